@@ -0,0 +1,99 @@
+"""
+Tracking of how active each chat is, used by the DogPicsBot to throttle
+unprompted replies on busy chats.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import time
+from array import array
+from typing import Callable, Hashable, List
+
+from cache import LRUCache
+
+
+def throttled_probability(
+    probability: float, messages: int, budget: float, replies: int = 0
+) -> float:
+    """
+    Scales down a reply probability so that, out of `messages` recent
+    messages of which `replies` were replied to, at most `budget` are
+    replied to: what is left of the budget is spread over the recent
+    messages, and nothing is replied to once it is spent.
+    """
+
+    remaining = budget - replies
+    if remaining <= 0:
+        return 0.0
+
+    if messages <= remaining:
+        return probability
+
+    return min(probability, remaining / messages)
+
+
+class ChatActivity:
+    """
+    Sliding-window message counter, one per chat. Every chat gets a ring
+    buffer of `buckets` counters, each one covering `window / buckets`
+    seconds, so counting the messages of the last `window` seconds takes
+    constant memory whatever the chat's message rate.
+
+    Only the `max_chats` most recently active chats are remembered; a
+    forgotten chat simply starts again with no recent messages.
+    """
+
+    __slots__ = ("window", "buckets", "bucket_width", "clock", "_chats")
+
+    def __init__(
+        self,
+        window: float = 600,
+        buckets: int = 10,
+        max_chats: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.window = window  # in seconds
+        self.buckets = buckets
+        self.bucket_width = window / buckets
+        self.clock = clock
+
+        # chat -> [index of the latest bucket, ring buffer of counters]
+        self._chats = LRUCache(max_chats)
+
+    def _advance(self, key: Hashable) -> List:
+        """
+        Returns the state of the given chat, with every bucket that fell out
+        of the window cleared.
+        """
+
+        current = int(self.clock() // self.bucket_width)
+        if key not in self._chats:
+            self._chats[key] = [current, array("I", [0]) * self.buckets]
+
+        state = self._chats[key]
+        latest, counters = state
+        for index in range(latest + 1, min(current, latest + self.buckets) + 1):
+            counters[index % self.buckets] = 0
+
+        state[0] = max(latest, current)
+        return state
+
+    def record(self, key: Hashable) -> int:
+        """
+        Records a message on the given chat, and returns how many messages
+        the chat got within the window (including this one).
+        """
+
+        latest, counters = self._advance(key)
+        counters[latest % self.buckets] += 1
+        return sum(counters)
+
+    def messages(self, key: Hashable) -> int:
+        """
+        Returns how many messages the given chat got within the window.
+        """
+
+        if key not in self._chats:
+            return 0
+
+        return sum(self._advance(key)[1])
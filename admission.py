@@ -0,0 +1,192 @@
+"""
+Admission control for the updates handled by the DogPicsBot, so that the
+bot sheds work instead of falling behind when a burst of updates (e.g. a
+raid on a group chat) arrives.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import sys
+from collections import Counter
+from typing import Callable, FrozenSet, List, Optional, Tuple
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Priorities of updates, from the most to the least important: commands and
+# inline queries (someone is waiting for them), messages on private chats,
+# and messages on group chats (which are only replied to on some triggers)
+COMMAND_PRIORITY = 0
+PRIVATE_CHAT_PRIORITY = 1
+GROUP_CHAT_PRIORITY = 2
+
+PRIORITY_NAMES: Tuple[str, ...] = ("commands", "private chats", "group chats")
+
+
+def get_command(message) -> Optional[str]:
+    """
+    Returns the (lowercase) command a message starts with, if any, as
+    Telegram marks it: with a bot command entity at the very beginning.
+    """
+
+    entities = getattr(message, "entities", None)
+    if not entities or entities[0].type != "bot_command" or entities[0].offset != 0:
+        return None
+
+    return message.text[1 : entities[0].length].split("@")[0].lower()
+
+
+def get_update_priority(update, commands: FrozenSet[str] = frozenset()) -> int:
+    """
+    Returns the priority of an update. Only the given commands (those the
+    bot handles) go first, so that floods of made-up commands are shed like
+    any other message.
+    """
+
+    if getattr(update, "inline_query", None) is not None:
+        return COMMAND_PRIORITY
+
+    message = getattr(update, "effective_message", None)
+    if message is None:
+        return PRIVATE_CHAT_PRIORITY
+
+    if get_command(message) in commands:
+        return COMMAND_PRIORITY
+
+    return PRIVATE_CHAT_PRIORITY if message.chat.type == "private" else GROUP_CHAT_PRIORITY
+
+
+class PriorityUpdateProcessor(BaseUpdateProcessor):
+    """
+    Update processor that handles up to `max_running` updates at the same
+    time, and keeps up to `max_waiting` more waiting for their turn, in
+    order of priority. When too many updates are waiting, the one with the
+    least priority (the most recent one, among equals) is dropped.
+
+    Every update gets here as soon as it arrives (the semaphore of the base
+    class is unbounded), so that admission is entirely decided here. If
+    given, `record` is called with every update before deciding, so that
+    dropped updates are recorded too.
+    """
+
+    def __init__(
+        self,
+        max_running: int,
+        max_waiting: int,
+        commands: FrozenSet[str] = frozenset(),
+        record: Optional[Callable] = None,
+    ):
+        super().__init__(sys.maxsize)
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.commands = commands
+        self.record = record
+
+        self.handled = 0
+        self.dropped: Counter = Counter()
+
+        self._running = 0
+        self._sequence = itertools.count()
+
+        # heap of (priority, sequence, future), the future is resolved to
+        # True when it's the update's turn, or to False if it is dropped
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []
+
+    @property
+    def waiting(self) -> int:
+        """
+        Amount of updates waiting for their turn.
+        """
+
+        return len(self._waiting)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        if self.record is not None:
+            self.record(update)
+
+        priority = get_update_priority(update, self.commands)
+
+        if self._running < self.max_running and not self._waiting:
+            self._running += 1
+        else:
+            try:
+                admitted = await self._wait_for_turn(priority)
+            except asyncio.CancelledError:
+                coroutine.close()
+                raise
+
+            if not admitted:
+                coroutine.close()
+                self.dropped[PRIORITY_NAMES[priority]] += 1
+                logger.debug("Dropped update %s with priority %d", update, priority)
+                return
+
+        try:
+            await coroutine
+        finally:
+            self.handled += 1
+            self._release()
+
+    async def _wait_for_turn(self, priority: int) -> bool:
+        """
+        Waits until a running update hands its slot over, returning True,
+        or until the update is dropped, returning False.
+        """
+
+        entry = (priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiting, entry)
+
+        if len(self._waiting) > self.max_waiting:
+            dropped = max(self._waiting)
+            self._waiting.remove(dropped)
+            heapq.heapify(self._waiting)
+            if not dropped[2].done():
+                dropped[2].set_result(False)
+
+        try:
+            return await entry[2]
+        except asyncio.CancelledError:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+            elif entry[2].done() and not entry[2].cancelled() and entry[2].result():
+                self._release()
+            raise
+
+    def _release(self):
+        """
+        Hands the slot of a finished update over to the waiting update with
+        the most priority, if any.
+        """
+
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():  # i.e. its update was not cancelled
+                future.set_result(True)
+                return
+
+        self._running -= 1
+
+    def describe(self) -> str:
+        """
+        Returns a human-readable summary of the updates handled, waiting
+        and dropped so far.
+        """
+
+        dropped = ", ".join(f"{name}: {self.dropped[name]}" for name in PRIORITY_NAMES)
+        return (
+            f"Updates handled: {self.handled}\n"
+            f"Updates waiting: {self.waiting}\n"
+            f"Updates dropped: {dropped}"
+        )
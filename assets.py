@@ -0,0 +1,288 @@
+"""
+Local bundle of the fox and wolf pictures sent by the DogPicsBot, so that
+they are served without any network I/O on each request.
+
+A build step (`python assets.py build`) downloads a fixed set of pictures
+into a local directory, compressing them if Pillow is installed, along with
+a manifest. Each bundled picture is uploaded to Telegram once per bot,
+either at startup or when first sent, and its `file_id` is recorded so that
+Telegram can resend it without the bot uploading it again.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import argparse
+import importlib
+import io
+import json
+import logging
+import os
+import random
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from startup import LazyModule
+
+telegram = LazyModule("telegram")
+
+logger = logging.getLogger(__name__)
+
+# src: https://gist.github.com/bcnzer/2e1e392e355dc95b7f3da98a0b2ade9d
+WOLF_PICTURES: Tuple[str, ...] = (
+    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf1.png",
+    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf2.png",
+    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf3.png",
+    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf4.png",
+    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf5.png",
+    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf6.png",
+    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf7.png",
+    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf8.png",
+    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf9.png",
+)
+
+# RandomFox numbers its pictures, so a fixed set of them can be bundled
+FOX_PICTURES: Tuple[str, ...] = tuple(
+    f"https://randomfox.ca/images/{number}.jpg" for number in range(1, 25)
+)
+
+# Pictures bundled by the build step, by category
+BUNDLED_PICTURES: Mapping[str, Tuple[str, ...]] = {"fox": FOX_PICTURES, "wolf": WOLF_PICTURES}
+
+MANIFEST_FILENAME = "manifest.json"
+FILE_IDS_FILENAME = "file_ids.json"
+
+# Errors (lowercase) of Telegram's Bot API that mean a recorded `file_id`
+# no longer works, so the picture has to be uploaded again
+FILE_ID_ERRORS: Tuple[str, ...] = ("wrong file identifier", "file reference expired")
+
+# Bundled pictures are scaled down to fit within this size (in pixels), and
+# saved as JPEG with this quality, when Pillow is installed
+MAX_PICTURE_SIZE = 1280
+PICTURE_QUALITY = 85
+
+
+def compress_picture(data: bytes) -> bytes:
+    """
+    Scales down and recompresses a picture as JPEG, if Pillow is installed
+    and doing so makes it smaller. Otherwise, returns it untouched.
+    """
+
+    try:
+        image_module = importlib.import_module("PIL.Image")
+    except ImportError:
+        return data
+
+    output = io.BytesIO()
+    with image_module.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((MAX_PICTURE_SIZE, MAX_PICTURE_SIZE))
+        image.save(output, "JPEG", quality=PICTURE_QUALITY, optimize=True)
+
+    compressed = output.getvalue()
+    return compressed if len(compressed) < len(data) else data
+
+
+def download(url: str) -> bytes:
+    """
+    Downloads the picture at the given URL.
+    """
+
+    response = importlib.import_module("requests").get(url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+
+def build_bundle(
+    directory: str,
+    sources: Optional[Mapping[str, Sequence[str]]] = None,
+    fetch: Callable[[str], bytes] = download,
+) -> Dict[str, List[str]]:
+    """
+    Downloads (and compresses) the pictures of every category (by default,
+    BUNDLED_PICTURES) into the given directory, and writes the manifest of
+    the bundle, which is also returned. Pictures that can't be downloaded
+    are left out.
+    """
+
+    sources = sources or BUNDLED_PICTURES
+    manifest: Dict[str, List[str]] = {}
+    for category, urls in sources.items():
+        os.makedirs(os.path.join(directory, category), exist_ok=True)
+        manifest[category] = []
+
+        for index, url in enumerate(urls):
+            try:
+                data = compress_picture(fetch(url))
+            except OSError as error:  # includes errors raised by requests
+                logger.warning("Could not bundle %s: %s", url, error)
+                continue
+
+            name = f"{category}/{index:02d}.jpg"
+            with open(os.path.join(directory, name), "wb") as picture:
+                picture.write(data)
+            manifest[category].append(name)
+
+    with open(os.path.join(directory, MANIFEST_FILENAME), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+
+    return manifest
+
+
+class AssetBundle:
+    """
+    Bundled pictures, read from the given directory (if it was built), and
+    the `file_id`s they got once uploaded to Telegram, recorded per bot
+    (`file_id`s can't be shared between bots) in the same directory.
+    """
+
+    __slots__ = ("directory", "_manifest", "_file_ids")
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._manifest: Optional[Dict[str, List[str]]] = None
+        self._file_ids: Optional[Dict[str, Dict[str, str]]] = None
+
+    def _read_json(self, filename: str) -> dict:
+        try:
+            with open(os.path.join(self.directory, filename), encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def pictures(self, category: str) -> List[str]:
+        """
+        Returns the names of the bundled pictures of the given category,
+        which is empty if the bundle was not built.
+        """
+
+        if self._manifest is None:
+            self._manifest = self._read_json(MANIFEST_FILENAME)
+
+        return self._manifest.get(category, [])
+
+    def file_id(self, namespace: str, name: str) -> Optional[str]:
+        """
+        Returns the `file_id` of a bundled picture for the given bot, if it
+        was uploaded already.
+        """
+
+        if self._file_ids is None:
+            self._file_ids = self._read_json(FILE_IDS_FILENAME)
+
+        return self._file_ids.get(namespace, {}).get(name)
+
+    def record_file_id(self, namespace: str, name: str, file_id: Optional[str]):
+        """
+        Records (or forgets, if None) the `file_id` of a bundled picture for
+        the given bot, and stores every `file_id` on disk.
+        """
+
+        self.file_id(namespace, name)  # loads the recorded file_ids
+        file_ids = self._file_ids.setdefault(namespace, {})
+        if file_id is None:
+            file_ids.pop(name, None)
+        else:
+            file_ids[name] = file_id
+
+        # a read-only bundle still works, it just uploads again on restarts
+        path = os.path.join(self.directory, FILE_IDS_FILENAME)
+        try:
+            with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+                json.dump(self._file_ids, file, indent=2)
+            os.replace(f"{path}.tmp", path)
+        except OSError as error:
+            logger.warning("Could not store the file_ids of the bundle: %s", error)
+
+    def read(self, name: str) -> bytes:
+        """
+        Returns the contents of a bundled picture.
+        """
+
+        with open(os.path.join(self.directory, name), "rb") as picture:
+            return picture.read()
+
+    async def send_picture(self, bot, namespace: str, name: str, **kwargs):
+        """
+        Sends a bundled picture through the given Telegram bot, by its
+        `file_id` if it was uploaded already, or uploading it (and recording
+        its `file_id`) otherwise. Returns the message sent.
+        """
+
+        file_id = self.file_id(namespace, name)
+        if file_id is not None:
+            try:
+                return await bot.send_photo(photo=file_id, **kwargs)
+            except telegram.error.BadRequest as error:
+                if not any(text in error.message.lower() for text in FILE_ID_ERRORS):
+                    raise
+
+                logger.info("The file_id of %s is no longer valid, uploading it again", name)
+                self.record_file_id(namespace, name, None)
+
+        message = await bot.send_photo(photo=self.read(name), **kwargs)
+        if message is not None and message.photo:
+            # the largest size comes last
+            self.record_file_id(namespace, name, message.photo[-1].file_id)
+
+        return message
+
+    async def send_random_picture(
+        self,
+        bot,
+        namespace: str,
+        category: str,
+        choose: Callable[[Sequence[str]], str] = random.choice,
+        **kwargs,
+    ):
+        """
+        Sends a random bundled picture (chosen through the given function) of
+        the given category through the given Telegram bot. Returns the
+        message sent.
+        """
+
+        name = choose(self.pictures(category))
+        return await self.send_picture(bot, namespace, name, **kwargs)
+
+    async def upload(self, bot, namespace: str, chat_id: int) -> int:
+        """
+        Uploads every bundled picture that the given bot did not upload
+        yet, by sending it to the given chat (and deleting it right after).
+        Returns how many pictures were uploaded.
+        """
+
+        uploaded = 0
+        for category in BUNDLED_PICTURES:
+            for name in self.pictures(category):
+                if self.file_id(namespace, name) is not None:
+                    continue
+
+                message = await self.send_picture(
+                    bot, namespace, name, chat_id=chat_id, disable_notification=True
+                )
+                await bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+                uploaded += 1
+
+        return uploaded
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Parses command line arguments and builds the bundle.
+    """
+
+    parser = argparse.ArgumentParser(description="Builds the bundle of fox and wolf pictures.")
+    parser.add_argument("command", choices=["build"], help="the step to run")
+    parser.add_argument(
+        "--directory",
+        default=os.environ.get("DPB_ASSETS_DIR", "assets"),
+        help="where to build the bundle (by default, DPB_ASSETS_DIR or assets)",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    manifest = build_bundle(args.directory)
+    for category, names in manifest.items():
+        print(f"{category}: {len(names)} pictures bundled")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
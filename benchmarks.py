@@ -0,0 +1,506 @@
+"""
+Benchmarks for the DogPicsBot, meant to be run locally to compare the
+performance of different versions of the bot. None of them reach the
+network.
+
+Usage: python benchmarks.py <benchmark> [options]
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+# Breeds returned by the Dog API at the time of writing, roughly. Used so
+# that benchmarks work with realistically sized data without the network
+SAMPLE_BREEDS = (
+    "affenpinscher african airedale akita appenzeller australian basenji beagle bluetick "
+    "borzoi bouvier boxer brabancon briard buhund bulldog bullterrier cattledog chihuahua "
+    "chow clumber cockapoo collie coonhound corgi cotondetulear dachshund dalmatian dane "
+    "deerhound dhole dingo doberman elkhound entlebucher eskimo finnish frise germanshepherd "
+    "greyhound groenendael havanese hound husky keeshond kelpie komondor kuvasz labradoodle "
+    "labrador leonberg lhasa malamute malinois maltese mastiff mexicanhairless mix mountain "
+    "newfoundland otterhound ovcharka papillon pekinese pembroke pinscher pitbull pointer "
+    "pomeranian poodle pug puggle pyrenees redbone retriever ridgeback rottweiler saluki "
+    "samoyed schipperke schnauzer segugio setter sharpei sheepdog shiba shihtzu spaniel "
+    "spitz springer stbernard terrier tervuren vizsla waterdog weimaraner whippet wolfhound"
+).split()
+
+# Measured within a fresh interpreter, so that numbers are not affected
+# by whatever the benchmark runner imported
+WORKER_RSS_SCRIPT = """
+import json, os, sys
+import bot
+instance = bot.DogPicsBot()
+instance.resources.breeds = list(sys.argv[1].split())
+with open("/proc/self/status") as status:
+    rss = next(int(line.split()[1]) for line in status if line.startswith("VmRSS"))
+print(json.dumps({"worker_rss_kib": rss}))
+"""
+
+
+def get_bot_class():
+    """
+    Imports and returns the bot class, making sure it can be instantiated.
+    """
+
+    os.environ.setdefault("DPB_TG_TOKEN", "BENCHMARK_TOKEN")
+
+    # pylint: disable=import-outside-toplevel
+    from bot import DogPicsBot
+
+    return DogPicsBot
+
+
+def measure_instance_memory(instances: int) -> dict:
+    """
+    Creates several bot instances and returns how much memory (in bytes)
+    each instance takes on average, as traced by tracemalloc.
+    """
+
+    bot_class = get_bot_class()
+
+    # the first instance pays for lazily built, shared data
+    warmup = bot_class()
+    del warmup
+    gc.collect()
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    bots = [bot_class() for _ in range(instances)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"instances": len(bots), "bytes_per_instance": (after - before) // instances}
+
+
+def measure_worker_rss() -> dict:
+    """
+    Returns the resident memory of a fresh worker process that has created
+    a bot instance (Linux only).
+    """
+
+    env = dict(os.environ, DPB_TG_TOKEN=os.environ.get("DPB_TG_TOKEN", "BENCHMARK_TOKEN"))
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER_RSS_SCRIPT, " ".join(SAMPLE_BREEDS)],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    return json.loads(output)
+
+
+def benchmark_memory(args: argparse.Namespace) -> dict:
+    """
+    Memory benchmark: per-instance memory of the bot, and per-worker RSS.
+    """
+
+    results = measure_instance_memory(args.instances)
+    if sys.platform.startswith("linux"):
+        results.update(measure_worker_rss())
+
+    return results
+
+
+def latency_report(latencies: List[float]) -> dict:
+    """
+    Returns the percentiles (and the maximum) of the given latencies, in
+    milliseconds.
+    """
+
+    if not latencies:
+        return {}
+
+    latencies = sorted(latencies)
+    report = {
+        f"p{percentile}": latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)]
+        for percentile in (50, 90, 99)
+    }
+    report["max"] = latencies[-1]
+    return {name: round(latency * 1000, 3) for name, latency in report.items()}
+
+
+def build_replay_bot(telegram_latency: float = 0.0, upstream_latency: float = 0.0, seed: int = 0):
+    """
+    Returns a bot that is ready to handle updates while talking to fake
+    Telegram and upstream APIs (with the given latencies, in seconds),
+    along with both fakes. The bot's random decisions follow the given
+    seed, so that replays are reproducible.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from bot import DogPicsBot
+    from chatsettings import ChatSettingsStore
+    from fakes import FakeTelegramRequest, FakeUpstreamSession
+    from randomness import RandomSource
+    from resources import SharedResources
+    from upstream import UpstreamClient
+
+    telegram_request = FakeTelegramRequest(telegram_latency)
+    upstream_session = FakeUpstreamSession(list(SAMPLE_BREEDS), upstream_latency)
+    resources = SharedResources(UpstreamClient(session=upstream_session))
+
+    bot = DogPicsBot("123456:REPLAY", resources, RandomSource(seed))
+    bot.chat_settings = ChatSettingsStore(":memory:", namespace="replay")
+    bot.recorder = None
+    bot.build_application(telegram_request)
+    bot.fetch_breeds()
+    bot.register_handlers()
+
+    return bot, telegram_request, upstream_session
+
+
+async def handle_recording(application, path: str, realtime: bool, speed: float) -> List[float]:
+    """
+    Streams a recording of updates through the handlers of the given
+    application, either as fast as possible or at the original timing (sped
+    up by `speed`), and returns how long handling every update took.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import telegram
+
+    from recorder import read_recording
+
+    latencies = []
+    first_received_at = None
+    started_at = time.perf_counter()
+    for received_at, data in read_recording(path):
+        if realtime:
+            if first_received_at is None:
+                first_received_at = received_at
+            due_at = (received_at - first_received_at) / speed
+            await asyncio.sleep(max(0.0, due_at - (time.perf_counter() - started_at)))
+
+        update = telegram.Update.de_json(data, application.bot)
+        handling_started_at = time.perf_counter()
+        await application.process_update(update)
+        latencies.append(time.perf_counter() - handling_started_at)
+
+    return latencies
+
+
+async def replay_recording(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    path: str,
+    realtime: bool = False,
+    speed: float = 1.0,
+    telegram_latency: float = 0.0,
+    upstream_latency: float = 0.0,
+    seed: int = 0,
+) -> dict:
+    """
+    Replays a recording of updates through the real handlers of a bot that
+    talks to fake Telegram and upstream APIs, and returns throughput and
+    latency figures.
+    """
+
+    bot, telegram_request, upstream_session = build_replay_bot(
+        telegram_latency, upstream_latency, seed
+    )
+    await bot.application.initialize()
+
+    started_at = time.perf_counter()
+    try:
+        latencies = await handle_recording(bot.application, path, realtime, speed)
+    finally:
+        await bot.application.shutdown()
+    elapsed = time.perf_counter() - started_at
+
+    return {
+        "updates": len(latencies),
+        "elapsed_seconds": round(elapsed, 3),
+        "updates_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": latency_report(latencies),
+        "telegram_requests": dict(telegram_request.calls),
+        "upstream_requests": dict(upstream_session.requests),
+    }
+
+
+def benchmark_replay(args: argparse.Namespace) -> dict:
+    """
+    Replay benchmark: throughput and latency of the bot handling recorded
+    traffic.
+    """
+
+    return asyncio.run(
+        replay_recording(
+            args.recording,
+            realtime=args.realtime,
+            speed=args.speed,
+            telegram_latency=args.telegram_latency / 1000,
+            upstream_latency=args.upstream_latency / 1000,
+            seed=args.seed,
+        )
+    )
+
+
+# Words that messages are made of, along with breeds and triggers, for
+# the triggers benchmark
+SAMPLE_WORDS = (
+    "the a my your this that is was so very really just look at me here there what "
+    "today yesterday photo picture cute little big happy love please send another one "
+    "hola mira que lindo mi tu este esta foto hoy ayer por favor otra vez"
+).split()
+
+
+def make_trigger_pack(seed: int, triggers_per_category: int = 10) -> dict:
+    """
+    Returns a made-up trigger pack, with random words (of 3 to 10 letters)
+    as triggers of every category.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from triggers import TRIGGER_CATEGORIES
+
+    generator = random.Random(seed)
+
+    def word() -> str:
+        return "".join(generator.choices(string.ascii_lowercase, k=generator.randint(3, 10)))
+
+    triggers = {
+        category: [word() for _ in range(triggers_per_category)] for category in TRIGGER_CATEGORIES
+    }
+    return {"name": f"Pack {seed}", "triggers": triggers}
+
+
+def make_messages(count: int, triggers: List[str], seed: int = 0) -> List[List[str]]:
+    """
+    Returns made-up messages (as lists of words) of 4 to 16 words, mostly
+    made of common words and breeds, and a few triggers.
+    """
+
+    generator = random.Random(seed)
+    vocabulary = SAMPLE_WORDS + list(SAMPLE_BREEDS)
+    messages = []
+    for _ in range(count):
+        words = generator.choices(vocabulary, k=generator.randint(4, 16))
+        if generator.random() < 0.2:
+            words.append(generator.choice(triggers) + "s")
+        messages.append(words)
+
+    return messages
+
+
+def time_per_message(match: Callable, messages: List[List[str]], rounds: int) -> float:
+    """
+    Returns how long matching a message takes on average, in microseconds.
+    """
+
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        for words in messages:
+            match(words)
+
+    return round((time.perf_counter() - started_at) / (rounds * len(messages)) * 1e6, 3)
+
+
+def measure_trigger_matching(locations: tuple, messages: List[List[str]], rounds: int) -> dict:
+    """
+    Compiles the trigger packs at the given locations and measures how long
+    matching a message takes, both through the compiled matcher and through
+    a scan over every trigger (i.e. what matching cost before compiling).
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from triggers import find_trigger_packs, load_trigger_matcher, read_trigger_pack
+
+    packs = find_trigger_packs(locations)
+    triggers: Dict[str, List[str]] = {}
+    for path in packs:
+        for category, category_triggers in read_trigger_pack(path).items():
+            triggers.setdefault(category, []).extend(category_triggers)
+
+    def scan(words):
+        return {
+            category
+            for category, category_triggers in triggers.items()
+            if any(word.startswith(trigger) for word in words for trigger in category_triggers)
+        }
+
+    started_at = time.perf_counter()
+    matcher = load_trigger_matcher.__wrapped__(locations)  # not cached, to time it
+    compile_ms = (time.perf_counter() - started_at) * 1000
+
+    return {
+        "packs": len(packs),
+        "triggers": sum(len(category_triggers) for category_triggers in triggers.values()),
+        "prefix_lengths": len(matcher.prefix_lengths),
+        "compile_ms": round(compile_ms, 3),
+        "matcher_us_per_message": time_per_message(matcher.match, messages, rounds),
+        "scan_us_per_message": time_per_message(scan, messages, rounds),
+    }
+
+
+def benchmark_triggers(args: argparse.Namespace) -> dict:
+    """
+    Triggers benchmark: cost of matching messages with the built-in trigger
+    packs only, and with many more (made-up) packs loaded.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from triggers import BUILTIN_TRIGGER_PACKS
+
+    with tempfile.TemporaryDirectory() as directory:
+        pack_triggers = []
+        for seed in range(args.packs):
+            pack = make_trigger_pack(seed)
+            pack_triggers.extend(pack["triggers"]["dog"])
+            with open(
+                os.path.join(directory, f"pack-{seed:02d}.json"), "w", encoding="utf-8"
+            ) as file:
+                json.dump(pack, file)
+
+        messages = make_messages(args.messages, pack_triggers + ["dog", "lobo", "sad"])
+        return {
+            "builtin": measure_trigger_matching((BUILTIN_TRIGGER_PACKS,), messages, args.rounds),
+            "with_packs": measure_trigger_matching(
+                (BUILTIN_TRIGGER_PACKS, directory), messages, args.rounds
+            ),
+        }
+
+
+async def send_concurrently(settings, api_url: str, sends: int) -> dict:
+    """
+    Sends the given amount of pictures at the same time through a Telegram
+    bot whose HTTP client has the given settings, talking to the Bot API at
+    the given URL, and reports how long it took, how many sends timed out
+    waiting for a connection, and the latency of the rest.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import telegram
+
+    latencies: List[float] = []
+    timeouts = 0
+
+    async def send(bot):
+        nonlocal timeouts
+        started_at = time.perf_counter()
+        try:
+            await bot.send_photo(chat_id=1, photo="https://images.dog.ceo/breeds/pug/1.jpg")
+        except telegram.error.TimedOut:
+            timeouts += 1
+            return
+        latencies.append(time.perf_counter() - started_at)
+
+    bot = telegram.Bot(
+        "123456:BENCHMARK", base_url=f"{api_url}/bot", request=settings.build_request()
+    )
+    async with bot:
+        started_at = time.perf_counter()
+        await asyncio.gather(*(send(bot) for _ in range(sends)))
+        elapsed = time.perf_counter() - started_at
+
+    return {
+        "sends_per_second": round(len(latencies) / elapsed, 1),
+        "timeouts": timeouts,
+        "latency_ms": latency_report(latencies),
+    }
+
+
+def benchmark_concurrency(args: argparse.Namespace) -> dict:
+    """
+    Concurrency benchmark: throughput of concurrent sends through the Bot
+    API client, as configured through the environment, for every given
+    pool size, against a local fake Bot API.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from dataclasses import replace
+
+    from fakes import FakeTelegramServer
+    from telegramclient import get_request_settings
+
+    settings = get_request_settings()
+    if args.http_version:
+        settings = replace(settings, http_version=args.http_version)
+
+    results = {"http_version": settings.effective_http_version}
+    with FakeTelegramServer(latency=args.telegram_latency / 1000) as server:
+        for pool_size in args.pool_sizes:
+            connections = server.connections
+            report = asyncio.run(
+                send_concurrently(replace(settings, pool_size=pool_size), server.url, args.sends)
+            )
+            report["connections"] = server.connections - connections
+            results[f"pool_size_{pool_size}"] = report
+
+    return results
+
+
+BENCHMARKS = {
+    "memory": benchmark_memory,
+    "replay": benchmark_replay,
+    "triggers": benchmark_triggers,
+    "concurrency": benchmark_concurrency,
+}
+
+
+def main(argv=None):
+    """
+    Parses command line arguments and runs the chosen benchmark, printing
+    its results as JSON.
+    """
+
+    parser = argparse.ArgumentParser(description="Benchmarks for the DogPicsBot.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    memory_parser = subparsers.add_parser("memory", help="memory used per bot and per worker")
+    memory_parser.add_argument("--instances", type=int, default=1000)
+
+    replay_parser = subparsers.add_parser("replay", help="replay a recording of updates")
+    replay_parser.add_argument("recording", help="path to a recording (see DPB_RECORD_UPDATES)")
+    replay_parser.add_argument(
+        "--realtime", action="store_true", help="replay at the original timing"
+    )
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="realtime speed-up")
+    replay_parser.add_argument(
+        "--telegram-latency", type=float, default=0.0, help="fake Telegram latency (ms)"
+    )
+    replay_parser.add_argument(
+        "--upstream-latency", type=float, default=0.0, help="fake Dog API latency (ms)"
+    )
+    replay_parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the bot's random decisions"
+    )
+
+    triggers_parser = subparsers.add_parser("triggers", help="matching cost with many packs")
+    triggers_parser.add_argument("--packs", type=int, default=24, help="made-up packs to load")
+    triggers_parser.add_argument("--messages", type=int, default=2000)
+    triggers_parser.add_argument("--rounds", type=int, default=5)
+
+    concurrency_parser = subparsers.add_parser(
+        "concurrency", help="concurrent sends through the Bot API client"
+    )
+    concurrency_parser.add_argument("--sends", type=int, default=200)
+    concurrency_parser.add_argument(
+        "--pool-sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[1, 16, 256],
+        help="comma-separated pool sizes to compare",
+    )
+    concurrency_parser.add_argument("--http-version", choices=["1.1", "2"])
+    concurrency_parser.add_argument(
+        "--telegram-latency", type=float, default=50.0, help="fake Telegram latency (ms)"
+    )
+
+    args = parser.parse_args(argv)
+    results = BENCHMARKS[args.benchmark](args)
+    print(json.dumps({args.benchmark: results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
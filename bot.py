@@ -9,38 +9,68 @@ Every picture is fetched through the Dog API (https://dog.ceo/dog-api/).
 @author Andrés Ignacio Torres <dev@aitorres.com>
 """
 
+# Imported before anything else, so that the origin of the startup timer
+# comes before the time spent importing every other module
+from startup import STARTUP_TIMER, LazyModule  # isort: skip  # pylint: disable=wrong-import-order
+
+import argparse
+import asyncio
 import logging
+import math
 import os
-import random
-from typing import List
+import signal
+from typing import FrozenSet, List, Optional, Tuple
 
-import requests
-from dotenv import load_dotenv
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from activity import ChatActivity, throttled_probability
+from assets import WOLF_PICTURES
+from botprofiling import PROFILER
+from chatsettings import ChatSettingsStore, ReplyCooldowns, parse_setting
+from hosting import get_tokens, run_bots
+from randomness import ChoiceTable, RandomSource, get_random_source
+from ratelimit import TokenBucketRateLimiter
+from resources import SharedResources, get_mentioned_breed
+from triggers import get_trigger_pack_locations, load_trigger_matcher
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.DEBUG
-)
+admission = LazyModule("admission")
+dotenv = LazyModule("dotenv")
+telegram = LazyModule("telegram")
+telegram_ext = LazyModule("telegram.ext")
+telegramclient = LazyModule("telegramclient")
+
+logger = logging.getLogger(__name__)
+
+
+def configure_logging():
+    """
+    Sets up the format and level of the bot's logs. Only meant to be
+    called when running the bot, never at import time.
+    """
+
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.DEBUG
+    )
 
 
 TELEGRAM_CHAT_TYPE_GROUP: str = "group"
 TELEGRAM_CHAT_TYPE_SUPERGROUP: str = "supergroup"
-TELEGRAM_GROUP_CHAT_TYPES: List[str] = [
-    TELEGRAM_CHAT_TYPE_GROUP,
-    TELEGRAM_CHAT_TYPE_SUPERGROUP,
-]
+TELEGRAM_GROUP_CHAT_TYPES: FrozenSet[str] = frozenset(
+    {
+        TELEGRAM_CHAT_TYPE_GROUP,
+        TELEGRAM_CHAT_TYPE_SUPERGROUP,
+    }
+)
 
 
-DOG_SOUNDS: List[str] = [
+DOG_SOUNDS: Tuple[str, ...] = (
     "Woof woof!",
     "Bark!",
     "Awoooo!",
     "Awroooo!",
     "Bark bark!",
     "Grrr!",
-]
+)
 
-FOX_SOUNDS: List[str] = [
+FOX_SOUNDS: Tuple[str, ...] = (
     "Grrr!",
     "Yip Yip!",
     "Ring-ding-ding-ding-dingeringeding!",
@@ -51,135 +81,95 @@ FOX_SOUNDS: List[str] = [
     "Fraka-kaka-kaka-kaka-kow!",
     "A-hee-ahee ha-hee!",
     "A-oo-oo-oo-ooo!",
-]
-
-
-DOGS_API_DOG_PICTURE_URL: str = "https://dog.ceo/api/breeds/image/random"
-DOGS_API_SPECIFIC_BREED_DOG_PICTURE_URL: str = "https://dog.ceo/api/breed/{0}/images/random"
-DOGS_API_BREED_LIST_URL: str = "https://dog.ceo/api/breeds/list/all"
-
-RANDOMFOX_API_URL: str = "https://randomfox.ca/floof/"
-
-
-# src: https://gist.github.com/bcnzer/2e1e392e355dc95b7f3da98a0b2ade9d
-WOLF_PICTURES: List[str] = [
-    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf1.png",
-    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf2.png",
-    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf3.png",
-    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf4.png",
-    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf5.png",
-    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf6.png",
-    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf7.png",
-    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf8.png",
-    "https://wolftracker9eee.blob.core.windows.net/wolfpictures-mock/wolf9.png",
-]
-
-
-def get_mentioned_breed(breeds, words):
-    """
-    Given a list of breeds and a list of words,
-    checks if any breed appears within the list of words
-    and returns the first successful case if so
-    """
+)
 
-    for breed in breeds:
-        # the breed might be directly mentioned
-        # or it can be a substring (like)
-        for word in words:
-            if breed in word:
-                return breed
+# Errors (lowercase) of Telegram's Bot API that mean a picture URL can't be
+# sent, as opposed to e.g. the message to reply to being gone
+PICTURE_ERRORS: Tuple[str, ...] = (
+    "wrong file identifier/http url specified",
+    "failed to get http url content",
+    "wrong type of the web page content",
+)
 
-    return None
+# Sounds and pictures to choose from, precomputed once
+DOG_SOUND_CHOICES = ChoiceTable(DOG_SOUNDS)
+FOX_SOUND_CHOICES = ChoiceTable(FOX_SOUNDS)
+WOLF_PICTURE_CHOICES = ChoiceTable(WOLF_PICTURES)
 
 
-class DogPicsBot:
+class DogPicsBot:  # pylint: disable=too-many-public-methods,too-many-instance-attributes
     """
     A class to encapsulate all relevant methods of the Dog Pics
     Telegram bot.
     """
 
-    REQUESTS_TIMEOUT = 10  # in seconds
-
-    def __init__(self):
+    # Immutable configuration (triggers, sounds, pictures) is compiled once
+    # and shared, so instances only hold their own mutable state
+    __slots__ = (
+        "activity",
+        "application",
+        "chat_settings",
+        "cooldowns",
+        "rate_limiter",
+        "recorder",
+        "resources",
+        "rng",
+        "sad_message_response_probability",
+        "sad_replies",
+        "token",
+        "trigger_matcher",
+    )
+
+    # Commands handled by the bot (see `register_handlers`), whose updates
+    # are handled before any other message
+    COMMANDS: FrozenSet[str] = frozenset(
+        {"start", "help", "dog", "settings", "set", "profile", "stats"}
+    )
+
+    # How long (in seconds) Telegram may cache each answer to an inline query
+    INLINE_CACHE_TIME = 300
+
+    # Most pictures a single /dog command may ask for (Telegram albums hold
+    # up to 10 pictures), and the per-chat picture budget of the command:
+    # up to PICTURE_BURST pictures at once, regained at PICTURE_RATE per second
+    DOG_COMMAND_MAX_PICTURES = 10
+    PICTURE_BURST = 20
+    PICTURE_RATE = 20 / 60
+
+    # Most updates handled at the same time, and most updates waiting for
+    # their turn before the least important ones are dropped
+    MAX_RUNNING_UPDATES = 16
+    MAX_WAITING_UPDATES = 256
+
+    # Most sad messages the bot replies to on a chat within SAD_REPLY_WINDOW
+    # seconds: the more sad messages, the less likely a reply
+    SAD_REPLY_BUDGET = 5
+    SAD_REPLY_WINDOW = 600
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        resources: Optional[SharedResources] = None,
+        rng: Optional[RandomSource] = None,
+    ):
         """
         Constructor of the class. Initializes certain instance variables
         and checks if everything's O.K. for the bot to work as expected.
+
+        The token is read from the environment unless given, and resources
+        are only shared with other bots if given. Random decisions are made
+        through the given source, or one of the bot's own otherwise.
         """
 
         # Load environment variables
-        load_dotenv()
-
-        self.dog_emojis = [
-            "🐶",
-            "🐕",
-            "🐩",
-            "🌭",
-            "🦮",
-            "🦴",
-            "🐾",
-        ]
-
-        # These will be checked against as substrings within each
-        # message, so different variations are not required if their
-        # radix is present (e.g. "pup" covers "puppy" and "pupper" too)
-        self.dog_triggers = [
-            "woof",
-            "bark",
-            "pup",
-            "dog",
-            "perr",
-            "lomito",
-            "pooch",
-        ] + self.dog_emojis
-
-        # Just like dog triggers, these will be checked against
-        # as substrings, variations are not required
-        self.fox_triggers = [
-            "🦊",
-            "zorr",
-            "fox",
-            "vixen",
-            "fennec",
-        ]
+        dotenv.load_dotenv()
 
-        # Same as earlier triggers, but for sad messages
-        self.sad_spanish_triggers = [
-            "triste",
-            "afligido",
-            "lloro",
-            "deprimido",
-            "tusa",
-            "despech",  # despechado, despechada, despecho
-        ]
-
-        self.sad_triggers = [
-            "😔",
-            "😞",
-            "😢",
-            "😭",
-            "😓",
-            "😫",
-            "💔",
-            "sad",
-            "bad",
-            "unhappy",
-            "depressed",
-            "miserable",
-            "downhearted",
-        ] + self.sad_spanish_triggers
-
-        # And again, for wolves. I promise this is the last animal to be
-        # introduced to the bot.
-        self.wolf_triggers = [
-            "🐺",
-            "lobo",
-            "wolf",
-            "wolves",
-            "howl",
-        ]
+        # Every trigger pack, compiled once into a matcher for both text
+        # messages and stickers, which is shared by every instance
+        self.trigger_matcher = load_trigger_matcher(get_trigger_pack_locations())
 
         # This environment variable should be set before using the bot
-        self.token = os.environ.get("DPB_TG_TOKEN")
+        self.token = token or os.environ.get("DPB_TG_TOKEN")
 
         # Stops runtime if the token has not been set properly
         if not self.token:
@@ -195,71 +185,262 @@ class DogPicsBot:
             os.environ.get("DPB_SAD_MESSAGE_RESPONSE_PROBABILITY", 1.0)
         )
 
-        # Fetches list of dog breeds from the Dogs API
-        self.fetch_breeds()
+        # Set up by the startup pipeline, so that creating an instance does
+        # not touch the network
+        self.application = None
 
-        # Instantiates the bot application
-        self.application = Application.builder().token(self.token).build()
+        self.resources = resources or SharedResources()
+
+        # Settings of every chat, read from memory while handling messages
+        self.chat_settings = ChatSettingsStore(
+            os.environ.get("DPB_SETTINGS_DB", "dogpicsbot.sqlite3"),
+            namespace=self.token.split(":")[0],
+        )
+        self.cooldowns = ReplyCooldowns()
+
+        # Seeded through the environment variable DPB_RANDOM_SEED, if set,
+        # along with the bot's ID so that bots don't follow the same path
+        self.rng = rng or get_random_source().spawn(self.chat_settings.namespace)
+
+        # Sad messages got by each chat, and sad messages replied to, within
+        # the last SAD_REPLY_WINDOW seconds
+        self.activity = ChatActivity(self.SAD_REPLY_WINDOW)
+        self.sad_replies = ChatActivity(self.SAD_REPLY_WINDOW)
+
+        # Every picture asked for through /dog is charged to the chat
+        self.rate_limiter = TokenBucketRateLimiter(self.PICTURE_BURST, self.PICTURE_RATE)
+
+        # Incoming updates are only recorded (redacted) if a path is given
+        # through the environment variable DPB_RECORD_UPDATES, into a single
+        # recording shared by every bot sharing these resources
+        self.recorder = self.resources.recorder
+
+    def build_application(self, request=None):
+        """
+        Instantiates the Telegram bot application, optionally with a custom
+        request object to send messages through. Updates are always polled
+        through a separate client, with a pool of its own.
+        """
+
+        # Updates are handled concurrently, with admission control so that
+        # bursts of updates are shed instead of piling up. Updates are
+        # recorded (if asked to) as they arrive, including those shed
+        update_processor = admission.PriorityUpdateProcessor(
+            self.MAX_RUNNING_UPDATES,
+            self.MAX_WAITING_UPDATES,
+            self.COMMANDS,
+            record=self.record_update if self.recorder is not None else None,
+        )
+        builder = (
+            telegram_ext.Application.builder()
+            .token(self.token)
+            .concurrent_updates(update_processor)
+        )
+        # Requests go through HTTP clients whose connection pools, timeouts
+        # and HTTP version are set through the environment (unless a request
+        # object is given to send messages through)
+        request = request or telegramclient.get_request_settings().build_request()
+        updates_request = telegramclient.get_updates_request_settings().build_request()
+        builder = builder.request(request).get_updates_request(updates_request)
+
+        # Telegram's Bot API can be swapped (e.g. for a fake server on tests)
+        api_url = os.environ.get("DPB_TG_API_URL")
+        if api_url:
+            builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+
+        self.application = builder.post_init(self.post_init).build()
+
+    @property
+    def breeds(self) -> List[str]:
+        """
+        The list of searchable breeds.
+        """
+
+        return self.resources.breeds
 
     def fetch_breeds(self):
         """
         Fetches and stores in memory the list of searchable breeds.
         """
 
-        response = requests.get(url=DOGS_API_BREED_LIST_URL, timeout=self.REQUESTS_TIMEOUT)
-        response_body = response.json()
-        self.breeds = list(response_body["message"])
+        self.resources.load_breeds()
+
+    def load_chat_settings(self):
+        """
+        Loads the settings of every chat that customized them.
+        """
+
+        self.chat_settings.preload()
+
+    async def post_init(self, application):
+        """
+        Runs once the application is initialized, within its event loop:
+        fills the image pool, uploads the bundled pictures in the background
+        (if DPB_ASSETS_CHAT_ID is set), and lets the process be profiled on
+        SIGUSR1.
+        """
+
+        await self.prewarm_image_pool(application)
+
+        assets_chat_id = os.environ.get("DPB_ASSETS_CHAT_ID")
+        if assets_chat_id:
+            application.create_task(
+                self.resources.assets.upload(
+                    application.bot, self.chat_settings.namespace, int(assets_chat_id)
+                )
+            )
+
+        try:
+            loop = asyncio.get_running_loop()
+            loop.add_signal_handler(signal.SIGUSR1, self.profile_on_signal)
+        except (AttributeError, NotImplementedError, RuntimeError):  # pragma: no cover
+            logger.warning("Could not add a handler for SIGUSR1, profiling is command-only")
+
+    async def prewarm_image_pool(self, _application):
+        """
+        Fills the image pool before the first inline query arrives.
+        """
+
+        await self.resources.image_pool.prewarm()
+        STARTUP_TIMER.mark("image_pool_prewarmed")
 
-    def run_bot(self):
+    def register_handlers(self):
         """
-        Sets up the required bot handlers and starts the polling
-        thread in order to successfully reply to messages.
+        Sets up the required bot handlers in order to successfully
+        reply to messages.
         """
 
         # Declares and adds handlers for commands that shows help info
-        start_handler = CommandHandler("start", self.show_help)
-        help_handler = CommandHandler("help", self.show_help)
+        start_handler = telegram_ext.CommandHandler("start", self.show_help)
+        help_handler = telegram_ext.CommandHandler("help", self.show_help)
         self.application.add_handler(start_handler)
         self.application.add_handler(help_handler)
 
-        # Declares and adds a handler to send a dog picture on demand
-        dog_handler = CommandHandler("dog", self.send_dog_picture)
+        # Declares and adds a handler to send dog pictures on demand
+        dog_handler = telegram_ext.CommandHandler("dog", self.handle_dog_command)
         self.application.add_handler(dog_handler)
 
+        # Declares and adds handlers for commands to show and change the
+        # settings of a chat
+        settings_handler = telegram_ext.CommandHandler("settings", self.show_settings)
+        set_handler = telegram_ext.CommandHandler("set", self.change_settings)
+        self.application.add_handler(settings_handler)
+        self.application.add_handler(set_handler)
+
+        # Declares and adds handlers for bot admins to profile the bot, and
+        # to see how many updates it handled and dropped
+        profile_handler = telegram_ext.CommandHandler("profile", self.handle_profile_command)
+        stats_handler = telegram_ext.CommandHandler("stats", self.show_stats)
+        self.application.add_handler(profile_handler)
+        self.application.add_handler(stats_handler)
+
         # Declares and adds a handler for text messages that will reply with
         # a dog pic if either the message comes from a personal chat
         # or includes a trigger word
-        text_handler = MessageHandler(filters.TEXT, self.handle_text_messages)
+        text_handler = telegram_ext.MessageHandler(
+            telegram_ext.filters.TEXT, self.handle_text_messages
+        )
         self.application.add_handler(text_handler)
 
         # Declares and adds a handler for stickers that will reply with
         # a dog pic if the sticker is dog-related
-        sticker_handler = MessageHandler(filters.Sticker.ALL, self.handle_stickers)
+        sticker_handler = telegram_ext.MessageHandler(
+            telegram_ext.filters.Sticker.ALL, self.handle_stickers
+        )
         self.application.add_handler(sticker_handler)
 
+        # Declares and adds a handler for inline queries, that will reply
+        # with a grid of dog pictures (of the mentioned breed, if any)
+        inline_handler = telegram_ext.InlineQueryHandler(self.handle_inline_query)
+        self.application.add_handler(inline_handler)
+
+    def startup(self, measure_startup: bool = False):
+        """
+        Runs the startup pipeline: builds the application, fetches the
+        list of breeds and registers the handlers, timing every step.
+
+        If `measure_startup` is set, the bot stops right after handling
+        its first update and prints a startup report.
+        """
+
+        STARTUP_TIMER.mark("startup_began")
+
+        steps = (
+            self.build_application,
+            self.fetch_breeds,
+            self.load_chat_settings,
+            self.register_handlers,
+        )
+        for step in steps:
+            with STARTUP_TIMER.step(step.__name__):
+                step()
+
+        if measure_startup:
+            # Handlers on a later group run once the regular handlers are done
+            # with the update, so this measures time to first update *handled*
+            first_update_handler = telegram_ext.TypeHandler(
+                telegram.Update, self.report_first_update
+            )
+            self.application.add_handler(first_update_handler, group=1)
+
+    def run_bot(self, measure_startup: bool = False):
+        """
+        Runs the startup pipeline and starts the polling thread in order
+        to successfully reply to messages.
+        """
+
+        self.startup(measure_startup)
+
         # Fires up the polling thread. We're live!
         self.application.run_polling()
+        self.close()
+
+    def close(self):
+        """
+        Releases what the bot holds once it stopped running, i.e. flushes
+        the recording of updates.
+        """
+
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def record_update(self, update):
+        """
+        Appends an incoming update to the recording.
+        """
+
+        self.recorder.record(update.to_dict())
+
+    async def report_first_update(self, _update, context):
+        """
+        Records the time it took to handle the first update, prints the
+        startup report and stops the bot.
+        """
+
+        STARTUP_TIMER.mark("first_update_handled")
+        print(STARTUP_TIMER.report())
+        context.application.stop_running()
 
     def get_random_dog_sound(self):
         """
         Randomly return a phrase similar to that of barking.
         """
 
-        return random.choice(DOG_SOUNDS)
+        return self.rng.choice(DOG_SOUND_CHOICES)
 
     def get_random_fox_sound(self):
         """
         Randomly return a phrase similar to that of Ding-ding-ding-ding.
         """
 
-        return random.choice(FOX_SOUNDS)
+        return self.rng.choice(FOX_SOUND_CHOICES)
 
     def get_random_wolf_picture(self):
         """
         Randomly return a link to a wolf's picture.
         """
 
-        return random.choice(WOLF_PICTURES)
+        return self.rng.choice(WOLF_PICTURE_CHOICES)
 
     async def show_help(self, update, context):
         """
@@ -273,72 +454,336 @@ class DogPicsBot:
         )
         await context.bot.send_message(chat_id=update.message.chat_id, text=help_msg)
 
+    def choose_reply(self, words, is_personal_chat, mentions_a_breed, settings):
+        """
+        Decides what a text message should be replied with, if anything,
+        returning one of "fox", "wolf", "sad" or "dog", or None.
+        """
+
+        # Every kind of trigger is checked at once, ignoring the animals
+        # that are disabled on the chat
+        matches = self.trigger_matcher.match(words) & settings.enabled_triggers
+
+        # Easter Egg Possibilities: has a fox or wolf emoji or word, or is
+        # a sad message
+        for category in ("fox", "wolf", "sad"):
+            if category in matches:
+                return category
+
+        # Possibilities: received message mentions dogs or a specific breed,
+        # or it's a personal chat message
+        if "dog" in settings.animals and ("dog" in matches or is_personal_chat or mentions_a_breed):
+            return "dog"
+
+        return None
+
     async def handle_text_messages(self, update, context):
         """
         Checks if a message comes from a group. If that is not the case,
-        or if the message includes a trigger word, replies with a dog picture.
+        or if the message includes a trigger word, replies with a dog picture
+        (or a fox or wolf picture), according to the settings of the chat.
         """
+
+        chat_id = update.message.chat_id
+        settings = await self.chat_settings.get(chat_id)
+        if self.cooldowns.is_cooling_down(chat_id, settings.cooldown):
+            return
+
         words = set(update.message.text.lower().split())
 
         # Possibility: received message mentions a specific breed
         mentioned_breed = get_mentioned_breed(self.breeds, words)
-        mentions_a_breed = mentioned_breed is not None
 
-        # Easter Egg Possibility: has a fox emoji or word
-        has_fox_reference = any(
-            any(word.startswith(fox_trigger) for word in words) for fox_trigger in self.fox_triggers
-        )
+        # Possibility: it's a personal chat message
+        chat_type = update.message.chat.type
+        is_personal_chat = chat_type not in TELEGRAM_GROUP_CHAT_TYPES
 
-        # Easter Egg Possibility: has a wolf emoji or word
-        has_wolf_reference = any(
-            any(word.startswith(wolf_trigger) for word in words)
-            for wolf_trigger in self.wolf_triggers
-        )
+        reply = self.choose_reply(words, is_personal_chat, mentioned_breed is not None, settings)
 
-        # Possibility: received a sad message
-        is_sad_message = any(
-            any(word.startswith(sad_trigger) for word in words) for sad_trigger in self.sad_triggers
-        )
+        # To avoid overloading the chat with dog pictures, only reply
+        # to sad messages with a certain probability
+        if reply == "sad" and not self.should_reply_to_sad_message(chat_id, settings):
+            return
 
-        # Possibility: received message mentions dogs
-        should_trigger_picture = any(
-            any(word.startswith(dog_trigger) for word in words) for dog_trigger in self.dog_triggers
-        )
+        if reply is not None:
+            self.cooldowns.record_reply(chat_id)
+            await self.send_reply(reply, update, context, mentioned_breed)
 
-        # Possibility: it's a personal chat message
-        chat_type = update.message.chat.type
-        is_personal_chat = chat_type not in TELEGRAM_GROUP_CHAT_TYPES
+    def should_reply_to_sad_message(self, chat_id: int, settings) -> bool:
+        """
+        Records a sad message on a chat, and decides whether to reply to
+        it, recording the reply if so.
+        """
+
+        messages = self.activity.record(chat_id)
+        replies = self.sad_replies.messages(chat_id)
+        if not self.rng.chance(self.sad_reply_probability(settings, messages, replies)):
+            return False
+
+        self.sad_replies.record(chat_id)
+        return True
+
+    def sad_reply_probability(self, settings, messages: int, replies: int = 0) -> float:
+        """
+        Returns the probability of replying to a sad message on a chat that
+        got `messages` sad messages recently, `replies` of which were replied
+        to: the probability set for the chat (or the bot-wide one), lowered
+        on busy chats so that replies stay within SAD_REPLY_BUDGET per
+        SAD_REPLY_WINDOW seconds.
+        """
 
-        if has_fox_reference:
+        probability = settings.probability
+        if probability is None:
+            probability = self.sad_message_response_probability
+
+        return throttled_probability(probability, messages, self.SAD_REPLY_BUDGET, replies)
+
+    async def send_reply(self, reply, update, context, breed=None):
+        """
+        Replies with a picture of the given kind ("fox", "wolf", "sad" or
+        "dog").
+        """
+
+        if reply == "fox":
             await self.send_fox_picture(update, context)
-        elif has_wolf_reference:
+        elif reply == "wolf":
             await self.send_wolf_picture(update, context)
-        elif is_sad_message:
+        elif reply == "sad":
             # Easter Egg: if the message is sad, send a dog picture
             # with a comforting message
+            sad_caption = "Don't be sad, have a cute dog!"
+            await self.send_dog_picture(update, context, breed, sad_caption)
+        else:
+            await self.send_dog_picture(update, context, breed)
+
+    def classify_sticker(self, sticker) -> Optional[str]:
+        """
+        Returns the trigger category (e.g. "dog" or "fox") of the emoji
+        associated to a given sticker, if any.
+        """
 
-            # To avoid overloading the chat with dog pictures, only
-            # send a picture with a certain probability
-            if random.random() < self.sad_message_response_probability:
-                sad_caption = "Don't be sad, have a cute dog!"
-                await self.send_dog_picture(update, context, mentioned_breed, sad_caption)
-        elif any([should_trigger_picture, is_personal_chat, mentions_a_breed]):
-            await self.send_dog_picture(update, context, mentioned_breed)
+        if sticker is None or sticker.emoji is None:
+            return None
+
+        sticker_categories = self.resources.sticker_categories
+        file_unique_id = sticker.file_unique_id
+        if file_unique_id in sticker_categories:
+            return sticker_categories[file_unique_id]
+
+        category = self.trigger_matcher.classify_emoji(sticker.emoji)
+        if file_unique_id is not None:
+            sticker_categories[file_unique_id] = category
+
+        return category
 
     async def handle_stickers(self, update, context):
         """
-        Checks if a given sticker is dog-related, and replies with a dog
-        picture if that's the case.
+        Checks if a given sticker is dog-related (or fox or wolf-related),
+        and replies with a matching picture if that's the case and the
+        animal is enabled on the chat.
+        """
+
+        chat_id = update.message.chat_id
+        settings = await self.chat_settings.get(chat_id)
+        if self.cooldowns.is_cooling_down(chat_id, settings.cooldown):
+            return
+
+        category = self.classify_sticker(update.message.sticker)
+
+        if category in settings.animals:
+            self.cooldowns.record_reply(chat_id)
+            await self.send_reply(category, update, context)
+
+    async def is_chat_admin(self, update, context) -> bool:
+        """
+        Checks whether the sender of a message may change the settings of
+        the chat: anyone can on personal chats, only admins can on groups.
+        """
+
+        message = update.message
+        if message.chat.type not in TELEGRAM_GROUP_CHAT_TYPES:
+            return True
+
+        member = await context.bot.get_chat_member(message.chat_id, message.from_user.id)
+        return member.status in ("administrator", "creator")
+
+    async def show_settings(self, update, context):
+        """
+        Sends the current settings of the chat.
+        """
+
+        settings = await self.chat_settings.get(update.message.chat_id)
+        await context.bot.send_message(
+            chat_id=update.message.chat_id,
+            text=f"Settings for this chat:\n{settings.describe()}",
+        )
+
+    async def change_settings(self, update, context):
+        """
+        Changes a setting of the chat through `/set <setting> <value>`, or
+        brings every setting back to its default through `/set reset`.
+        Only chat admins are allowed to.
+        """
+
+        chat_id = update.message.chat_id
+        args = context.args or []
+
+        if not await self.is_chat_admin(update, context):
+            text = "Only chat admins can change my settings. Woof!"
+        elif args == ["reset"]:
+            await self.chat_settings.reset(chat_id)
+            text = "Settings are back to their defaults. Woof!"
+        else:
+            try:
+                if len(args) != 2:
+                    raise ValueError(
+                        "Usage: /set probability <0-1|default>, /set animals <dog,fox,wolf>, "
+                        "/set cooldown <seconds> or /set reset."
+                    )
+                settings = await self.chat_settings.update(chat_id, **parse_setting(*args))
+                text = f"Settings for this chat:\n{settings.describe()}"
+            except ValueError as error:
+                text = str(error)
+
+        await context.bot.send_message(chat_id=chat_id, text=text)
+
+    async def handle_profile_command(self, update, context):
+        """
+        Profiles the bot for a while through `/profile [seconds]`, then
+        sends a summary of the profile. Only bot admins (whose user IDs are
+        listed on DPB_ADMIN_IDS) are allowed to; anyone else is ignored.
+        """
+
+        chat_id = update.message.chat_id
+        if update.message.from_user.id not in get_admin_ids():
+            return
+
+        try:
+            seconds = float(context.args[0]) if context.args else PROFILER.DEFAULT_SECONDS
+        except ValueError:
+            seconds = PROFILER.DEFAULT_SECONDS
+        if not math.isfinite(seconds):  # e.g. "nan" or "inf"
+            seconds = PROFILER.DEFAULT_SECONDS
+        seconds = min(max(seconds, 0.0), PROFILER.MAX_SECONDS)
+
+        if PROFILER.running:
+            await context.bot.send_message(chat_id=chat_id, text="A profile is already running.")
+            return
+
+        # Profiling happens in the background, so updates keep being handled
+        PROFILER.start()
+        await context.bot.send_message(chat_id=chat_id, text=f"Profiling for {seconds:g} seconds.")
+        context.application.create_task(self.finish_profile(seconds, context.bot, chat_id))
+
+    def profile_on_signal(self):
+        """
+        Profiles the bot for PROFILER.DEFAULT_SECONDS seconds, logging the
+        summary of the profile, unless a profile is already running.
+        """
+
+        if PROFILER.running:
+            logger.warning("A profile is already running")
+            return
+
+        PROFILER.start()
+        self.application.create_task(self.finish_profile(PROFILER.DEFAULT_SECONDS))
+
+    async def finish_profile(self, seconds: float, bot=None, chat_id=None):
+        """
+        Waits for the given amount of seconds, then stops the running
+        profile and logs its summary, also sending it to the given chat.
+        """
+
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            path, summary = PROFILER.stop()
+
+        logger.info("Profile written to %s\n%s", path, summary)
+        if bot is not None:
+            await bot.send_message(chat_id=chat_id, text=f"Profile written to {path}\n{summary}")
+
+    async def show_stats(self, update, context):
+        """
+        Sends how many updates the bot handled, has waiting and dropped.
+        Only bot admins (whose user IDs are listed on DPB_ADMIN_IDS) are
+        allowed to see them; anyone else is ignored.
+        """
+
+        if update.message.from_user.id not in get_admin_ids():
+            return
+
+        await context.bot.send_message(
+            chat_id=update.message.chat_id,
+            text=context.application.update_processor.describe(),
+        )
+
+    async def handle_inline_query(self, update, _context):
+        """
+        Answers an inline query with a grid of dog pictures taken from the
+        image pool, of the breed being typed if there is one.
+        """
+
+        inline_query = update.inline_query
+        breed = self.resources.breed_matcher.match(inline_query.query)
+        image_urls = await self.resources.image_pool.get(breed)
+
+        results = [
+            telegram.InlineQueryResultPhoto(
+                id=str(index),
+                photo_url=image_url,
+                thumbnail_url=image_url,
+                caption=self.get_random_dog_sound(),
+            )
+            for index, image_url in enumerate(image_urls)
+        ]
+
+        await inline_query.answer(results, cache_time=self.INLINE_CACHE_TIME)
+
+    def parse_dog_command_args(self, args: List[str]) -> Tuple[int, Optional[str]]:
+        """
+        Given the arguments of a `/dog [N] [breed]` command, returns the
+        amount of requested pictures (capped) and the mentioned breed, if any.
         """
 
-        has_sticker = update.message.sticker is not None
-        has_emoji_sticker = has_sticker and update.message.sticker.emoji is not None
-        has_dog_sticker = has_emoji_sticker and any(
-            e in update.message.sticker.emoji for e in self.dog_emojis
+        count = 1
+        # only ASCII digits, as `int` rejects other digits (e.g. "²")
+        if args and args[0].isascii() and args[0].isdigit():
+            count = min(max(int(args[0]), 1), self.DOG_COMMAND_MAX_PICTURES)
+            args = args[1:]
+
+        words = {word.lower() for word in args}
+        return count, get_mentioned_breed(self.breeds, words)
+
+    async def handle_dog_command(self, update, context):
+        """
+        Replies to `/dog [N] [breed]` with N dog pictures (of the given breed,
+        if any). Several pictures are fetched through a single request to the
+        Dog API, and sent back as a single album.
+        """
+
+        count, breed = self.parse_dog_command_args(context.args or [])
+
+        if not self.rate_limiter.try_acquire(update.message.chat_id, count):
+            logger.debug("Rate limited /dog command on chat %s", update.message.chat_id)
+            return
+
+        if count == 1:
+            await self.send_dog_picture(update, context, breed)
+            return
+
+        image_urls = await asyncio.to_thread(
+            self.resources.upstream.fetch_dog_pictures, breed, count
         )
 
-        if has_dog_sticker:
-            await self.send_dog_picture(update, context)
+        # Albums need at least two pictures, and breeds with few pictures
+        # might not have as many as requested
+        if len(image_urls) < 2:
+            if image_urls:
+                await self.send_picture(update, context, image_urls[0], self.get_random_dog_sound())
+            return
+
+        await self.send_pictures(update, context, image_urls, self.get_random_dog_sound())
 
     async def send_dog_picture(self, update, context, breed=None, caption=None):
         """
@@ -346,61 +791,189 @@ class DogPicsBot:
         given dog picture as a photo message on Telegram.
         """
 
-        url = (
-            DOGS_API_DOG_PICTURE_URL
-            if breed is None
-            else DOGS_API_SPECIFIC_BREED_DOG_PICTURE_URL.format(breed)
-        )
-
-        # Fetches a dog picture URL from the Dog API
-        response = requests.get(url=url, timeout=self.REQUESTS_TIMEOUT)
-        response_body = response.json()
-        image_url = response_body["message"]
+        # Fetches a dog picture URL from the Dog API, without blocking the
+        # handling of other updates
+        image_url = await asyncio.to_thread(self.resources.upstream.fetch_dog_picture, breed)
 
         if caption is None:
             caption = self.get_random_dog_sound()
 
-        await self.send_picture(update, context, image_url, caption)
+        # Dead pictures are replaced by a pooled picture of the same breed
+        await self.send_picture(
+            update,
+            context,
+            image_url,
+            caption,
+            lambda dead_url: self.resources.get_pooled_picture(
+                breed, exclude=dead_url, choose=self.rng.choice
+            ),
+        )
 
     async def send_fox_picture(self, update, context):
         """
         Retrieves a random fox pic URL from the Fox API and sends the
         given fox picture as a photo message on Telegram.
+
+        Bundled fox pictures, if any, are sent instead without reaching
+        the Fox API.
         """
 
-        # Fetches a dog picture URL from the Dog API
-        response = requests.get(url=RANDOMFOX_API_URL, timeout=self.REQUESTS_TIMEOUT)
-        response_body = response.json()
-        image_url = response_body["image"]
+        if await self.send_bundled_picture(update, context, "fox", self.get_random_fox_sound()):
+            return
 
-        await self.send_picture(update, context, image_url, self.get_random_fox_sound())
+        # Fetches a fox picture URL from the Fox API, without blocking the
+        # handling of other updates
+        image_url = await asyncio.to_thread(self.resources.upstream.fetch_fox_picture)
+
+        # Dead pictures are replaced by another fox picture
+        await self.send_picture(
+            update,
+            context,
+            image_url,
+            self.get_random_fox_sound(),
+            lambda _: asyncio.to_thread(self.resources.upstream.fetch_fox_picture),
+        )
 
     async def send_wolf_picture(self, update, context):
         """
         Retrieves a random wolf pic URL from the static list and sends the
         given wolf picture as a photo message on Telegram.
+
+        Bundled wolf pictures, if any, are sent instead.
         """
 
+        if await self.send_bundled_picture(update, context, "wolf", "Howl!"):
+            return
+
         image_url = self.get_random_wolf_picture()
 
         await self.send_picture(update, context, image_url, "Howl!")
 
-    async def send_picture(self, update, context, image_url, caption):
+    async def send_bundled_picture(self, update, context, category, caption) -> bool:
+        """
+        Sends a random bundled picture of the given category as a photo
+        reply message on Telegram, returning False if there is none.
+        """
+
+        if not self.resources.assets.pictures(category):
+            return False
+
+        await self.resources.assets.send_random_picture(
+            context.bot,
+            self.chat_settings.namespace,
+            category,
+            choose=self.rng.choice,
+            chat_id=update.message.chat_id,
+            reply_to_message_id=update.message.message_id,
+            caption=caption,
+        )
+        return True
+
+    async def send_picture(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self, update, context, image_url, caption, get_replacement=None
+    ):
         """
         Retrieves a pic URL from the provided API and sends the
         given picture as a photo reply message on Telegram.
+
+        If given, `get_replacement` is awaited with a dead picture URL to
+        get another one: pictures known to be dead are replaced before
+        sending them, and pictures Telegram can't send are retried once.
+        """
+
+        validator = self.resources.validator
+        if get_replacement is not None and validator.is_dead(image_url):
+            image_url = await get_replacement(image_url) or image_url
+
+        for attempt in range(2):
+            try:
+                # Sends the picture
+                await context.bot.send_photo(
+                    chat_id=update.message.chat_id,
+                    reply_to_message_id=update.message.message_id,
+                    photo=image_url,
+                    caption=caption,
+                )
+                return
+            except telegram.error.BadRequest as error:
+                if get_replacement is None or attempt > 0 or not is_picture_error(error):
+                    raise
+
+                logger.info("Could not send %s, retrying with another picture", image_url)
+                validator.mark_dead(image_url)
+                self.resources.image_pool.evict([image_url])
+                replacement_url = await get_replacement(image_url)
+                if replacement_url is None:
+                    raise
+                image_url = replacement_url
+
+    async def send_pictures(self, update, context, image_urls, caption):
+        """
+        Sends the given pictures as a single album reply message on
+        Telegram, with the caption attached to the first picture.
         """
 
-        # Sends the picture
-        await context.bot.send_photo(
+        media = [
+            telegram.InputMediaPhoto(media=image_url, caption=caption if index == 0 else None)
+            for index, image_url in enumerate(image_urls)
+        ]
+
+        await context.bot.send_media_group(
             chat_id=update.message.chat_id,
             reply_to_message_id=update.message.message_id,
-            photo=image_url,
-            caption=caption,
+            media=media,
         )
 
 
+def is_picture_error(error) -> bool:
+    """
+    Checks whether an error of Telegram's Bot API is about the picture
+    being sent.
+    """
+
+    message = error.message.lower()
+    return any(picture_error in message for picture_error in PICTURE_ERRORS)
+
+
+def get_admin_ids() -> FrozenSet[int]:
+    """
+    Returns the user IDs of the bot admins, read from the comma separated
+    DPB_ADMIN_IDS environment variable.
+    """
+
+    admin_ids = os.environ.get("DPB_ADMIN_IDS", "")
+    return frozenset(int(admin_id) for admin_id in admin_ids.split(",") if admin_id.strip())
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Parses command line arguments, sets up logging and runs the bot.
+    """
+
+    parser = argparse.ArgumentParser(description="A Telegram bot that sends dog pictures.")
+    parser.add_argument(
+        "--measure-startup",
+        action="store_true",
+        help="stop after handling the first update and print a startup timing report",
+    )
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    tokens = get_tokens()
+    if not tokens:
+        parser.error("no token was found, set DPB_TG_TOKEN or DPB_TG_TOKENS")
+
+    if len(tokens) == 1:
+        bot = DogPicsBot(tokens[0])
+        bot.run_bot(measure_startup=args.measure_startup)
+        return
+
+    # Every bot hosted by this process shares the same resources
+    resources = SharedResources()
+    bots = [DogPicsBot(token, resources) for token in tokens]
+    run_bots(bots, measure_startup=args.measure_startup)
+
+
 # If the script is run directly, fires the main procedure
 if __name__ == "__main__":
-    bot = DogPicsBot()
-    bot.run_bot()
+    main()
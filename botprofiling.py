@@ -0,0 +1,125 @@
+"""
+On-demand profiling of a running DogPicsBot process, so that CPU spikes in
+production can be looked into without restarting the bot.
+
+Profiles are taken with cProfile for a given amount of seconds, written
+to disk (to be opened with `pstats` or tools such as snakeviz), and
+summarised around the functions on the bot's hot path.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import cProfile
+import os
+import pstats
+import time
+from typing import Optional, Tuple
+
+# Functions on the hot path of the bot, as (module file, function name),
+# that are always part of the summary of a profile
+HOT_PATH_FUNCTIONS: Tuple[Tuple[str, str], ...] = (
+    ("bot.py", "handle_text_messages"),
+    ("bot.py", "handle_stickers"),
+    ("resources.py", "get_mentioned_breed"),
+    ("triggers.py", "match"),
+    ("triggers.py", "classify_emoji"),
+    ("bot.py", "send_picture"),
+)
+
+
+def summarize_function(entries: dict, filename: str, function: str) -> str:
+    """
+    Returns the calls and times of a function (or of every function with
+    the given name within the given module file) on a profile.
+    """
+
+    calls, own_time, cumulative_time = 0, 0.0, 0.0
+    for (path, _, name), (_, ncalls, tottime, cumtime, _) in entries.items():
+        if name == function and os.path.basename(path) == filename:
+            calls += ncalls
+            own_time += tottime
+            cumulative_time += cumtime
+
+    return f"  {function}: {calls}, {cumulative_time * 1000:.1f}, {own_time * 1000:.1f}"
+
+
+def summarize(stats: pstats.Stats, top: int = 10) -> str:
+    """
+    Returns a human-readable summary of a profile: calls and times of the
+    hot path functions, and the functions that took the most time.
+    """
+
+    # (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+    entries = stats.stats  # type: ignore[attr-defined]
+
+    lines = ["Hot path (calls, cumulative ms, own ms):"]
+    lines.extend(summarize_function(entries, *function) for function in HOT_PATH_FUNCTIONS)
+
+    lines.append(f"Top {top} functions by own time (calls, own ms):")
+    by_own_time = sorted(entries.items(), key=lambda entry: entry[1][2], reverse=True)
+    for (path, line, name), (_, ncalls, tottime, _, _) in by_own_time[:top]:
+        location = f"{os.path.basename(path)}:{line}" if line else path
+        lines.append(f"  {name} ({location}): {ncalls}, {tottime * 1000:.1f}")
+
+    return "\n".join(lines)
+
+
+class Profiler:
+    """
+    Profiles the process for a while, one profile at a time. Note that
+    cProfile only sees the thread it is enabled on, i.e. the event loop's,
+    and not work run on worker threads.
+    """
+
+    __slots__ = ("directory", "_profile")
+
+    # How long profiles last unless told otherwise, and at most, in seconds
+    DEFAULT_SECONDS = 30
+    MAX_SECONDS = 300
+
+    def __init__(self, directory: Optional[str] = None):
+        # profiles are written to DPB_PROFILE_DIR unless a directory is given
+        self.directory = directory
+        self._profile: Optional[cProfile.Profile] = None
+
+    @property
+    def running(self) -> bool:
+        """
+        Whether a profile is being taken.
+        """
+
+        return self._profile is not None
+
+    def start(self):
+        """
+        Starts profiling. Raises a RuntimeError if a profile is already
+        being taken.
+        """
+
+        if self.running:
+            raise RuntimeError("A profile is already being taken.")
+
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self) -> Tuple[str, str]:
+        """
+        Stops profiling, writes the profile to disk and returns its path
+        along with its summary.
+        """
+
+        profile, self._profile = self._profile, None
+        profile.disable()
+
+        directory = self.directory or os.environ.get("DPB_PROFILE_DIR", "profiles")
+        os.makedirs(directory, exist_ok=True)
+        filename = f"dogpicsbot-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.prof"
+        path = os.path.join(directory, filename)
+        profile.dump_stats(path)
+
+        return path, summarize(pstats.Stats(profile))
+
+
+# A single profiler for the whole process, as cProfile can only take one
+# profile at a time
+PROFILER = Profiler()
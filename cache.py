@@ -0,0 +1,52 @@
+"""
+A small in-memory cache used across the DogPicsBot.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """
+    Mapping that holds at most `max_size` entries, forgetting the least
+    recently used one whenever a new entry does not fit.
+    """
+
+    __slots__ = ("max_size", "_entries")
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, key: Hashable) -> Any:
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def keys(self):
+        """
+        Returns the cached keys, from least to most recently used.
+        """
+
+        return self._entries.keys()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Removes the given key from the cache, returning its value (or the
+        default, if it was not cached).
+        """
+
+        return self._entries.pop(key, default)
@@ -0,0 +1,280 @@
+"""
+Per-chat settings of the DogPicsBot, which chat admins can change.
+
+Settings are persisted on a local SQLite database, and read through an
+in-memory LRU cache with write-through, so that handling a message does
+not need to touch the disk.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Callable, FrozenSet, Optional, Set
+
+from cache import LRUCache
+
+# Animals the bot can reply with, and that can be enabled or disabled per chat
+ANIMALS: FrozenSet[str] = frozenset({"dog", "fox", "wolf"})
+
+# Longest reply cooldown that can be set on a chat (a day), in seconds
+MAX_COOLDOWN: float = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_settings (
+    namespace TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    probability REAL,
+    animals TEXT NOT NULL,
+    cooldown REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, chat_id)
+)
+"""
+
+
+@dataclass(frozen=True)
+class ChatSettings:
+    """
+    Settings of a chat. A probability of None means that the bot-wide sad
+    message response probability applies.
+    """
+
+    probability: Optional[float] = None
+    animals: FrozenSet[str] = ANIMALS
+    cooldown: float = 0.0  # in seconds
+
+    @property
+    def enabled_triggers(self) -> FrozenSet[str]:
+        """
+        Trigger categories the bot may reply to on the chat: sad messages
+        are replied to with dogs, so they are enabled along with dogs.
+        """
+
+        return self.animals | {"sad"} if "dog" in self.animals else self.animals
+
+    def describe(self) -> str:
+        """
+        Returns a human-readable summary of the settings.
+        """
+
+        probability = "default" if self.probability is None else f"{self.probability:g}"
+        animals = ", ".join(sorted(self.animals)) or "none"
+        return (
+            f"probability: {probability}\n"
+            f"animals: {animals}\n"
+            f"cooldown: {self.cooldown:g} seconds"
+        )
+
+
+DEFAULT_CHAT_SETTINGS = ChatSettings()
+
+
+def parse_number(value: str, error_message: str) -> float:
+    """
+    Parses a number typed by a user, raising a ValueError with the given
+    message if it is not one.
+    """
+
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(error_message) from None
+
+
+def parse_setting(name: str, value: str) -> dict:
+    """
+    Given the name of a setting and a value as typed by a user, returns the
+    changes to apply to a chat's settings. Raises a ValueError with a user
+    friendly message if the setting or the value are not valid.
+    """
+
+    if name == "probability":
+        if value == "default":
+            return {"probability": None}
+        message = "The probability must be a number between 0 and 1."
+        probability = parse_number(value, message)
+        if not 0 <= probability <= 1:
+            raise ValueError(message)
+        return {"probability": probability}
+
+    if name == "animals":
+        animals = frozenset(a.strip() for a in value.lower().split(",") if a.strip())
+        if not animals <= ANIMALS:
+            raise ValueError(f"Animals must be among: {', '.join(sorted(ANIMALS))}.")
+        return {"animals": animals}
+
+    if name == "cooldown":
+        message = f"The cooldown must be between 0 and {MAX_COOLDOWN:g} seconds."
+        cooldown = parse_number(value, message)
+        if not 0 <= cooldown <= MAX_COOLDOWN:
+            raise ValueError(message)
+        return {"cooldown": cooldown}
+
+    raise ValueError("Settings are: probability, animals and cooldown.")
+
+
+class ChatSettingsStore:
+    """
+    Stores the settings of every chat that customized them, for a given
+    namespace (i.e. a given bot, when several share the same database).
+
+    Reads are served from an LRU cache. The IDs of every customized chat
+    are kept in memory too, so that looking up a chat that never changed
+    its settings does not touch the disk either. Writes go to the database
+    (in a worker thread) and then to the cache.
+    """
+
+    __slots__ = ("path", "namespace", "_cache", "_customized", "_connection", "_lock")
+
+    def __init__(self, path: str, namespace: str, cache_size: int = 10000):
+        self.path = path
+        self.namespace = namespace
+        self._cache = LRUCache(cache_size)
+        self._customized: Set[int] = set()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        The connection to the database, opened (and set up) on first use.
+        """
+
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(SCHEMA)
+
+        return self._connection
+
+    def preload(self):
+        """
+        Loads the IDs of every customized chat, and warms the cache up with
+        the most recently updated settings. Meant to be called at startup.
+        """
+
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT chat_id, probability, animals, cooldown FROM chat_settings "
+                "WHERE namespace = ? ORDER BY updated_at DESC",
+                (self.namespace,),
+            ).fetchall()
+
+        self._customized = {row[0] for row in rows}
+        for row in reversed(rows[: self._cache.max_size]):
+            self._cache[row[0]] = self._settings_from_row(row[1:])
+
+    async def get(self, chat_id: int) -> ChatSettings:
+        """
+        Returns the settings of the given chat.
+        """
+
+        if chat_id in self._cache:
+            return self._cache[chat_id]
+
+        if chat_id not in self._customized:
+            return DEFAULT_CHAT_SETTINGS
+
+        # Only reached by customized chats that fell out of the cache
+        settings = await asyncio.to_thread(self._read, chat_id)
+        self._cache[chat_id] = settings
+        return settings
+
+    async def update(self, chat_id: int, **changes) -> ChatSettings:
+        """
+        Applies the given changes to the settings of a chat, and returns the
+        resulting settings.
+        """
+
+        settings = replace(await self.get(chat_id), **changes)
+        await asyncio.to_thread(self._write, chat_id, settings)
+
+        self._customized.add(chat_id)
+        self._cache[chat_id] = settings
+        return settings
+
+    async def reset(self, chat_id: int):
+        """
+        Brings the settings of a chat back to the defaults.
+        """
+
+        await asyncio.to_thread(self._delete, chat_id)
+
+        self._customized.discard(chat_id)
+        self._cache.pop(chat_id)
+
+    @staticmethod
+    def _settings_from_row(row) -> ChatSettings:
+        probability, animals, cooldown = row
+        return ChatSettings(
+            probability=probability,
+            animals=frozenset(animals.split(",")) - {""},
+            cooldown=cooldown,
+        )
+
+    def _read(self, chat_id: int) -> ChatSettings:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT probability, animals, cooldown FROM chat_settings "
+                "WHERE namespace = ? AND chat_id = ?",
+                (self.namespace, chat_id),
+            ).fetchone()
+
+        return DEFAULT_CHAT_SETTINGS if row is None else self._settings_from_row(row)
+
+    def _write(self, chat_id: int, settings: ChatSettings):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO chat_settings "
+                "(namespace, chat_id, probability, animals, cooldown, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self.namespace,
+                    chat_id,
+                    settings.probability,
+                    ",".join(sorted(settings.animals)),
+                    settings.cooldown,
+                    time.time(),
+                ),
+            )
+
+    def _delete(self, chat_id: int):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM chat_settings WHERE namespace = ? AND chat_id = ?",
+                (self.namespace, chat_id),
+            )
+
+
+class ReplyCooldowns:
+    """
+    Remembers when the bot last replied (unprompted) on each chat, for the
+    `max_chats` most recently active chats.
+    """
+
+    __slots__ = ("clock", "_last_replies")
+
+    def __init__(self, max_chats: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._last_replies = LRUCache(max_chats)
+
+    def is_cooling_down(self, chat_id: int, cooldown: float) -> bool:
+        """
+        Checks whether the bot replied on the given chat less than
+        `cooldown` seconds ago.
+        """
+
+        if cooldown <= 0 or chat_id not in self._last_replies:
+            return False
+
+        return self.clock() - self._last_replies[chat_id] < cooldown
+
+    def record_reply(self, chat_id: int):
+        """
+        Records that the bot just replied on the given chat.
+        """
+
+        self._last_replies[chat_id] = self.clock()
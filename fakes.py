@@ -0,0 +1,567 @@
+"""
+Fake versions of the services the DogPicsBot talks to (Telegram's Bot API,
+the Dog API and RandomFox), so that the bot can be run end to end without
+reaching the network, e.g. to replay recorded traffic.
+
+Fakes come in two flavours: in-process ones, that stand in for the objects
+the bot talks through (its `requests` session and Telegram request), and
+local HTTP servers, that the bot reaches through real connections, so that
+connection reuse, timeouts and concurrency can be measured as well.
+
+Every fake can simulate a fixed latency, and counts the requests it gets.
+Fake servers can also be told to fail some of their requests.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import asyncio
+import email.parser
+import email.policy
+import json
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from telegram.request import BaseRequest
+
+FAKE_DOG_PICTURE_URL = "https://images.dog.ceo/breeds/{0}/{1}.jpg"
+FAKE_FOX_PICTURE_URL = "https://randomfox.ca/images/{0}.jpg"
+
+
+@dataclass
+class FakeResponse:
+    """
+    Response of a fake upstream API, with the subset of the interface of
+    `requests` responses that the bot uses.
+    """
+
+    payload: dict
+    status_code: int = 200
+
+    def json(self) -> dict:
+        """
+        Returns the JSON body of the response.
+        """
+
+        return self.payload
+
+
+class FakeUpstreamSession:
+    """
+    Stands in for the `requests` session of the upstream client, answering
+    like the Dog API and RandomFox would, with made-up picture URLs.
+    """
+
+    def __init__(
+        self,
+        breeds: List[str],
+        latency: float = 0.0,
+        picture_url: str = FAKE_DOG_PICTURE_URL,
+        fox_picture_url: str = FAKE_FOX_PICTURE_URL,
+    ):
+        self.breeds = breeds
+        self.latency = latency  # in seconds
+        self.picture_url_template = picture_url
+        self.fox_picture_url_template = fox_picture_url
+        self.requests: Counter = Counter()
+        self._pictures = count()
+
+    def picture_url(self, breed: Optional[str] = None) -> str:
+        """
+        Returns a new, made-up picture URL of the given breed (if any).
+        """
+
+        return self.picture_url_template.format(breed or "mix", next(self._pictures))
+
+    def answer(self, url: str) -> FakeResponse:
+        """
+        Returns the response of one of the upstream APIs to a GET request.
+        """
+
+        if "randomfox" in url:
+            self.requests["fox_picture"] += 1
+            fox_picture_url = self.fox_picture_url_template.format(next(self._pictures))
+            return FakeResponse({"image": fox_picture_url})
+
+        if url.endswith("/breeds/list/all"):
+            self.requests["breeds"] += 1
+            return FakeResponse({"message": {breed: [] for breed in self.breeds}})
+
+        breed = url.split("/breed/")[1].split("/")[0] if "/breed/" in url else None
+        last_segment = url.rsplit("/", 1)[1]
+        if last_segment.isdigit():
+            self.requests["dog_pictures"] += 1
+            pictures = [self.picture_url(breed) for _ in range(int(last_segment))]
+            return FakeResponse({"message": pictures})
+
+        self.requests["dog_picture"] += 1
+        return FakeResponse({"message": self.picture_url(breed)})
+
+    def get(self, url: str, timeout: Optional[float] = None) -> FakeResponse:
+        """
+        Answers a GET request to one of the upstream APIs, after blocking
+        for the configured latency, just like `requests` would.
+        """
+
+        del timeout
+        if self.latency:
+            time.sleep(self.latency)
+
+        return self.answer(url)
+
+    def head(self, url: str, timeout: Optional[float] = None, allow_redirects: bool = False):
+        """
+        Answers a HEAD request to a picture, after blocking for the
+        configured latency. Every picture is alive.
+        """
+
+        del url, timeout, allow_redirects
+        if self.latency:
+            time.sleep(self.latency)
+
+        self.requests["picture_check"] += 1
+        return FakeResponse({})
+
+
+def fake_message(chat_id: int, message_id: int, **fields) -> dict:
+    """
+    Returns a minimal message, as sent by the Bot API, with the given
+    extra fields (e.g. its text).
+    """
+
+    chat = {"id": chat_id, "type": "private" if chat_id > 0 else "group"}
+    return {"message_id": message_id, "date": int(time.time()), "chat": chat, **fields}
+
+
+class FakeBotAPI:
+    """
+    Answers Bot API calls like Telegram would, counting them by method.
+    Uploaded photos get made-up file IDs.
+    """
+
+    def __init__(self):
+        self.calls: Counter = Counter()
+        self._message_ids = count(1)
+        self._file_ids = count(1)
+
+    def fake_photo(self, photo) -> List[dict]:
+        """
+        Returns the sizes of a sent photo, which keeps its file ID if it was
+        sent by one, or gets a new one if it was uploaded or sent by URL.
+        """
+
+        if isinstance(photo, str) and "://" not in photo:
+            file_id = photo
+        else:
+            file_id = f"fake-file-{next(self._file_ids)}"
+        return [{"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480}]
+
+    def answer(self, method: str, parameters: Dict) -> object:
+        """
+        Returns the result of a Bot API call.
+        """
+
+        self.calls[method] += 1
+        chat_id = int(parameters.get("chat_id", 0))
+
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "DogPicsBot", "username": "bot"}
+        if method == "sendMessage":
+            return fake_message(chat_id, next(self._message_ids))
+        if method == "sendPhoto":
+            photo = self.fake_photo(parameters.get("photo"))
+            return fake_message(chat_id, next(self._message_ids), photo=photo)
+        if method == "sendMediaGroup":
+            media = parameters.get("media", [])
+            if isinstance(media, str):  # sent as JSON, through HTTP
+                media = json.loads(media)
+            return [fake_message(chat_id, next(self._message_ids)) for _ in media]
+        if method == "getChatMember":
+            user = {"id": int(parameters["user_id"]), "is_bot": False, "first_name": "Someone"}
+            return {"status": "member", "user": user}
+
+        # e.g. answerInlineQuery, deleteMessage or deleteWebhook
+        return True
+
+
+class FakeTelegramRequest(FakeBotAPI, BaseRequest):
+    """
+    Request object for Telegram applications that answers Bot API calls
+    locally instead of sending them to Telegram, counting them by method.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency  # in seconds
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        url: str,
+        method: str,
+        request_data=None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        api_method = url.rsplit("/", 1)[1]
+        parameters = request_data.parameters if request_data is not None else {}
+        body = {"ok": True, "result": self.answer(api_method, parameters)}
+        return 200, json.dumps(body).encode()
+
+
+def parse_parameters(content_type: str, body: bytes) -> Dict:
+    """
+    Returns the parameters of a request to the Bot API, which are sent as a
+    form, as multipart form data (when uploading files) or as JSON.
+    """
+
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+
+    if content_type.startswith("multipart/form-data"):
+        headers = f"Content-Type: {content_type}\r\n\r\n".encode()
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(headers + body)
+        parameters = {}
+        for part in message.iter_parts():
+            payload = part.get_payload(decode=True)
+            name = part.get_param("name", header="content-disposition")
+            parameters[name] = payload if part.get_filename() else payload.decode()
+        return parameters
+
+    return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    """
+    Hands the requests of a connection over to the fake server it belongs
+    to. Connections are kept alive between requests.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.fake.count_connection()
+
+    def handle_request(self, method: str):
+        """
+        Answers a request through the fake server, after its latency.
+        """
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, content_type, content = self.server.fake.handle(
+            method, self.path, self.headers.get("Content-Type", ""), body
+        )
+
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            if method != "HEAD":
+                self.wfile.write(content)
+        except ConnectionError:  # e.g. the client gave up on a long poll
+            self.close_connection = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Answers a GET request.
+        """
+
+        self.handle_request("GET")
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        """
+        Answers a HEAD request.
+        """
+
+        self.handle_request("HEAD")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Answers a POST request.
+        """
+
+        self.handle_request("POST")
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    """
+    HTTP server that handles every connection on its own (daemon) thread,
+    and queues plenty of connections, so that bursts of new connections are
+    accepted right away.
+    """
+
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class FakeServer(ABC):
+    """
+    Local HTTP server, run on a random port on a background thread, that
+    answers every request after `latency` seconds. A share of its requests
+    (`error_rate`, picked by a seedable random generator) and any request
+    it is told to `fail` are answered with an error instead.
+
+    Subclasses answer requests through `respond`.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency  # in seconds
+        self.error_rate = error_rate
+        self.connections = 0
+        self.errors = 0
+
+        self._random = random.Random(seed)
+        self._failures: List[int] = []  # statuses of the next failing requests
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        self._server = FakeHTTPServer(("127.0.0.1", 0), FakeRequestHandler)
+        self._server.fake = self  # type: ignore[attr-defined]
+
+    @property
+    def url(self) -> str:
+        """
+        The base URL of the server.
+        """
+
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Starts serving requests on a background thread.
+        """
+
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops serving requests, and closes the server.
+        """
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.stop()
+
+    def fail(self, times: int = 1, status: int = 500):
+        """
+        Answers the next `times` requests with the given error status.
+        """
+
+        with self._lock:
+            self._failures.extend([status] * times)
+
+    def count_connection(self):
+        """
+        Counts a new connection to the server.
+        """
+
+        with self._lock:
+            self.connections += 1
+
+    def _error_status(self) -> Optional[int]:
+        with self._lock:
+            if self._failures:
+                status = self._failures.pop(0)
+            elif self.error_rate and self._random.random() < self.error_rate:
+                status = 500
+            else:
+                return None
+
+            self.errors += 1
+            return status
+
+    def handle(self, method: str, path: str, content_type: str, body: bytes):
+        """
+        Returns the status, content type and content of the response to a
+        request, after the server's latency.
+        """
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        status = self._error_status()
+        if status is not None:
+            error = {"ok": False, "error_code": status, "description": "Injected error"}
+            return status, "application/json", json.dumps(error).encode()
+
+        return self.respond(method, path, content_type, body)
+
+    @abstractmethod
+    def respond(self, method: str, path: str, content_type: str, body: bytes):
+        """
+        Returns the status, content type and content of the response to a
+        request that does not fail.
+        """
+
+
+class FakeUpstreamServer(FakeServer):
+    """
+    Local server that answers like the Dog API (under `/api`) and RandomFox
+    (under `/randomfox`) would, with made-up pictures served by itself (under
+    `/images`). Pictures whose name includes "dead" are gone.
+    """
+
+    def __init__(self, breeds: List[str], **kwargs):
+        super().__init__(**kwargs)
+        self.session = FakeUpstreamSession(
+            breeds,
+            picture_url=f"{self.url}/images/{{0}}/{{1}}.jpg",
+            fox_picture_url=f"{self.url}/images/fox/{{0}}.jpg",
+        )
+
+    @property
+    def requests(self) -> Counter:
+        """
+        Amount of requests answered, by kind.
+        """
+
+        return self.session.requests
+
+    @property
+    def dogs_api_url(self) -> str:
+        """
+        The base URL of the fake Dog API.
+        """
+
+        return f"{self.url}/api"
+
+    @property
+    def randomfox_url(self) -> str:
+        """
+        The base URL of the fake RandomFox API.
+        """
+
+        return f"{self.url}/randomfox"
+
+    def respond(self, method: str, path: str, content_type: str, body: bytes):
+        del method, content_type, body
+        if path.startswith("/images/"):
+            self.session.requests["picture"] += 1
+            status = 404 if "dead" in path else 200
+            return status, "image/jpeg", b"\xff\xd8\xff\xd9"
+
+        response = self.session.answer(urlsplit(path).path)
+        return response.status_code, "application/json", json.dumps(response.json()).encode()
+
+
+class FakeTelegramServer(FakeServer):
+    """
+    Local server that answers like Telegram's Bot API would, for any bot
+    token. Updates pushed to the server are handed out through `getUpdates`
+    (which waits for them, like long polling does), and every other call is
+    kept on `history` along with its parameters.
+    """
+
+    # Longest time getUpdates waits for updates to arrive, in seconds
+    MAX_POLLING_TIMEOUT = 0.25
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.api = FakeBotAPI()
+        self.history: List[Tuple[str, Dict]] = []
+
+        self._updates: List[dict] = []
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+        self._new_updates = threading.Condition()
+
+    def push_update(self, update: dict) -> dict:
+        """
+        Queues an update (as a dictionary, without its ID) to be handed out
+        to the bot, and returns it.
+        """
+
+        with self._new_updates:
+            update = {"update_id": next(self._update_ids), **update}
+            self._updates.append(update)
+            self._new_updates.notify_all()
+
+        return update
+
+    def push_message(self, chat_id: int, text: str) -> dict:
+        """
+        Queues an update with a text message sent to the given chat (a
+        private chat if its ID is positive, a group otherwise).
+        """
+
+        sender = {"id": abs(chat_id), "is_bot": False, "first_name": "Someone"}
+        message = fake_message(chat_id, next(self._message_ids), text=text, **{"from": sender})
+        if text.startswith("/"):
+            command_length = len(text.split()[0])
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": command_length}]
+
+        return self.push_update({"message": message})
+
+    def sent(self, method: str) -> List[Dict]:
+        """
+        Returns the parameters of every call of the given method.
+        """
+
+        with self._lock:
+            return [parameters for name, parameters in self.history if name == method]
+
+    def get_updates(self, parameters: Dict) -> List[dict]:
+        """
+        Returns the updates after the given offset, waiting for them until
+        the given timeout (or MAX_POLLING_TIMEOUT) passes.
+        """
+
+        offset = int(parameters.get("offset") or 0)
+        timeout = min(float(parameters.get("timeout") or 0), self.MAX_POLLING_TIMEOUT)
+
+        with self._new_updates:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            if not self._updates and timeout:
+                self._new_updates.wait(timeout)
+            return list(self._updates)
+
+    def respond(self, method: str, path: str, content_type: str, body: bytes):
+        del method
+        api_method = path.rsplit("/", 1)[1]
+        parameters = parse_parameters(content_type, body)
+
+        if api_method == "getUpdates":
+            result = self.get_updates(parameters)
+        else:
+            with self._lock:
+                self.history.append((api_method, parameters))
+                result = self.api.answer(api_method, parameters)
+
+        return 200, "application/json", json.dumps({"ok": True, "result": result}).encode()
@@ -0,0 +1,93 @@
+"""
+Hosting of one or several DogPicsBot instances within a single process.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import asyncio
+import logging
+import os
+import signal
+from typing import List
+
+from startup import LazyModule
+
+dotenv = LazyModule("dotenv")
+
+logger = logging.getLogger(__name__)
+
+
+def get_tokens() -> List[str]:
+    """
+    Returns the Telegram bot tokens to run bots for, read from the comma
+    separated DPB_TG_TOKENS environment variable or, if that one is not
+    set, from DPB_TG_TOKEN.
+    """
+
+    dotenv.load_dotenv()
+    tokens = os.environ.get("DPB_TG_TOKENS") or os.environ.get("DPB_TG_TOKEN", "")
+    return [token.strip() for token in tokens.split(",") if token.strip()]
+
+
+async def start_application(application):
+    """
+    Initializes and starts a Telegram application, and starts polling for
+    its updates, without blocking the event loop.
+    """
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.updater.start_polling()
+    await application.start()
+
+
+async def stop_application(application):
+    """
+    Stops polling for updates of a Telegram application, then stops it
+    and shuts it down.
+    """
+
+    if application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await application.shutdown()
+
+
+def run_bots(bots: list, measure_startup: bool = False):
+    """
+    Runs several bots within the same process and event loop, until the
+    process is signaled to stop (or one of the bots calls `stop_running`).
+
+    Mirrors what `Application.run_polling` does for a single application.
+    """
+
+    for bot in bots:
+        bot.startup(measure_startup)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(stop_signal, loop.stop)
+        except (NotImplementedError, RuntimeError):  # pragma: no cover
+            logger.warning("Could not add a handler for signal %s", stop_signal)
+
+    started = []
+    try:
+        for bot in bots:
+            started.append(bot.application)
+            loop.run_until_complete(start_application(bot.application))
+        logger.info("Hosting %d bots", len(bots))
+        loop.run_forever()
+    except (KeyboardInterrupt, SystemExit):  # pragma: no cover
+        logger.debug("Received stop signal, shutting down")
+    finally:
+        for application in reversed(started):
+            loop.run_until_complete(stop_application(application))
+        loop.close()
+
+        for bot in bots:
+            bot.close()
@@ -0,0 +1,166 @@
+"""
+An in-memory pool of picture URLs for the DogPicsBot.
+
+Pictures are fetched in batches (one upstream call per batch), kept in
+memory per breed, and served from there while fresh, so that latency
+sensitive paths such as inline queries rarely wait on the network.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from validation import ImageValidator
+
+logger = logging.getLogger(__name__)
+
+# A blocking callable that, given a breed (or None for any breed) and an
+# amount of pictures, returns that many picture URLs
+BatchFetcher = Callable[[Optional[str], int], List[str]]
+
+
+def log_failed_refresh(task: asyncio.Task):
+    """
+    Logs the error of a background refresh (or validation) that nobody
+    awaited.
+    """
+
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Could not refresh the image pool: %r", task.exception())
+
+
+class ImagePool:
+    """
+    Keeps batches of picture URLs in memory, keyed by breed (None being
+    the key for pictures of any breed).
+
+    Batches are refreshed once they are older than `ttl` seconds; stale
+    batches keep being served while a refresh happens in the background.
+    Concurrent requests for the same breed share a single upstream fetch,
+    and no more than `max_concurrent_fetches` fetches run at the same time.
+
+    If given a validator, every new batch is validated in the background,
+    and dead pictures are evicted from the pool.
+    """
+
+    __slots__ = (
+        "fetch_batch",
+        "batch_size",
+        "ttl",
+        "validator",
+        "_batches",
+        "_in_flight",
+        "_fetch_semaphore",
+    )
+
+    def __init__(
+        self,
+        fetch_batch: BatchFetcher,
+        batch_size: int = 12,
+        ttl: float = 600.0,
+        max_concurrent_fetches: int = 4,
+        validator: Optional[ImageValidator] = None,
+    ):
+        self.fetch_batch = fetch_batch
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self.validator = validator
+
+        # breed -> (fetched_at, picture_urls)
+        self._batches: Dict[Optional[str], Tuple[float, List[str]]] = {}
+
+        # breed -> fetch currently running for that breed
+        self._in_flight: Dict[Optional[str], asyncio.Task] = {}
+
+        self._fetch_semaphore = asyncio.Semaphore(max_concurrent_fetches)
+
+    def __len__(self) -> int:
+        return sum(len(urls) for _, urls in self._batches.values())
+
+    def is_fresh(self, breed: Optional[str]) -> bool:
+        """
+        Checks whether there is a batch for the given breed that is not
+        older than the pool's TTL.
+        """
+
+        batch = self._batches.get(breed)
+        return batch is not None and time.monotonic() - batch[0] < self.ttl
+
+    async def get(self, breed: Optional[str] = None) -> List[str]:
+        """
+        Returns a batch of picture URLs for the given breed, fetching one
+        only if the pool has never seen the breed before.
+        """
+
+        batch = self._batches.get(breed)
+        if batch is None:
+            return await self.refresh(breed)
+
+        if not self.is_fresh(breed) and breed not in self._in_flight:
+            task = asyncio.create_task(self._fetch(breed))
+            task.add_done_callback(log_failed_refresh)
+            self._in_flight[breed] = task
+
+        return batch[1]
+
+    async def refresh(self, breed: Optional[str] = None) -> List[str]:
+        """
+        Fetches a new batch of picture URLs for the given breed, joining
+        an already running fetch for the same breed if there is one.
+        """
+
+        task = self._in_flight.get(breed)
+        if task is None:
+            task = asyncio.create_task(self._fetch(breed))
+            self._in_flight[breed] = task
+
+        return await task
+
+    def evict(self, urls: Iterable[str]):
+        """
+        Removes the given picture URLs from the pool. Batches left empty are
+        dropped, so that they are fetched again when needed.
+        """
+
+        urls = set(urls)
+        for breed, (fetched_at, batch) in list(self._batches.items()):
+            if urls.isdisjoint(batch):
+                continue
+
+            batch = [url for url in batch if url not in urls]
+            if batch:
+                self._batches[breed] = (fetched_at, batch)
+            else:
+                del self._batches[breed]
+
+    async def prewarm(self, breeds: Iterable[Optional[str]] = (None,)):
+        """
+        Fills the pool for the given breeds ahead of time, skipping the ones
+        that already have a fresh batch.
+        """
+
+        await asyncio.gather(*(self.refresh(b) for b in breeds if not self.is_fresh(b)))
+        logger.info("Image pool prewarmed with %d pictures", len(self))
+
+    async def _fetch(self, breed: Optional[str]) -> List[str]:
+        try:
+            async with self._fetch_semaphore:
+                urls = await asyncio.to_thread(self.fetch_batch, breed, self.batch_size)
+            self._batches[breed] = (time.monotonic(), urls)
+        finally:
+            del self._in_flight[breed]
+
+        if self.validator is not None:
+            task = asyncio.create_task(self._validate(urls))
+            task.add_done_callback(log_failed_refresh)
+
+        return urls
+
+    async def _validate(self, urls: List[str]):
+        dead_urls = await self.validator.find_dead(urls)
+        if dead_urls:
+            logger.info("Evicting %d dead pictures from the image pool", len(dead_urls))
+            self.evict(dead_urls)
@@ -0,0 +1,92 @@
+"""
+Source of the random decisions of the DogPicsBot (which sound to reply
+with, which picture to send, whether to reply to a sad message), so that
+they can be made reproducible by seeding it, e.g. to compare benchmark runs
+or replays of different versions of the bot.
+
+Every bot gets its own source, derived from a common seed (if any), the
+worker running it (if several workers run the same bots) and the bot's ID,
+so that bots and workers don't share the state of a single generator and
+still follow reproducible paths. Updates handled at the same time by a bot
+share its source, so their decisions depend on the order they interleave
+in; replays handle updates one at a time, so theirs don't.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import hashlib
+import os
+import random
+from typing import Optional, Sequence
+
+
+class ChoiceTable(tuple):
+    """
+    Immutable, non-empty table of items to choose from, built once so that
+    choosing an item only takes a multiplication and an index lookup.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, items: Sequence):
+        table = super().__new__(cls, items)
+        if not table:
+            raise ValueError("A choice table needs at least one item.")
+        return table
+
+
+class RandomSource:
+    """
+    Seedable source of random decisions. Unless given a seed, decisions
+    are not reproducible.
+    """
+
+    __slots__ = ("seed", "random")
+
+    def __init__(self, seed: Optional[int] = None):
+        self.seed = seed
+
+        # a bound method of a generator of its own, so that every decision
+        # is a single call that does not touch the global `random` state
+        self.random = random.Random(seed).random
+
+    def spawn(self, key: str) -> "RandomSource":
+        """
+        Returns an independent source for the given key (e.g. a bot or a
+        worker), which is seeded from this source's seed and the key.
+        """
+
+        if self.seed is None:
+            return RandomSource()
+
+        digest = hashlib.blake2b(f"{self.seed}:{key}".encode(), digest_size=8).digest()
+        return RandomSource(int.from_bytes(digest, "big"))
+
+    def chance(self, probability: float) -> bool:
+        """
+        Returns True with the given probability.
+        """
+
+        return self.random() < probability
+
+    def choice(self, items: Sequence):
+        """
+        Returns a random item from the given choice table (or any other
+        non-empty sequence).
+        """
+
+        return items[int(self.random() * len(items))]
+
+
+def get_random_source() -> RandomSource:
+    """
+    Returns a source seeded with the DPB_RANDOM_SEED environment variable,
+    if set, or an unseeded one otherwise. Workers named on the DPB_WORKER_ID
+    environment variable get a source of their own.
+    """
+
+    seed = os.environ.get("DPB_RANDOM_SEED", "").strip()
+    source = RandomSource(int(seed) if seed else None)
+
+    worker = os.environ.get("DPB_WORKER_ID", "").strip()
+    return source.spawn(f"worker:{worker}") if worker else source
@@ -0,0 +1,64 @@
+"""
+A per-chat rate limiter for the DogPicsBot.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Tuple
+
+
+class TokenBucketRateLimiter:
+    """
+    Classic token bucket, one per key (e.g. per chat). Every bucket holds
+    up to `capacity` tokens and regains `refill_rate` tokens per second.
+
+    Only the `max_keys` most recently seen keys are remembered, so memory
+    stays bounded no matter how many chats the bot is in; a forgotten key
+    simply starts again with a full bucket.
+    """
+
+    __slots__ = ("capacity", "refill_rate", "max_keys", "clock", "_buckets")
+
+    def __init__(
+        self,
+        capacity: float,
+        refill_rate: float,
+        max_keys: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_keys = max_keys
+        self.clock = clock
+
+        # key -> (tokens, last_updated_at)
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+
+    def tokens(self, key: Hashable) -> float:
+        """
+        Returns the amount of tokens currently available for the given key.
+        """
+
+        now = self.clock()
+        tokens, updated_at = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated_at) * self.refill_rate)
+
+    def try_acquire(self, key: Hashable, cost: float = 1.0) -> bool:
+        """
+        Takes `cost` tokens from the bucket of the given key if there are
+        enough of them, and returns whether that was the case.
+        """
+
+        tokens = self.tokens(key)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+
+        self._buckets[key] = (tokens, self.clock())
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+        return allowed
@@ -0,0 +1,189 @@
+"""
+Recording of the updates received by the DogPicsBot, so that real traffic
+can be replayed offline (see the `replay` benchmark of benchmarks.py) to
+tune matching and caching.
+
+Recordings are gzip-compressed JSONL files, with one update per line along
+with the time it was received. Updates are redacted before being written:
+names, usernames and contact details are dropped, mentions are masked, and
+user and chat IDs are replaced by pseudonyms that are stable within a
+recording (so that per-chat behaviour can still be replayed). The key the
+pseudonyms are derived from is kept next to the recording, on a `.salt`
+file, so that they stay stable when the bot restarts and appends to it.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import secrets
+import time
+from typing import Iterator, Tuple
+
+# Fields that are dropped altogether from recorded updates
+REDACTED_FIELDS = frozenset(
+    {
+        "bio",
+        "contact",
+        "email",
+        "invite_link",
+        "last_name",
+        "location",
+        "phone_number",
+        "username",
+        "venue",
+    }
+)
+
+# Fields that are required to parse an update back, and get a placeholder
+REDACTED_PLACEHOLDERS = {"first_name": "Someone", "title": "Some chat"}
+
+# Fields that hold a user or a chat (or a list of them), whose IDs are
+# pseudonymized
+IDENTITY_FIELDS = frozenset(
+    {
+        "chat",
+        "forward_from",
+        "forward_from_chat",
+        "from",
+        "left_chat_member",
+        "new_chat_members",
+        "sender_chat",
+        "sender_user",
+        "user",
+        "via_bot",
+    }
+)
+
+# Fields that only users have, so that users are pseudonymized wherever
+# they show up, even within fields not listed above
+USER_FIELDS = frozenset({"first_name", "is_bot"})
+
+# Fields that hold text typed by users, whose mentions are masked
+TEXT_FIELDS = frozenset({"caption", "query", "text"})
+
+MENTION_PATTERN = re.compile(r"@\w+")
+
+
+def pseudonymize(identifier: int, salt: bytes) -> int:
+    """
+    Returns a pseudonym for a user or chat ID, keeping its sign (negative
+    IDs belong to groups).
+    """
+
+    digest = hashlib.blake2b(str(identifier).encode(), key=salt, digest_size=6).digest()
+    pseudonym = int.from_bytes(digest, "big") or 1
+    return -pseudonym if identifier < 0 else pseudonym
+
+
+def redact(data, salt: bytes, is_identity: bool = False):
+    """
+    Returns a redacted copy of the given update (as a dictionary), or of
+    any value within it, pseudonymizing its ID if it holds a user or chat.
+    """
+
+    if isinstance(data, list):
+        return [redact(item, salt, is_identity) for item in data]
+
+    if not isinstance(data, dict):
+        return data
+
+    redacted = {}
+    for key, value in data.items():
+        if key in REDACTED_FIELDS:
+            continue
+
+        if key in REDACTED_PLACEHOLDERS:
+            redacted[key] = REDACTED_PLACEHOLDERS[key]
+        elif key in TEXT_FIELDS and isinstance(value, str):
+            redacted[key] = MENTION_PATTERN.sub("@someone", value)
+        else:
+            redacted[key] = redact(value, salt, key in IDENTITY_FIELDS)
+
+    if isinstance(data.get("id"), int) and (is_identity or not USER_FIELDS.isdisjoint(data)):
+        redacted["id"] = pseudonymize(data["id"], salt)
+
+    return redacted
+
+
+def load_salt(path: str) -> bytes:
+    """
+    Returns the key that the pseudonyms of a recording are derived from,
+    read from the given path, or newly generated and saved there (readable
+    by its owner only) if there is none.
+    """
+
+    try:
+        with open(path, "rb") as salt_file:
+            return salt_file.read()
+    except FileNotFoundError:
+        pass
+
+    salt = secrets.token_bytes(16)
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as salt_file:
+        salt_file.write(salt)
+    return salt
+
+
+class UpdateRecorder:
+    """
+    Appends redacted updates to a recording. The file is opened on the first
+    update, and flushed every `flush_every` updates and when closed.
+    """
+
+    __slots__ = ("path", "flush_every", "clock", "_salt", "_file", "_pending")
+
+    def __init__(self, path: str, flush_every: int = 100, clock=time.time):
+        self.path = path
+        self.flush_every = flush_every
+        self.clock = clock
+
+        # a key per recording, so pseudonyms can't be linked across them,
+        # loaded along with the recording
+        self._salt = b""
+        self._file = None
+        self._pending = 0
+
+    def record(self, update: dict):
+        """
+        Redacts the given update (as a dictionary) and appends it to the
+        recording.
+        """
+
+        if self._file is None:
+            self._salt = load_salt(self.path + ".salt")
+            self._file = gzip.open(self.path, "at", encoding="utf-8")
+
+        line = {"received_at": self.clock(), "update": redact(update, self._salt)}
+        self._file.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self._file.flush()
+            self._pending = 0
+
+    def close(self):
+        """
+        Flushes and closes the recording, if it was opened.
+        """
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._pending = 0
+
+
+def read_recording(path: str) -> Iterator[Tuple[float, dict]]:
+    """
+    Yields every recorded update (as a dictionary) along with the time it
+    was received, reading the recording one line at a time.
+    """
+
+    with gzip.open(path, "rt", encoding="utf-8") as recording:
+        for line in recording:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry["received_at"], entry["update"]
@@ -0,0 +1,157 @@
+"""
+State of the DogPicsBot that several bots hosted within the same process
+can share, along with the breed matching it relies on.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import os
+import random
+from typing import Callable, List, Optional, Sequence
+
+from assets import AssetBundle
+from cache import LRUCache
+from imagepool import ImagePool
+from recorder import UpdateRecorder
+from upstream import UpstreamClient
+from validation import ImageValidator
+
+
+def get_mentioned_breed(breeds, words):
+    """
+    Given a list of breeds and a list of words,
+    checks if any breed appears within the list of words
+    and returns the first successful case if so
+    """
+
+    for breed in breeds:
+        # the breed might be directly mentioned
+        # or it can be a substring (like)
+        for word in words:
+            if breed in word:
+                return breed
+
+    return None
+
+
+class BreedQueryMatcher:  # pylint: disable=too-few-public-methods
+    """
+    Memoizes which breed an inline query refers to, keyed by the query
+    text. Inline queries arrive once per typed character, so every prefix
+    of what the user types gets its own (cheap to reuse) entry.
+    """
+
+    __slots__ = ("breeds", "_matches")
+
+    def __init__(self, breeds: List[str], max_size: int = 4096):
+        self.breeds = breeds
+        self._matches = LRUCache(max_size)
+
+    def match(self, query: str) -> Optional[str]:
+        """
+        Returns the breed mentioned in the given query, if any. The last
+        word of the query is treated as a breed being typed, so "retr"
+        already matches "retriever".
+        """
+
+        key = " ".join(query.lower().split())
+        if key in self._matches:
+            return self._matches[key]
+
+        words = key.split()
+        breed = get_mentioned_breed(self.breeds, words)
+        if breed is None and words:
+            breed = next((b for b in self.breeds if b.startswith(words[-1])), None)
+
+        self._matches[key] = breed
+        return breed
+
+
+class SharedResources:  # pylint: disable=too-few-public-methods
+    """
+    State that several bots hosted within the same process can share: the
+    upstream client (and its HTTP connection pool), the list of breeds, the
+    validator of picture URLs, the bundle of fox and wolf pictures, and the
+    in-memory caches of pictures, breed matches and sticker categories.
+    """
+
+    __slots__ = (
+        "upstream",
+        "breeds",
+        "breed_matcher",
+        "validator",
+        "image_pool",
+        "assets",
+        "recorder",
+        "sticker_categories",
+    )
+
+    # Amount of pictures offered as a reply to an inline query, and how many
+    # upstream fetches may run at the same time to serve inline queries
+    INLINE_RESULTS_COUNT = 12
+    INLINE_MAX_CONCURRENT_FETCHES = 4
+
+    # Amount of stickers whose category is remembered
+    STICKER_CACHE_SIZE = 4096
+
+    def __init__(
+        self, upstream: Optional[UpstreamClient] = None, assets: Optional[AssetBundle] = None
+    ):
+        self.upstream = upstream or UpstreamClient()
+
+        # Set up by the startup pipeline, so that creating an instance does
+        # not touch the network
+        self.breeds: List[str] = []
+
+        # Inline queries are answered from memory whenever possible, with
+        # pictures that are checked in the background to be still alive
+        self.breed_matcher = BreedQueryMatcher(self.breeds)
+        self.validator = ImageValidator(self.upstream.is_reachable)
+        self.image_pool = ImagePool(
+            self.upstream.fetch_dog_pictures,
+            batch_size=self.INLINE_RESULTS_COUNT,
+            max_concurrent_fetches=self.INLINE_MAX_CONCURRENT_FETCHES,
+            validator=self.validator,
+        )
+
+        # Fox and wolf pictures are served from the local bundle, if it was
+        # built (see assets.py)
+        self.assets = assets or AssetBundle(os.environ.get("DPB_ASSETS_DIR") or "assets")
+
+        # Bots hosted by the same process append to a single recording, as
+        # several writers would interleave (and corrupt) the same file
+        record_path = os.environ.get("DPB_RECORD_UPDATES")
+        self.recorder = UpdateRecorder(record_path) if record_path else None
+
+        # Stickers are sent over and over, so their category is remembered
+        # by their unique file ID
+        self.sticker_categories = LRUCache(self.STICKER_CACHE_SIZE)
+
+    def load_breeds(self):
+        """
+        Fetches and stores in memory the list of searchable breeds, unless
+        it was already fetched (e.g. by another bot sharing these resources).
+        """
+
+        if not self.breeds:
+            self.breeds = self.upstream.fetch_breeds()
+            self.breed_matcher = BreedQueryMatcher(self.breeds)
+
+    async def get_pooled_picture(
+        self,
+        breed: Optional[str] = None,
+        exclude: Optional[str] = None,
+        choose: Callable[[Sequence[str]], str] = random.choice,
+    ) -> Optional[str]:
+        """
+        Returns a random picture URL (chosen through the given function) of
+        the given breed (if any) from the image pool, that is not known to be
+        dead, or None if there is none.
+        """
+
+        urls = [
+            url
+            for url in await self.image_pool.get(breed)
+            if url != exclude and not self.validator.is_dead(url)
+        ]
+        return choose(urls) if urls else None
@@ -0,0 +1,101 @@
+"""
+Helpers to keep the startup of the DogPicsBot fast and measurable: lazy
+imports of heavy modules, and timing of the startup pipeline.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import importlib
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+# Recorded before any other module of the bot is imported (bot.py imports
+# this module first, and third-party modules are imported lazily), so that
+# startup reports account for the time spent importing them
+PROCESS_STARTED_AT: float = time.perf_counter()
+
+
+class LazyModule:  # pylint: disable=too-few-public-methods
+    """
+    Stand-in for a module that is only imported the first time one of
+    its attributes is accessed. Keeps heavy dependencies (HTTP clients,
+    the Telegram stack) out of the import path of this module.
+    """
+
+    __slots__ = ("_name", "_module")
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+
+        return getattr(self._module, attribute)
+
+
+class StartupTimer:
+    """
+    Keeps track of how long each step of the startup pipeline takes,
+    and of how long it takes to handle the first update, relative to
+    the moment this module started loading.
+    """
+
+    __slots__ = ("origin", "steps", "milestones")
+
+    def __init__(self, origin: float = PROCESS_STARTED_AT):
+        self.origin = origin
+
+        # tuples of (step_name, duration_in_seconds)
+        self.steps: List[Tuple[str, float]] = []
+
+        # tuples of (milestone_name, seconds_since_origin)
+        self.milestones: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def step(self, name: str):
+        """
+        Context manager that times a startup step and records a milestone
+        once it finishes.
+        """
+
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - started_at))
+            self.mark(name)
+
+    def mark(self, name: str):
+        """
+        Records a milestone, measured since the origin of the timer.
+        """
+
+        self.milestones.append((name, time.perf_counter() - self.origin))
+
+    def elapsed(self, name: str) -> Optional[float]:
+        """
+        Returns the time since the origin at which the given milestone was
+        reached, or None if it has not been reached yet.
+        """
+
+        for milestone, seconds in self.milestones:
+            if milestone == name:
+                return seconds
+
+        return None
+
+    def report(self) -> str:
+        """
+        Returns a human-readable summary of the recorded steps and milestones.
+        """
+
+        lines = ["Startup report (milliseconds)"]
+        lines += [f"  step {name}: {seconds * 1000:.1f}" for name, seconds in self.steps]
+        lines += [f"  reached {name}: {seconds * 1000:.1f}" for name, seconds in self.milestones]
+        return "\n".join(lines)
+
+
+STARTUP_TIMER = StartupTimer()
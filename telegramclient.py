@@ -0,0 +1,177 @@
+"""
+Settings of the HTTP clients through which the DogPicsBot talks to
+Telegram's Bot API: one to send messages and pictures, and one to poll
+for updates.
+
+Every setting can be changed through environment variables, named after
+the setting with a prefix: DPB_TG_ for the client that sends messages
+(e.g. DPB_TG_POOL_SIZE) and DPB_TG_UPDATES_ for the one that polls for
+updates (e.g. DPB_TG_UPDATES_READ_TIMEOUT).
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import asyncio
+import dataclasses
+import importlib.util
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+HTTP_VERSIONS = ("1.1", "2")
+
+# How settings are parsed from the environment, other than as numbers
+SETTING_PARSERS = {"pool_size": int, "keepalive_connections": int, "http_version": str}
+
+
+class PooledHTTPXRequest(HTTPXRequest):
+    """
+    Request object whose pool timeout bounds the whole wait for one of its
+    connections. httpx on its own restarts that wait whenever a connection
+    is freed but taken by another request, so under contention requests
+    queue for as long as it takes instead of timing out.
+    """
+
+    __slots__ = ("_pool_timeout", "_connections")
+
+    def __init__(self, pool_size: int, pool_timeout: Optional[float], **kwargs):
+        super().__init__(connection_pool_size=pool_size, pool_timeout=pool_timeout, **kwargs)
+        self._pool_timeout = pool_timeout
+        self._connections = asyncio.Semaphore(pool_size)
+
+    async def do_request(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        url: str,
+        method: str,
+        request_data=None,
+        read_timeout=HTTPXRequest.DEFAULT_NONE,
+        write_timeout=HTTPXRequest.DEFAULT_NONE,
+        connect_timeout=HTTPXRequest.DEFAULT_NONE,
+        pool_timeout=HTTPXRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        if pool_timeout is HTTPXRequest.DEFAULT_NONE:
+            pool_timeout = self._pool_timeout
+
+        try:
+            await asyncio.wait_for(self._connections.acquire(), pool_timeout)
+        except asyncio.TimeoutError:
+            raise TimedOut("Pool timeout: every connection of the pool is busy.") from None
+
+        try:
+            return await super().do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout
+            )
+        finally:
+            self._connections.release()
+
+
+@dataclass(frozen=True)
+class RequestSettings:  # pylint: disable=too-many-instance-attributes
+    """
+    Settings of an HTTP client for Telegram's Bot API: size of its pool of
+    connections, timeouts (in seconds), HTTP version, and how many idle
+    connections are kept alive (by default, the whole pool) and for how
+    long (in seconds).
+    """
+
+    pool_size: int = 256
+    pool_timeout: float = 1.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 5.0
+    write_timeout: float = 5.0
+    http_version: str = "1.1"
+    keepalive_connections: Optional[int] = None
+    keepalive_expiry: float = 30.0
+
+    def __post_init__(self):
+        if self.pool_size < 1:
+            raise ValueError("The pool size must be at least 1.")
+        if self.http_version not in HTTP_VERSIONS:
+            raise ValueError(f"The HTTP version must be one of: {', '.join(HTTP_VERSIONS)}.")
+        if self.keepalive_connections is not None and self.keepalive_connections < 0:
+            raise ValueError("The amount of kept alive connections can't be negative.")
+
+        timeouts = (self.pool_timeout, self.connect_timeout, self.read_timeout, self.write_timeout)
+        if min(timeouts + (self.keepalive_expiry,)) < 0:
+            raise ValueError("Timeouts can't be negative.")
+
+    @classmethod
+    def from_environment(cls, prefix: str, **defaults) -> "RequestSettings":
+        """
+        Returns the settings on the environment variables with the given
+        prefix, falling back to the given defaults and then to the class
+        defaults. Raises a ValueError if any setting is not valid.
+        """
+
+        settings = dict(defaults)
+        for field in dataclasses.fields(cls):
+            name = f"{prefix}{field.name.upper()}"
+            value = os.environ.get(name, "").strip()
+            if not value:
+                continue
+
+            try:
+                settings[field.name] = SETTING_PARSERS.get(field.name, float)(value)
+            except ValueError:
+                raise ValueError(f"{name} is not valid: {value}") from None
+
+        return cls(**settings)
+
+    @property
+    def effective_http_version(self) -> str:
+        """
+        The HTTP version to use: HTTP/2 needs the optional `h2` package
+        (i.e. python-telegram-bot[http2]), and falls back to HTTP/1.1
+        without it.
+        """
+
+        if self.http_version == "2" and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 needs python-telegram-bot[http2], using HTTP/1.1")
+            return "1.1"
+
+        return self.http_version
+
+    def build_request(self) -> PooledHTTPXRequest:
+        """
+        Returns a request object for Telegram applications with these
+        settings.
+        """
+
+        limits = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        return PooledHTTPXRequest(
+            self.pool_size,
+            self.pool_timeout,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            write_timeout=self.write_timeout,
+            http_version=self.effective_http_version,
+            httpx_kwargs={"limits": limits},
+        )
+
+
+def get_request_settings() -> RequestSettings:
+    """
+    Returns the settings of the client that sends messages and pictures.
+    """
+
+    return RequestSettings.from_environment("DPB_TG_")
+
+
+def get_updates_request_settings() -> RequestSettings:
+    """
+    Returns the settings of the client that polls for updates, which only
+    needs a single connection (long polling requests run one at a time).
+    """
+
+    return RequestSettings.from_environment("DPB_TG_UPDATES_", pool_size=1)
@@ -4,48 +4,205 @@ Unit tests for the functions and classes implemented for the DogPicsBot.
 @author Andrés Ignacio Torres <dev@aitorres.com>
 """
 
-from dataclasses import dataclass, field
+# pylint: disable=too-many-lines
+
+import ast
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field, replace
 from random import randint
-from typing import List, Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 
 import pytest
-
+import requests
+from telegram.error import BadRequest
+from telegram.request import HTTPXRequest
+
+import assets
+import benchmarks
+from activity import ChatActivity, throttled_probability
+from admission import (
+    COMMAND_PRIORITY,
+    GROUP_CHAT_PRIORITY,
+    PRIVATE_CHAT_PRIORITY,
+    PriorityUpdateProcessor,
+    get_update_priority,
+)
+from assets import AssetBundle, build_bundle
 from bot import (
     DOG_SOUNDS,
-    DOGS_API_BREED_LIST_URL,
-    DOGS_API_DOG_PICTURE_URL,
     FOX_SOUNDS,
-    RANDOMFOX_API_URL,
+    STARTUP_TIMER,
     TELEGRAM_CHAT_TYPE_GROUP,
     WOLF_PICTURES,
     DogPicsBot,
+    get_admin_ids,
+    get_tokens,
+    main,
+    run_bots,
+)
+from botprofiling import HOT_PATH_FUNCTIONS, PROFILER, Profiler
+from cache import LRUCache
+from chatsettings import (
+    DEFAULT_CHAT_SETTINGS,
+    ChatSettings,
+    ChatSettingsStore,
+    ReplyCooldowns,
+    parse_setting,
+)
+from fakes import FakeTelegramServer, FakeUpstreamServer
+from hosting import start_application, stop_application
+from imagepool import ImagePool
+from randomness import ChoiceTable, RandomSource
+from ratelimit import TokenBucketRateLimiter
+from recorder import UpdateRecorder, pseudonymize, read_recording, redact
+from resources import BreedQueryMatcher, SharedResources
+from startup import StartupTimer
+from telegramclient import RequestSettings, get_request_settings, get_updates_request_settings
+from triggers import (
+    TriggerMatcher,
+    find_trigger_packs,
+    get_trigger_pack_locations,
+    load_trigger_matcher,
+    read_trigger_pack,
+)
+from upstream import (
+    DOGS_API_BREED_LIST_URL,
+    DOGS_API_DOG_PICTURE_URL,
+    DOGS_API_URL,
+    RANDOMFOX_API_URL,
+    RANDOMFOX_URL,
+    UpstreamClient,
 )
+from validation import ImageValidator
+
+
+@pytest.fixture(autouse=True)
+def in_memory_chat_settings(monkeypatch: pytest.MonkeyPatch):
+    """
+    Keeps chat settings stored in memory during tests, instead of on disk.
+    """
+
+    monkeypatch.setenv("DPB_SETTINGS_DB", ":memory:")
+
+
+@pytest.fixture(autouse=True)
+def no_asset_bundle(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    """
+    Keeps a locally built asset bundle from being used during tests.
+    """
+
+    monkeypatch.setenv("DPB_ASSETS_DIR", str(tmp_path / "assets"))
+
+
+@pytest.fixture(autouse=True)
+def offline_picture_checks(monkeypatch: pytest.MonkeyPatch):
+    """
+    Keeps picture URLs from being checked through live requests during
+    tests: URLs are dead if they say so.
+    """
+
+    monkeypatch.setattr("requests.Session.head", mock_session_head)
+
+
+@pytest.fixture(name="fake_upstream_server")
+def fixture_fake_upstream_server():
+    """
+    Runs a local fake of the Dog API and RandomFox during a test.
+    """
+
+    with FakeUpstreamServer(["pug", "collie", "dalmatian"]) as server:
+        yield server
+
+
+@pytest.fixture(name="fake_telegram_server")
+def fixture_fake_telegram_server():
+    """
+    Runs a local fake of Telegram's Bot API during a test.
+    """
+
+    with FakeTelegramServer() as server:
+        yield server
+
+
+@pytest.fixture(name="live_bot")
+def fixture_live_bot(
+    monkeypatch: pytest.MonkeyPatch,
+    fake_upstream_server: FakeUpstreamServer,
+    fake_telegram_server: FakeTelegramServer,
+):
+    """
+    Returns a bot, through its regular startup pipeline, that talks to the
+    local fake servers through real HTTP connections.
+    """
+
+    monkeypatch.setenv("DPB_TG_TOKEN", "123456:LIVE")
+    monkeypatch.setenv("DPB_TG_API_URL", fake_telegram_server.url)
+    monkeypatch.setenv("DPB_DOG_API_URL", fake_upstream_server.dogs_api_url)
+    monkeypatch.setenv("DPB_RANDOMFOX_URL", fake_upstream_server.randomfox_url)
+    monkeypatch.setenv("DPB_RECORD_UPDATES", "")
+
+    bot = DogPicsBot()
+    bot.startup()
+    return bot
 
 
 # Mocking Telegram's API
 @dataclass
-class MockApplication:
+class MockUpdater:
     """
-    Mock class to bypass Telegram's application on tests.
+    Mock class to bypass Telegram's updater on tests.
     """
 
-    _token: str = ""
-    handler_names: List[str] = field(default_factory=list)
+    running: bool = False
+    stop_loop_on_start: bool = False
 
-    def build(self):
+    async def start_polling(self):
         """
-        Fakes the process in which a Telegram bot is built.
+        Fakes the call to Telegram's updater's start_polling. Optionally,
+        stops the event loop shortly after, so hosting tests can finish.
         """
 
-        return self
+        self.running = True
+        if self.stop_loop_on_start:
+            loop = asyncio.get_running_loop()
+            loop.call_later(0.05, loop.stop)
 
-    def token(self, _token: str):
+    async def stop(self):
         """
-        Fakes the process in which a Telegram bot's token is set.
+        Fakes the call to Telegram's updater's stop.
         """
 
-        self._token = _token
-        return self
+        self.running = False
+
+
+@dataclass
+class MockApplication:  # pylint: disable=too-many-instance-attributes
+    """
+    Mock class to bypass Telegram's application on tests.
+    """
+
+    _token: str = ""
+    post_init: Optional[Callable] = None
+    update_processor: Optional[PriorityUpdateProcessor] = None
+    requests: Tuple[Optional[HTTPXRequest], Optional[HTTPXRequest]] = (None, None)
+    handler_names: List[str] = field(default_factory=list)
+    handler_groups: List[int] = field(default_factory=list)
+    handler_commands: List[str] = field(default_factory=list)
+    updater: MockUpdater = field(default_factory=MockUpdater)
+    running: bool = False
+    stopped: bool = False
+
+    # lifecycle calls, in order (e.g. "initialize" or "shutdown")
+    calls: List[str] = field(default_factory=list)
+
+    # tasks created through the application
+    tasks: List[asyncio.Task] = field(default_factory=list)
 
     @staticmethod
     def builder():
@@ -53,16 +210,18 @@ class MockApplication:
         Fakes the process in which a Telegram bot's builder is set.
         """
 
-        return MockApplication()
+        return MockApplicationBuilder()
 
-    def add_handler(self, handler):
+    def add_handler(self, handler, group=0):
         """
         Fakes the process in which a new handler is added to a Telegram
-        bot's dispatcher. Instead, stores the name of the new handler
-        on an instance level for further checks on tests.
+        bot's dispatcher. Instead, stores the name and group of the new
+        handler on an instance level for further checks on tests.
         """
 
         self.handler_names.append(str(handler.__class__))
+        self.handler_groups.append(group)
+        self.handler_commands.extend(getattr(handler, "commands", ()))
 
     def run_polling(self):
         """
@@ -71,6 +230,121 @@ class MockApplication:
         """
         return
 
+    def create_task(self, coroutine):
+        """
+        Fakes the call to Telegram's application's create_task, storing the
+        task for further checks on tests.
+        """
+
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.append(task)
+        return task
+
+    def stop_running(self):
+        """
+        Fakes the call to Telegram's application's stop_running, storing
+        that it happened for further checks on tests.
+        """
+
+        self.stopped = True
+
+    async def initialize(self):
+        """
+        Fakes the call to Telegram's application's initialize.
+        """
+
+        self.calls.append("initialize")
+
+    async def start(self):
+        """
+        Fakes the call to Telegram's application's start.
+        """
+
+        self.running = True
+        self.calls.append("start")
+
+    async def stop(self):
+        """
+        Fakes the call to Telegram's application's stop.
+        """
+
+        self.running = False
+        self.calls.append("stop")
+
+    async def shutdown(self):
+        """
+        Fakes the call to Telegram's application's shutdown.
+        """
+
+        self.calls.append("shutdown")
+
+
+@dataclass
+class MockApplicationBuilder:
+    """
+    Mock class to bypass Telegram's application builder on tests.
+    """
+
+    _token: str = ""
+    _post_init: Optional[Callable] = None
+    _update_processor: Optional[PriorityUpdateProcessor] = None
+    _request: Optional[HTTPXRequest] = None
+    _get_updates_request: Optional[HTTPXRequest] = None
+
+    def token(self, _token: str):
+        """
+        Fakes the process in which a Telegram bot's token is set.
+        """
+
+        self._token = _token
+        return self
+
+    def concurrent_updates(self, update_processor):
+        """
+        Fakes the process in which a Telegram bot's update processor is set.
+        """
+
+        self._update_processor = update_processor
+        return self
+
+    def request(self, request):
+        """
+        Fakes the process in which a Telegram bot's request object is set.
+        """
+
+        self._request = request
+        return self
+
+    def get_updates_request(self, request):
+        """
+        Fakes the process in which the request object a Telegram bot polls
+        for updates through is set.
+        """
+
+        self._get_updates_request = request
+        return self
+
+    def post_init(self, callback):
+        """
+        Fakes the process in which a Telegram bot's post initialization
+        callback is set.
+        """
+
+        self._post_init = callback
+        return self
+
+    def build(self):
+        """
+        Fakes the process in which a Telegram bot is built.
+        """
+
+        return MockApplication(
+            _token=self._token,
+            post_init=self._post_init,
+            update_processor=self._update_processor,
+            requests=(self._request, self._get_updates_request),
+        )
+
 
 @dataclass
 class MockChat:
@@ -81,6 +355,18 @@ class MockChat:
     type: str
 
 
+@dataclass
+class MockMessageEntity:
+    """
+    Mocks the information contained in Telegram's MessageEntity class for
+    tests.
+    """
+
+    type: str
+    offset: int
+    length: int
+
+
 @dataclass
 class MockSticker:
     """
@@ -88,6 +374,25 @@ class MockSticker:
     """
 
     emoji: Optional[str] = None
+    file_unique_id: Optional[str] = None
+
+
+@dataclass
+class MockUser:
+    """
+    Mocks the information contained in Telegram's User class for tests.
+    """
+
+    id: int  # pylint: disable=invalid-name
+
+
+@dataclass
+class MockChatMember:
+    """
+    Mocks the information contained in Telegram's ChatMember class for tests.
+    """
+
+    status: str
 
 
 @dataclass
@@ -101,6 +406,8 @@ class MockMessage:
     chat: MockChat
     text: str
     sticker: Optional[MockSticker] = None
+    from_user: MockUser = field(default_factory=lambda: MockUser(id=randint(0, 100000)))
+    entities: Tuple[MockMessageEntity, ...] = ()
 
 
 @dataclass
@@ -113,6 +420,57 @@ class MockUpdate:
     message: MockMessage
 
 
+@dataclass
+class MockInlineQuery:
+    """
+    Mocks the information contained in Telegram's InlineQuery class for
+    tests, storing every answer for further checks on tests.
+    """
+
+    query: str
+
+    # tuple of (results, cache_time)
+    answers: List[Tuple[list, int]] = field(default_factory=list)
+
+    async def answer(self, results, cache_time):
+        """
+        Pretends that the inline query is answered, instead stores the
+        answer on an instance level for further checks on tests.
+        """
+
+        self.answers.append((results, cache_time))
+
+
+@dataclass
+class MockInlineUpdate:
+    """
+    Mocks the information contained in Telegram's Update class for tests,
+    for updates that carry an inline query.
+    """
+
+    inline_query: MockInlineQuery
+
+
+@dataclass
+class MockPhotoSize:
+    """
+    Mocks the information contained in Telegram's PhotoSize class for tests.
+    """
+
+    file_id: str
+
+
+@dataclass
+class MockSentMessage:
+    """
+    Mocks the information contained in the messages sent through Telegram's
+    bot for tests.
+    """
+
+    message_id: int
+    photo: List[MockPhotoSize]
+
+
 @dataclass
 class MockContextBot:
     """
@@ -126,6 +484,24 @@ class MockContextBot:
     # tuple of (intended_chat_id, intented_reply_to_message_id, photo, caption)
     photos: List[Tuple[int, int, str, str]] = field(default_factory=list)
 
+    # tuple of (intended_chat_id, intented_reply_to_message_id, media)
+    albums: List[Tuple[int, int, list]] = field(default_factory=list)
+
+    # photos that Telegram fails to send, and the error it fails with
+    failing_photos: List[str] = field(default_factory=list)
+    photo_error: str = "Wrong type of the web page content"
+
+    # IDs of the users that are admins of every chat
+    admin_ids: List[int] = field(default_factory=list)
+
+    async def get_chat_member(self, chat_id, user_id):  # pylint: disable=unused-argument
+        """
+        Pretends to look up a member of a chat, who is an admin if their ID
+        is among `admin_ids`.
+        """
+
+        return MockChatMember(status="administrator" if user_id in self.admin_ids else "member")
+
     async def send_message(self, chat_id, text):
         """
         Pretends that a message is sent, instead stores it on an instance
@@ -134,13 +510,41 @@ class MockContextBot:
 
         self.messages.append((chat_id, text))
 
-    async def send_photo(self, chat_id, reply_to_message_id, photo, caption):
+    # tuple of (intended_chat_id, message_id) of deleted messages
+    deleted: List[Tuple[int, int]] = field(default_factory=list)
+
+    async def send_photo(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self, chat_id, photo, reply_to_message_id=None, caption=None, disable_notification=False
+    ):
         """
         Pretends that a message with a photo is sent, instead stores it
-        on an instance level for further checks on tests.
+        on an instance level for further checks on tests. Uploaded photos
+        get a made-up file ID.
         """
 
+        del disable_notification
+        if photo in self.failing_photos:
+            raise BadRequest(self.photo_error)
+
         self.photos.append((chat_id, reply_to_message_id, photo, caption))
+        file_id = f"file-{len(self.photos)}" if isinstance(photo, bytes) else photo
+        return MockSentMessage(message_id=len(self.photos), photo=[MockPhotoSize(file_id)])
+
+    async def delete_message(self, chat_id, message_id):
+        """
+        Pretends that a message is deleted, instead stores it on an
+        instance level for further checks on tests.
+        """
+
+        self.deleted.append((chat_id, message_id))
+
+    async def send_media_group(self, chat_id, reply_to_message_id, media):
+        """
+        Pretends that an album is sent, instead stores it on an instance
+        level for further checks on tests.
+        """
+
+        self.albums.append((chat_id, reply_to_message_id, media))
 
 
 @dataclass
@@ -150,6 +554,8 @@ class MockContext:
     """
 
     bot: MockContextBot
+    application: Optional[MockApplication] = None
+    args: List[str] = field(default_factory=list)
 
 
 @dataclass
@@ -161,6 +567,20 @@ class MockResponse:
 
     url: str
     timeout: int
+    status_code: int = 200
+
+    @property
+    def content(self) -> bytes:
+        """
+        Return made-up picture contents, namely the instance url
+        """
+
+        return self.url.encode()
+
+    def raise_for_status(self):
+        """
+        Pretend that the request succeeded
+        """
 
     def json(self):
         """
@@ -173,6 +593,12 @@ class MockResponse:
         if self.url == RANDOMFOX_API_URL:
             return {"image": "https://fox.pics/fox.png"}
 
+        if "/images/random/" in self.url or "/image/random/" in self.url:
+            # multi-image endpoints end with the amount of requested pictures
+            count = int(self.url.rsplit("/", 1)[1])
+            folder = "specific-breed/" if "breed/" in self.url else ""
+            return {"message": [f"https://dog.pics/{folder}dog{i}.png" for i in range(count)]}
+
         if self.url == DOGS_API_BREED_LIST_URL:
             return {
                 "message": {
@@ -188,6 +614,26 @@ class MockResponse:
         raise NotImplementedError("Test case not yet covered in `MockResponse`")
 
 
+def mock_session_get(_session, url, timeout):
+    """
+    Replacement for `requests.Session.get` on tests, that returns an
+    instance of MockResponse instead of making a live request.
+    """
+
+    return MockResponse(url=url, timeout=timeout)
+
+
+def mock_session_head(_session, url, timeout, allow_redirects):
+    """
+    Replacement for `requests.Session.head` on tests, that returns an
+    instance of MockResponse (that is not found, if the URL has "dead" in
+    it) instead of making a live request.
+    """
+
+    assert allow_redirects
+    return MockResponse(url=url, timeout=timeout, status_code=404 if "dead" in url else 200)
+
+
 def get_mock_bot(monkeypatch: pytest.MonkeyPatch):
     """
     Helper function that initializes and returns a mocked instance of the
@@ -195,9 +641,11 @@ def get_mock_bot(monkeypatch: pytest.MonkeyPatch):
     """
 
     monkeypatch.setenv("DPB_TG_TOKEN", "TEST_TOKEN_-_INVALID")
-    monkeypatch.setattr("bot.Application", MockApplication)
-    monkeypatch.setattr("requests.get", MockResponse)
-    return DogPicsBot()
+    monkeypatch.setattr("telegram.ext.Application", MockApplication)
+    monkeypatch.setattr("requests.Session.get", mock_session_get)
+    bot = DogPicsBot()
+    bot.fetch_breeds()
+    return bot
 
 
 def get_mock_update(
@@ -205,6 +653,7 @@ def get_mock_update(
     chat_type=TELEGRAM_CHAT_TYPE_GROUP,
     is_sticker=False,
     emoji=None,
+    file_unique_id=None,
 ):
     """
     Given chat and message information, returns an instance of MockUpdate.
@@ -212,24 +661,32 @@ def get_mock_update(
 
     chat = MockChat(type=chat_type)
 
+    # Telegram marks commands at the beginning of messages
+    entities = ()
+    if message.startswith("/"):
+        entities = (MockMessageEntity("bot_command", 0, len(message.split()[0])),)
+
     return MockUpdate(
         message=MockMessage(
             message_id=randint(0, 100000),
             chat_id=randint(0, 100000),
             chat=chat,
             text=message,
-            sticker=MockSticker(emoji=emoji) if is_sticker else None,
+            sticker=(
+                MockSticker(emoji=emoji, file_unique_id=file_unique_id) if is_sticker else None
+            ),
+            entities=entities,
         ),
         chat=chat,
     )
 
 
-def get_mock_context():
+def get_mock_context(args: Optional[List[str]] = None):
     """
     Returns a properly created instance of MockContext.
     """
 
-    return MockContext(bot=MockContextBot())
+    return MockContext(bot=MockContextBot(), args=args or [])
 
 
 # Code of actual tests
@@ -278,6 +735,60 @@ async def test_get_random_wolf_picture(monkeypatch: pytest.MonkeyPatch):
         assert bot.get_random_wolf_picture() in WOLF_PICTURES
 
 
+async def test_random_source():
+    """
+    Unit test to verify that seeded random sources are reproducible, and
+    that the sources spawned from them are too, while being independent
+    from each other.
+    """
+
+    table = ChoiceTable(DOG_SOUNDS)
+    first, second = RandomSource(7), RandomSource(7)
+
+    choices = [first.choice(table) for _ in range(50)]
+    assert choices == [second.choice(table) for _ in range(50)]
+    assert set(choices) == set(DOG_SOUNDS)
+    assert first.choice(["only"]) == "only"
+    assert first.chance(1.0) and not first.chance(0.0)
+
+    spawned = [RandomSource(7).spawn(key).random() for key in ("1", "1", "2")]
+    assert spawned[0] == spawned[1] != spawned[2]
+    assert RandomSource().spawn("1").seed is None
+
+    with pytest.raises(ValueError):
+        ChoiceTable([])
+
+
+async def test_bot_random_decisions_follow_seed(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the random decisions of bots follow the seed
+    given through the environment, per bot, or the source they are given.
+    """
+
+    monkeypatch.setenv("DPB_RANDOM_SEED", "42")
+    monkeypatch.setenv("DPB_TG_TOKEN", "123:A")
+    monkeypatch.setattr("telegram.ext.Application", MockApplication)
+    bots = [DogPicsBot(), DogPicsBot(), DogPicsBot("456:B"), DogPicsBot(rng=RandomSource(42))]
+
+    sounds = [[bot.get_random_fox_sound() for _ in range(20)] for bot in bots]
+    assert sounds[0] == sounds[1]
+    assert sounds[0] != sounds[2]
+    source = RandomSource(42)
+    assert sounds[3] == [source.choice(FOX_SOUNDS) for _ in range(20)]
+
+    # workers running the same bot follow streams of their own
+    worker_sounds = []
+    for worker in ("1", "2", "1"):
+        monkeypatch.setenv("DPB_WORKER_ID", worker)
+        bot = DogPicsBot()
+        worker_sounds.append([bot.get_random_fox_sound() for _ in range(20)])
+    assert worker_sounds[0] == worker_sounds[2]
+    assert worker_sounds[0] not in (worker_sounds[1], sounds[0])
+
+    monkeypatch.delenv("DPB_RANDOM_SEED")
+    assert DogPicsBot().rng.seed is None
+
+
 async def test_show_help(monkeypatch: pytest.MonkeyPatch):
     """
     Unit test to verify that the bot is sending the proper help information
@@ -527,43 +1038,104 @@ async def test_handle_text_messages_for_dog_sticker(
 
 
 @pytest.mark.parametrize(
-    "fox_message",
+    "emoji, expected_photo_url, expected_captions",
     [
-        "🦊",
-        "me gusta mucho este animal 🦊",
-        "foxes are the best",
-        "i saw a fennec the other day",
-        "do you have a fox?",
-        "mira un zorro!",
+        ("🦊", "https://fox.pics/fox.png", FOX_SOUNDS),
+        ("🐺", None, ["Howl!"]),
+        ("🐕\u200d🦺", "https://dog.pics/dog.png", DOG_SOUNDS),
+        ("🐶\ufe0f", "https://dog.pics/dog.png", DOG_SOUNDS),
     ],
 )
-async def test_handle_text_messages_for_fox_reference(
-    monkeypatch: pytest.MonkeyPatch, fox_message: str
+async def test_handle_stickers_for_other_animals(
+    monkeypatch: pytest.MonkeyPatch, emoji, expected_photo_url, expected_captions
 ):
     """
-    Unit test to verify that, in the presence of a message with a fox
-    reference, the bot replies with a random fox picture and a specific
-    caption.
+    Unit test to verify that fox and wolf stickers are replied to with the
+    matching animal, and that emoji sequences and variations are recognized.
     """
 
-    # instantiating mock bot
     bot = get_mock_bot(monkeypatch)
-    update = get_mock_update(message=fox_message)
+    update = get_mock_update(is_sticker=True, emoji=emoji)
     context = get_mock_context()
 
-    # context is empty of sent photos
-    assert len(context.bot.photos) == 0
-
-    await bot.handle_text_messages(update, context)
+    await bot.handle_stickers(update, context)
 
-    # one picture sent through context
     assert len(context.bot.photos) == 1
+    _, _, photo_url, caption = context.bot.photos[0]
+    assert photo_url == expected_photo_url or photo_url in WOLF_PICTURES
+    assert caption in expected_captions
 
-    # contains the chat_id, original message id, photo url and caption
-    chat_id, reply_to_message_id, photo_url, caption = context.bot.photos[0]
-    assert chat_id == update.message.chat_id
-    assert reply_to_message_id == update.message.message_id
-    assert photo_url == "https://fox.pics/fox.png"
+
+@pytest.mark.parametrize("emoji", ["🌵", "😢", None])
+async def test_handle_stickers_for_unrelated_stickers(monkeypatch: pytest.MonkeyPatch, emoji):
+    """
+    Unit test to verify that stickers unrelated to animals are ignored.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update(is_sticker=True, emoji=emoji)
+    context = get_mock_context()
+
+    await bot.handle_stickers(update, context)
+
+    assert len(context.bot.photos) == 0
+
+
+async def test_sticker_categories_are_cached(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the category of a sticker is remembered by its
+    unique file ID.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    sticker = MockSticker(emoji="🐩", file_unique_id="AgADpoodle")
+
+    assert bot.classify_sticker(sticker) == "dog"
+    assert bot.resources.sticker_categories["AgADpoodle"] == "dog"
+
+    # a cached category is used even if the sticker's emoji is not checked again
+    sticker.emoji = "🌵"
+    assert bot.classify_sticker(sticker) == "dog"
+
+
+@pytest.mark.parametrize(
+    "fox_message",
+    [
+        "🦊",
+        "me gusta mucho este animal 🦊",
+        "foxes are the best",
+        "i saw a fennec the other day",
+        "do you have a fox?",
+        "mira un zorro!",
+    ],
+)
+async def test_handle_text_messages_for_fox_reference(
+    monkeypatch: pytest.MonkeyPatch, fox_message: str
+):
+    """
+    Unit test to verify that, in the presence of a message with a fox
+    reference, the bot replies with a random fox picture and a specific
+    caption.
+    """
+
+    # instantiating mock bot
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update(message=fox_message)
+    context = get_mock_context()
+
+    # context is empty of sent photos
+    assert len(context.bot.photos) == 0
+
+    await bot.handle_text_messages(update, context)
+
+    # one picture sent through context
+    assert len(context.bot.photos) == 1
+
+    # contains the chat_id, original message id, photo url and caption
+    chat_id, reply_to_message_id, photo_url, caption = context.bot.photos[0]
+    assert chat_id == update.message.chat_id
+    assert reply_to_message_id == update.message.message_id
+    assert photo_url == "https://fox.pics/fox.png"
     assert caption in FOX_SOUNDS
 
 
@@ -629,7 +1201,8 @@ async def test_run_bot(monkeypatch: pytest.MonkeyPatch):
     # instantiating mock bot
     bot = get_mock_bot(monkeypatch)
 
-    assert len(bot.application.handler_names) == 0
+    # the application is only built by the startup pipeline
+    assert bot.application is None
     bot.run_bot()
 
     # ? we're actually only checking that we got the right amount
@@ -638,7 +1211,7 @@ async def test_run_bot(monkeypatch: pytest.MonkeyPatch):
     # ? information with either some introspection or attribute checks,
     # ? but it might not be needed for now
 
-    assert len(bot.application.handler_names) == 5
+    assert len(bot.application.handler_names) == 10
     assert bot.application.handler_names == [
         # /start
         "<class 'telegram.ext._handlers.commandhandler.CommandHandler'>",
@@ -646,8 +1219,1989 @@ async def test_run_bot(monkeypatch: pytest.MonkeyPatch):
         "<class 'telegram.ext._handlers.commandhandler.CommandHandler'>",
         # /dog
         "<class 'telegram.ext._handlers.commandhandler.CommandHandler'>",
+        # /settings
+        "<class 'telegram.ext._handlers.commandhandler.CommandHandler'>",
+        # /set
+        "<class 'telegram.ext._handlers.commandhandler.CommandHandler'>",
+        # /profile
+        "<class 'telegram.ext._handlers.commandhandler.CommandHandler'>",
+        # /stats
+        "<class 'telegram.ext._handlers.commandhandler.CommandHandler'>",
         # text messages
         "<class 'telegram.ext._handlers.messagehandler.MessageHandler'>",
         # stickers
         "<class 'telegram.ext._handlers.messagehandler.MessageHandler'>",
+        # inline queries
+        "<class 'telegram.ext._handlers.inlinequeryhandler.InlineQueryHandler'>",
+    ]
+
+    # commands handled by the bot are the ones prioritized by admission
+    assert set(bot.application.handler_commands) == DogPicsBot.COMMANDS
+
+
+def test_importing_bot_has_no_side_effects():
+    """
+    Unit test to verify that importing the bot module neither imports the
+    heavy third-party dependencies nor configures logging.
+    """
+
+    code = (
+        "import logging, sys; import bot; "
+        "heavy = [m for m in ('requests', 'dotenv', 'telegram') if m in sys.modules]; "
+        "print(heavy, logging.getLogger().handlers)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+
+    assert result.stdout.strip() == "[] []"
+
+
+def test_startup_timer_starts_before_other_imports():
+    """
+    Unit test to verify that the startup timer starts before the bot
+    imports any other module, so that their import time is accounted for.
+    """
+
+    code = (
+        "import sys; import bot; modules = list(sys.modules); "
+        "print(all(modules.index('startup') < modules.index(name) "
+        "for name in ('asyncio', 'activity', 'assets', 'chatsettings', 'triggers')))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+
+    assert result.stdout.strip() == "True"
+
+
+async def test_bot_instantiation_does_not_touch_the_network(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that creating a bot instance neither fetches breeds
+    nor builds the Telegram application.
+    """
+
+    def fail(*_args, **_kwargs):
+        raise AssertionError("The network should not be used")
+
+    monkeypatch.setenv("DPB_TG_TOKEN", "TEST_TOKEN_-_INVALID")
+    monkeypatch.setattr("requests.Session.get", fail)
+    monkeypatch.setattr("telegram.ext.Application", fail)
+
+    bot = DogPicsBot()
+
+    assert not bot.breeds
+    assert bot.application is None
+
+
+async def test_startup_timer_report():
+    """
+    Unit test to verify that the startup timer records steps and milestones
+    and includes them in its report.
+    """
+
+    timer = StartupTimer()
+    with timer.step("build_application"):
+        pass
+    timer.mark("first_update_handled")
+
+    assert [name for name, _ in timer.steps] == ["build_application"]
+    assert timer.elapsed("first_update_handled") >= timer.elapsed("build_application")
+    assert timer.elapsed("unknown") is None
+
+    report = timer.report()
+    assert "step build_application" in report
+    assert "reached first_update_handled" in report
+
+
+async def test_run_bot_measuring_startup(monkeypatch: pytest.MonkeyPatch, capsys):
+    """
+    Unit test to verify that, when measuring startup, the bot reports the
+    time to its first handled update and stops afterwards.
+    """
+
+    monkeypatch.setattr(STARTUP_TIMER, "steps", [])
+    monkeypatch.setattr(STARTUP_TIMER, "milestones", [])
+
+    bot = get_mock_bot(monkeypatch)
+    bot.run_bot(measure_startup=True)
+
+    # the extra handler runs after every regular handler
+    assert len(bot.application.handler_names) == 11
+    assert bot.application.handler_groups[-1] == 1
+    assert [name for name, _ in STARTUP_TIMER.steps] == [
+        "build_application",
+        "fetch_breeds",
+        "load_chat_settings",
+        "register_handlers",
+    ]
+
+    context = MockContext(bot=MockContextBot(), application=bot.application)
+    await bot.report_first_update(get_mock_update(), context)
+
+    assert bot.application.stopped
+    assert STARTUP_TIMER.elapsed("first_update_handled") is not None
+    assert "reached first_update_handled" in capsys.readouterr().out
+
+
+async def test_main(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the main procedure parses its arguments and
+    runs the bot.
+    """
+
+    calls = []
+    monkeypatch.setenv("DPB_TG_TOKEN", "TEST_TOKEN_-_INVALID")
+    monkeypatch.setattr("bot.configure_logging", lambda: None)
+    monkeypatch.setattr(
+        "bot.DogPicsBot.run_bot", lambda _self, measure_startup: calls.append(measure_startup)
+    )
+
+    main(["--measure-startup"])
+    main([])
+
+    assert calls == [True, False]
+
+
+async def test_main_with_single_token_list(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the main procedure runs a single bot with the
+    only token on DPB_TG_TOKENS, even if DPB_TG_TOKEN is not set.
+    """
+
+    tokens = []
+    monkeypatch.delenv("DPB_TG_TOKEN", raising=False)
+    monkeypatch.setenv("DPB_TG_TOKENS", "123:A")
+    monkeypatch.setattr("bot.configure_logging", lambda: None)
+    monkeypatch.setattr(
+        "bot.DogPicsBot.run_bot", lambda self, measure_startup: tokens.append(self.token)
+    )
+
+    main([])
+
+    assert tokens == ["123:A"]
+
+
+async def test_main_without_tokens(monkeypatch: pytest.MonkeyPatch, capsys):
+    """
+    Unit test to verify that the main procedure exits with a clear error if
+    no token was set.
+    """
+
+    monkeypatch.delenv("DPB_TG_TOKEN", raising=False)
+    monkeypatch.delenv("DPB_TG_TOKENS", raising=False)
+    monkeypatch.setattr("bot.configure_logging", lambda: None)
+    monkeypatch.setattr("dotenv.load_dotenv", lambda *args, **kwargs: None)
+
+    with pytest.raises(SystemExit):
+        main([])
+
+    assert "no token was found" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize(
+    "query, expected_breed",
+    [
+        ("", None),
+        ("pug", "pug"),
+        ("PUGS please", "pug"),
+        ("col", "collie"),
+        ("my border collie", "collie"),
+        ("cats", None),
+    ],
+)
+async def test_breed_query_matcher(query: str, expected_breed: Optional[str]):
+    """
+    Unit test to verify that inline queries are matched against breeds,
+    including breeds that are still being typed.
+    """
+
+    matcher = BreedQueryMatcher(["pug", "collie", "dalmatian"])
+
+    assert matcher.match(query) == expected_breed
+    # a second lookup is served from memory
+    assert matcher.match(query) == expected_breed
+
+
+async def test_breed_query_matcher_is_bounded():
+    """
+    Unit test to verify that the breed query matcher forgets its least
+    recently used queries once it's full.
+    """
+
+    matcher = BreedQueryMatcher(["pug"], max_size=2)
+    for query in ["p", "pu", "pug", "pu"]:
+        matcher.match(query)
+
+    assert list(matcher._matches.keys()) == ["pug", "pu"]  # pylint: disable=protected-access
+
+
+async def test_handle_inline_query(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that inline queries are answered with a grid of
+    pictures of the breed being typed, cached by Telegram.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    update = MockInlineUpdate(inline_query=MockInlineQuery(query="pu"))
+
+    await bot.handle_inline_query(update, get_mock_context())
+
+    assert len(update.inline_query.answers) == 1
+    results, cache_time = update.inline_query.answers[0]
+    assert cache_time == DogPicsBot.INLINE_CACHE_TIME
+    assert len(results) == SharedResources.INLINE_RESULTS_COUNT
+    assert len({result.id for result in results}) == len(results)
+    assert results[0].photo_url == "https://dog.pics/specific-breed/dog0.png"
+    assert results[0].caption in DOG_SOUNDS
+
+
+async def test_prewarm_image_pool(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the image pool is filled with pictures of any
+    breed before inline queries arrive.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    await bot.prewarm_image_pool(bot.application)
+
+    image_pool = bot.resources.image_pool
+    assert len(image_pool) == SharedResources.INLINE_RESULTS_COUNT
+    assert image_pool.is_fresh(None)
+    assert not image_pool.is_fresh("pug")
+
+
+async def test_image_pool_shares_fetches_and_caps_concurrency():
+    """
+    Unit test to verify that concurrent requests for the same breed share
+    a single upstream fetch, and that fetches for different breeds never
+    exceed the configured concurrency.
+    """
+
+    calls = []
+    running = []
+    lock = threading.Lock()
+
+    def fetch_batch(breed, count):
+        with lock:
+            running.append(breed)
+            calls.append((breed, max(len(running), 1)))
+        time.sleep(0.02)
+        with lock:
+            running.remove(breed)
+        return [f"{breed}-{i}" for i in range(count)]
+
+    pool = ImagePool(fetch_batch, batch_size=2, max_concurrent_fetches=2)
+    batches = await asyncio.gather(*(pool.get(breed) for breed in ["a", "a", "b", "c", "d"]))
+
+    assert batches[0] == batches[1] == ["a-0", "a-1"]
+    assert sorted(breed for breed, _ in calls) == ["a", "b", "c", "d"]
+    assert max(concurrency for _, concurrency in calls) <= 2
+
+    # fresh batches are served from memory
+    await pool.get("a")
+    assert len(calls) == 4
+
+
+async def test_image_pool_serves_stale_batches_while_refreshing():
+    """
+    Unit test to verify that stale batches are still served, while a new
+    batch is fetched in the background.
+    """
+
+    fetched = []
+
+    def fetch_batch(breed, count):
+        fetched.append(breed)
+        if len(fetched) > 2:
+            raise RuntimeError("upstream is down")
+        return [f"{breed}-{len(fetched)}"] * count
+
+    pool = ImagePool(fetch_batch, batch_size=1, ttl=0.0)
+
+    assert await pool.get() == ["None-1"]
+    assert await pool.get() == ["None-1"]
+    await asyncio.sleep(0.05)
+    assert await pool.get() == ["None-2"]
+
+    # a failed background refresh keeps the stale batch around
+    await asyncio.sleep(0.05)
+    assert await pool.get() == ["None-2"]
+
+
+@pytest.mark.parametrize(
+    "args, expected",
+    [
+        ([], (1, None)),
+        (["pug"], (1, "pug")),
+        (["3"], (3, None)),
+        (["3", "Pug"], (3, "pug")),
+        (["0"], (1, None)),
+        (["500", "collie"], (DogPicsBot.DOG_COMMAND_MAX_PICTURES, "collie")),
+        (["-2"], (1, None)),
+        (["²"], (1, None)),
+        (["٣", "pug"], (1, "pug")),
+    ],
+)
+async def test_parse_dog_command_args(monkeypatch: pytest.MonkeyPatch, args, expected):
+    """
+    Unit test to verify that the amount of pictures and the breed are
+    properly read from the arguments of the /dog command.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+
+    assert bot.parse_dog_command_args(args) == expected
+
+
+async def test_handle_dog_command_with_a_single_picture(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that a plain /dog command replies with a single photo.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update(message="/dog")
+    context = get_mock_context()
+
+    await bot.handle_dog_command(update, context)
+
+    assert len(context.bot.photos) == 1
+    assert len(context.bot.albums) == 0
+    _, _, photo_url, caption = context.bot.photos[0]
+    assert photo_url == "https://dog.pics/dog.png"
+    assert caption in DOG_SOUNDS
+
+
+async def test_handle_dog_command_with_several_pictures(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that /dog N fetches all pictures through a single
+    upstream request, and replies with a single album.
+    """
+
+    requested_urls = []
+
+    def get(session, url, timeout):
+        requested_urls.append(url)
+        return mock_session_get(session, url, timeout)
+
+    bot = get_mock_bot(monkeypatch)
+    monkeypatch.setattr("requests.Session.get", get)
+    update = get_mock_update(message="/dog 4 pug")
+    context = get_mock_context(args=["4", "pug"])
+
+    await bot.handle_dog_command(update, context)
+
+    assert requested_urls == ["https://dog.ceo/api/breed/pug/images/random/4"]
+    assert len(context.bot.photos) == 0
+    assert len(context.bot.albums) == 1
+
+    chat_id, reply_to_message_id, media = context.bot.albums[0]
+    assert chat_id == update.message.chat_id
+    assert reply_to_message_id == update.message.message_id
+    assert [photo.media for photo in media] == [
+        f"https://dog.pics/specific-breed/dog{i}.png" for i in range(4)
     ]
+    assert media[0].caption in DOG_SOUNDS
+    assert all(photo.caption is None for photo in media[1:])
+
+
+@pytest.mark.parametrize("image_urls", [[], ["https://dog.pics/specific-breed/dog0.png"]])
+async def test_handle_dog_command_with_too_few_pictures(
+    monkeypatch: pytest.MonkeyPatch, image_urls
+):
+    """
+    Unit test to verify that /dog N sends a single photo instead of an album
+    when the Dog API returns a single picture, and nothing if it returns none.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    monkeypatch.setattr(
+        "upstream.UpstreamClient.fetch_dog_pictures",
+        lambda self, breed=None, count=1: list(image_urls),
+    )
+    update = get_mock_update(message="/dog 4 pug")
+    context = get_mock_context(args=["4", "pug"])
+
+    await bot.handle_dog_command(update, context)
+
+    assert len(context.bot.albums) == 0
+    assert [photo[2] for photo in context.bot.photos] == image_urls
+
+
+async def test_handle_dog_command_is_rate_limited(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that every picture asked for through /dog is charged
+    to the chat, and that the command is ignored once the budget runs out.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update(message="/dog 10")
+    context = get_mock_context(args=["10"])
+
+    for _ in range(3):
+        await bot.handle_dog_command(update, context)
+
+    assert DogPicsBot.PICTURE_BURST == 20
+    assert len(context.bot.albums) == 2
+
+
+async def test_token_bucket_rate_limiter():
+    """
+    Unit test to verify that the token bucket rate limiter refills over time,
+    tracks keys independently and forgets the least recently seen keys.
+    """
+
+    now = [0.0]
+    limiter = TokenBucketRateLimiter(capacity=2, refill_rate=1, max_keys=2, clock=lambda: now[0])
+
+    assert limiter.try_acquire("a", 2)
+    assert not limiter.try_acquire("a")
+    assert limiter.try_acquire("b")
+
+    now[0] = 1.5
+    assert limiter.tokens("a") == 1.5
+    assert limiter.try_acquire("a")
+    assert not limiter.try_acquire("a")
+
+    # "b" is forgotten, and comes back with a full bucket
+    limiter.try_acquire("c")
+    assert limiter.tokens("b") == 2
+
+
+async def test_trigger_matcher():
+    """
+    Unit test to verify that the trigger matcher finds every category of
+    trigger that words start with, and classifies emojis by precedence.
+    """
+
+    matcher = TriggerMatcher(
+        (
+            ("fox", ["🦊", "fox"]),
+            ("dog", ["🐶", "🐕‍🦺", "dog", "do"]),
+        )
+    )
+
+    assert matcher.match(["doggo"]) == {"dog"}
+    assert matcher.match(["foxy", "dogs"]) == {"fox", "dog"}
+    assert matcher.match(["d", "cat", ""]) == frozenset()
+    assert matcher.match(["🦊🐶"]) == {"fox"}
+
+    assert matcher.classify_emoji("🦊") == "fox"
+    assert matcher.classify_emoji("🐶🦊") == "fox"
+    assert matcher.classify_emoji("🐕‍🦺\ufe0f") == "dog"
+    assert matcher.classify_emoji("🌵") is None
+
+
+async def test_trigger_packs(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    """
+    Unit test to verify that trigger packs found on DPB_TRIGGER_PACKS are
+    compiled into the shared matcher along with the built-in packs, and
+    that invalid packs are rejected.
+    """
+
+    (tmp_path / "pt.json").write_text(
+        '{"name": "Português", "triggers": {"dog": ["Cachorr"], "wolf": ["lobo"]}}',
+        encoding="utf-8",
+    )
+    (tmp_path / "README.md").write_text("Not a pack", encoding="utf-8")
+    monkeypatch.setenv("DPB_TRIGGER_PACKS", f"{tmp_path}, ")
+
+    locations = get_trigger_pack_locations()
+    assert find_trigger_packs(locations[1:]) == [str(tmp_path / "pt.json")]
+    assert read_trigger_pack(str(tmp_path / "pt.json")) == {"dog": ["cachorr"], "wolf": ["lobo"]}
+
+    matcher = load_trigger_matcher(locations)
+    assert matcher is load_trigger_matcher(locations)
+    assert matcher.match(["cachorrinho"]) == {"dog"}
+    assert matcher.match(["lomito", "😢", "fennec"]) == {"dog", "sad", "fox"}
+    assert matcher.classify_emoji("🐺") == "wolf"
+    assert not load_trigger_matcher().match(["cachorrinho"])
+
+    invalid_packs = (
+        '["dog"]',
+        '{"triggers": {"cat": ["meow"]}}',
+        '{"triggers": {"dog": "dog"}}',
+        '{"triggers": {"dog": [""]}}',
+    )
+    for index, invalid_pack in enumerate(invalid_packs):
+        path = tmp_path / f"invalid-{index}.json"
+        path.write_text(invalid_pack, encoding="utf-8")
+        with pytest.raises(ValueError):
+            read_trigger_pack(str(path))
+
+
+async def test_lru_cache():
+    """
+    Unit test to verify that the LRU cache forgets its least recently used
+    entries first.
+    """
+
+    cache = LRUCache(max_size=2)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache["a"] == 1
+
+    cache["c"] = 3
+    assert "b" not in cache
+    assert len(cache) == 2
+    assert list(cache.keys()) == ["a", "c"]
+    assert cache.pop("a") == 1
+    assert cache.pop("a") is None
+
+
+async def test_bot_state_is_compact_and_shared(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that bot instances have no per-instance dictionary,
+    and that immutable configuration is shared among every instance.
+    """
+
+    first_bot = get_mock_bot(monkeypatch)
+    second_bot = get_mock_bot(monkeypatch)
+
+    assert not hasattr(first_bot, "__dict__")
+    assert (
+        first_bot.trigger_matcher
+        is second_bot.trigger_matcher
+        is load_trigger_matcher(get_trigger_pack_locations())
+    )
+    assert isinstance(DOG_SOUNDS, tuple)
+    assert isinstance(FOX_SOUNDS, tuple)
+    assert isinstance(WOLF_PICTURES, tuple)
+
+    with pytest.raises(AttributeError):
+        first_bot.dog_triggers = ["woof"]  # pylint: disable=assigning-non-slot
+
+
+async def test_memory_benchmark(capsys):
+    """
+    Unit test to verify that the memory benchmark runs and reports both
+    per-instance memory and per-worker RSS.
+    """
+
+    benchmarks.main(["memory", "--instances", "10"])
+    output = capsys.readouterr().out
+
+    assert '"bytes_per_instance"' in output
+    assert '"worker_rss_kib"' in output
+
+
+async def test_triggers_benchmark(capsys):
+    """
+    Unit test to verify that the triggers benchmark runs with the built-in
+    packs and with many more packs loaded.
+    """
+
+    benchmarks.main(["triggers", "--packs", "20", "--messages", "50", "--rounds", "1"])
+    results = json.loads(capsys.readouterr().out)["triggers"]
+
+    assert results["with_packs"]["packs"] == results["builtin"]["packs"] + 20
+    assert results["with_packs"]["triggers"] > results["builtin"]["triggers"]
+    assert results["with_packs"]["matcher_us_per_message"] > 0
+
+
+@pytest.mark.parametrize(
+    "environment, expected_tokens",
+    [
+        ({"DPB_TG_TOKEN": "A"}, ["A"]),
+        ({"DPB_TG_TOKEN": "A", "DPB_TG_TOKENS": "B, C,,"}, ["B", "C"]),
+        ({}, []),
+    ],
+)
+async def test_get_tokens(monkeypatch: pytest.MonkeyPatch, environment, expected_tokens):
+    """
+    Unit test to verify that several tokens can be read from the environment.
+    """
+
+    monkeypatch.delenv("DPB_TG_TOKEN", raising=False)
+    monkeypatch.delenv("DPB_TG_TOKENS", raising=False)
+    for name, value in environment.items():
+        monkeypatch.setenv(name, value)
+
+    assert get_tokens() == expected_tokens
+
+
+async def test_bots_share_resources(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that bots sharing resources fetch the list of breeds
+    and prewarm the image pool only once.
+    """
+
+    requested_urls = []
+
+    def get(session, url, timeout):
+        requested_urls.append(url)
+        return mock_session_get(session, url, timeout)
+
+    monkeypatch.setattr("telegram.ext.Application", MockApplication)
+    monkeypatch.setattr("requests.Session.get", get)
+
+    resources = SharedResources()
+    bots = [DogPicsBot(token, resources) for token in ["A", "B", "C"]]
+    for bot in bots:
+        bot.startup()
+        await bot.prewarm_image_pool(bot.application)
+
+    assert [bot.token for bot in bots] == ["A", "B", "C"]
+    assert len({id(bot.application) for bot in bots}) == 3
+    assert all(bot.breeds == ["pug", "collie", "dalmatian"] for bot in bots)
+    assert len(requested_urls) == 2
+
+
+def test_run_bots(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that several bots are started within the same event
+    loop, and properly stopped and shut down once the loop stops.
+    """
+
+    monkeypatch.setattr("telegram.ext.Application", MockApplication)
+    monkeypatch.setattr("requests.Session.get", mock_session_get)
+
+    resources = SharedResources()
+    bots = [DogPicsBot(token, resources) for token in ["A", "B"]]
+
+    # the last bot to start stops the event loop shortly after
+    original_startup = DogPicsBot.startup
+
+    def startup(bot, measure_startup=False):
+        original_startup(bot, measure_startup)
+        bot.application.updater.stop_loop_on_start = bot.token == "B"
+
+    monkeypatch.setattr(DogPicsBot, "startup", startup)
+
+    # run_bots closes its own event loop, the one of the tests is restored
+    tests_loop = asyncio.get_event_loop_policy().get_event_loop()
+    try:
+        run_bots(bots)
+    finally:
+        asyncio.set_event_loop(tests_loop)
+
+    for bot in bots:
+        assert bot.application.calls == ["initialize", "start", "stop", "shutdown"]
+        assert not bot.application.updater.running
+    assert len(resources.image_pool) == SharedResources.INLINE_RESULTS_COUNT
+
+
+async def test_main_with_several_tokens(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the main procedure hosts several bots within
+    the same process, sharing their resources, if several tokens are set.
+    """
+
+    hosted = []
+    monkeypatch.setenv("DPB_TG_TOKENS", "A,B,C")
+    monkeypatch.setattr("bot.configure_logging", lambda: None)
+    monkeypatch.setattr(
+        "bot.run_bots", lambda bots, measure_startup: hosted.append((bots, measure_startup))
+    )
+
+    main([])
+
+    bots, measure_startup = hosted[0]
+    assert [bot.token for bot in bots] == ["A", "B", "C"]
+    assert len({id(bot.resources) for bot in bots}) == 1
+    assert not measure_startup
+
+
+@pytest.mark.parametrize(
+    "name, value, expected_changes",
+    [
+        ("probability", "0.25", {"probability": 0.25}),
+        ("probability", "default", {"probability": None}),
+        ("animals", "Dog, fox", {"animals": frozenset({"dog", "fox"})}),
+        ("cooldown", "30", {"cooldown": 30.0}),
+    ],
+)
+async def test_parse_setting(name: str, value: str, expected_changes: dict):
+    """
+    Unit test to verify that settings typed by users are properly parsed.
+    """
+
+    assert parse_setting(name, value) == expected_changes
+
+
+@pytest.mark.parametrize(
+    "name, value",
+    [
+        ("probability", "2"),
+        ("probability", "often"),
+        ("animals", "dog,cat"),
+        ("cooldown", "-1"),
+        ("cooldown", "1000000"),
+        ("color", "brown"),
+    ],
+)
+async def test_parse_setting_rejects_invalid_values(name: str, value: str):
+    """
+    Unit test to verify that invalid settings are rejected.
+    """
+
+    with pytest.raises(ValueError):
+        parse_setting(name, value)
+
+
+async def test_chat_settings():
+    """
+    Unit test to verify that chat settings enable sad triggers along with
+    dogs, and are described in a human-readable way.
+    """
+
+    assert DEFAULT_CHAT_SETTINGS.enabled_triggers == {"dog", "fox", "wolf", "sad"}
+    assert ChatSettings(animals=frozenset({"fox"})).enabled_triggers == {"fox"}
+
+    description = ChatSettings(probability=0.5, animals=frozenset(), cooldown=60).describe()
+    assert description == "probability: 0.5\nanimals: none\ncooldown: 60 seconds"
+
+
+async def test_chat_settings_store(tmp_path):
+    """
+    Unit test to verify that chat settings are persisted per namespace, and
+    read from memory once loaded.
+    """
+
+    path = str(tmp_path / "settings.sqlite3")
+    store = ChatSettingsStore(path, namespace="A")
+    other_store = ChatSettingsStore(path, namespace="B")
+
+    assert await store.get(1) is DEFAULT_CHAT_SETTINGS
+    settings = await store.update(1, probability=0.5)
+    assert settings == ChatSettings(probability=0.5)
+    assert await store.update(2, cooldown=10) == ChatSettings(cooldown=10)
+    assert await other_store.get(1) is DEFAULT_CHAT_SETTINGS
+
+    # a fresh store with a single-entry cache reads the rest from disk
+    reloaded_store = ChatSettingsStore(path, namespace="A", cache_size=1)
+    reloaded_store.preload()
+    assert len(reloaded_store._cache) == 1  # pylint: disable=protected-access
+    assert await reloaded_store.get(1) == ChatSettings(probability=0.5)
+    assert await reloaded_store.get(2) == ChatSettings(cooldown=10)
+    assert await reloaded_store.get(3) is DEFAULT_CHAT_SETTINGS
+
+    await reloaded_store.reset(1)
+    assert await reloaded_store.get(1) is DEFAULT_CHAT_SETTINGS
+
+    fresh_store = ChatSettingsStore(path, namespace="A")
+    fresh_store.preload()
+    assert await fresh_store.get(1) is DEFAULT_CHAT_SETTINGS
+    assert await fresh_store.get(2) == ChatSettings(cooldown=10)
+
+
+async def test_reply_cooldowns():
+    """
+    Unit test to verify that reply cooldowns expire, and are only
+    remembered for the most recently active chats.
+    """
+
+    now = [0.0]
+    cooldowns = ReplyCooldowns(max_chats=2, clock=lambda: now[0])
+
+    assert not cooldowns.is_cooling_down(1, 10)
+    cooldowns.record_reply(1)
+    assert cooldowns.is_cooling_down(1, 10)
+    assert not cooldowns.is_cooling_down(1, 0)
+
+    now[0] = 10.0
+    assert not cooldowns.is_cooling_down(1, 10)
+
+    cooldowns.record_reply(1)
+    cooldowns.record_reply(2)
+    cooldowns.record_reply(3)
+    assert not cooldowns.is_cooling_down(1, 10)
+    assert cooldowns.is_cooling_down(3, 10)
+
+
+async def test_handle_messages_with_disabled_animals(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the bot does not reply with animals disabled
+    on the chat, neither to messages nor to stickers.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    context = get_mock_context()
+
+    update = get_mock_update(message="look a fox and a dog")
+    await bot.chat_settings.update(update.message.chat_id, animals=frozenset({"dog"}))
+    await bot.handle_text_messages(update, context)
+    assert [photo for _, _, photo, _ in context.bot.photos] == ["https://dog.pics/dog.png"]
+
+    update = get_mock_update(is_sticker=True, emoji="🦊")
+    await bot.chat_settings.update(update.message.chat_id, animals=frozenset({"dog"}))
+    await bot.handle_stickers(update, context)
+    assert len(context.bot.photos) == 1
+
+    update = get_mock_update(message="I'm so sad", chat_type="private")
+    await bot.chat_settings.update(update.message.chat_id, animals=frozenset())
+    await bot.handle_text_messages(update, context)
+    assert len(context.bot.photos) == 1
+
+
+async def test_handle_messages_with_cooldown(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the bot stays quiet on a chat while its reply
+    cooldown lasts.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    context = get_mock_context()
+    update = get_mock_update(message="I love dogs")
+    await bot.chat_settings.update(update.message.chat_id, cooldown=60)
+
+    await bot.handle_text_messages(update, context)
+    await bot.handle_text_messages(update, context)
+    update.message.sticker = MockSticker(emoji="🐶")
+    await bot.handle_stickers(update, context)
+
+    assert len(context.bot.photos) == 1
+
+
+async def test_handle_sad_messages_with_chat_probability(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the sad message response probability of a chat
+    overrides the bot-wide one.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    bot.sad_message_response_probability = 1.0
+    context = get_mock_context()
+    update = get_mock_update(message="I'm so sad")
+    await bot.chat_settings.update(update.message.chat_id, probability=0.0)
+
+    await bot.handle_text_messages(update, context)
+
+    assert len(context.bot.photos) == 0
+
+
+async def test_show_settings(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the bot sends the settings of a chat.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update()
+    context = get_mock_context()
+
+    await bot.show_settings(update, context)
+
+    assert context.bot.messages == [
+        (update.message.chat_id, f"Settings for this chat:\n{DEFAULT_CHAT_SETTINGS.describe()}")
+    ]
+
+
+@pytest.mark.parametrize(
+    "args, expected_settings",
+    [
+        (["cooldown", "30"], ChatSettings(cooldown=30)),
+        (["animals", "fox"], ChatSettings(animals=frozenset({"fox"}))),
+        (["reset"], DEFAULT_CHAT_SETTINGS),
+    ],
+)
+async def test_change_settings_as_admin(
+    monkeypatch: pytest.MonkeyPatch, args: List[str], expected_settings: ChatSettings
+):
+    """
+    Unit test to verify that group admins can change the settings of a chat.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update()
+    context = get_mock_context(args)
+    context.bot.admin_ids.append(update.message.from_user.id)
+    await bot.chat_settings.update(update.message.chat_id, probability=0.5)
+
+    await bot.change_settings(update, context)
+
+    if args != ["reset"]:
+        expected_settings = replace(expected_settings, probability=0.5)
+    assert await bot.chat_settings.get(update.message.chat_id) == expected_settings
+    assert len(context.bot.messages) == 1
+
+
+@pytest.mark.parametrize(
+    "chat_type, args, expected_message",
+    [
+        ("group", ["cooldown", "30"], "Only chat admins can change my settings. Woof!"),
+        ("private", ["cooldown", "soon"], "The cooldown must be between 0 and 86400 seconds."),
+        ("private", ["cooldown"], "Usage: /set"),
+    ],
+)
+async def test_change_settings_is_rejected(
+    monkeypatch: pytest.MonkeyPatch, chat_type: str, args: List[str], expected_message: str
+):
+    """
+    Unit test to verify that settings are left untouched when changed by
+    someone who is not an admin, or to invalid values.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update(chat_type=chat_type)
+    context = get_mock_context(args)
+
+    await bot.change_settings(update, context)
+
+    assert await bot.chat_settings.get(update.message.chat_id) is DEFAULT_CHAT_SETTINGS
+    _, sent_message = context.bot.messages[0]
+    assert sent_message.startswith(expected_message)
+
+
+async def test_chat_activity():
+    """
+    Unit test to verify that chat activity is counted over a sliding window,
+    and only remembered for the most recently active chats.
+    """
+
+    now = [0.0]
+    activity = ChatActivity(window=60, buckets=6, max_chats=2, clock=lambda: now[0])
+
+    assert activity.messages(1) == 0
+    assert [activity.record(1) for _ in range(3)] == [1, 2, 3]
+
+    now[0] = 30.0
+    assert activity.record(1) == 4
+
+    # the first three messages fall out of the window, the last one doesn't
+    now[0] = 65.0
+    assert activity.messages(1) == 1
+    now[0] = 500.0
+    assert activity.messages(1) == 0
+
+    activity.record(2)
+    activity.record(3)
+    activity.record(1)
+    assert activity.messages(2) == 0
+
+
+@pytest.mark.parametrize(
+    "probability, messages, replies, expected_probability",
+    [
+        (0.8, 1, 0, 0.8),
+        (0.8, 5, 0, 0.8),
+        (1.0, 10, 0, 0.5),
+        (0.2, 10, 0, 0.2),
+        (1.0, 500, 0, 0.01),
+        (1.0, 10, 3, 0.2),
+        (0.8, 2, 3, 0.8),
+        (1.0, 1, 5, 0.0),
+        (1.0, 10, 7, 0.0),
+    ],
+)
+async def test_throttled_probability(probability, messages, replies, expected_probability):
+    """
+    Unit test to verify that reply probabilities are lowered on busy chats,
+    down to zero once the reply budget is spent.
+    """
+
+    assert throttled_probability(probability, messages, 5, replies) == expected_probability
+
+
+async def test_sad_messages_are_throttled_on_busy_chats(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the bot replies to fewer sad messages as a chat
+    gets busier, staying around its reply budget.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    bot.rng = RandomSource(7)
+    bot.sad_message_response_probability = 1.0
+    context = get_mock_context()
+    update = get_mock_update(message="I'm so sad")
+    chat_id = update.message.chat_id
+
+    for _ in range(200):
+        await bot.handle_text_messages(update, context)
+
+    assert bot.activity.messages(chat_id) == 200
+    assert bot.sad_replies.messages(chat_id) == len(context.bot.photos)
+    assert len(context.bot.photos) == bot.SAD_REPLY_BUDGET
+
+
+async def test_sad_reply_budget_holds_over_time(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that a chat getting a sad message every second gets
+    no more than the reply budget in any window (which, being counted in
+    buckets, is at least a bucket shorter than SAD_REPLY_WINDOW).
+    """
+
+    now = [0.0]
+    bot = get_mock_bot(monkeypatch)
+    bot.rng = RandomSource(11)
+    bot.activity = ChatActivity(bot.SAD_REPLY_WINDOW, clock=lambda: now[0])
+    bot.sad_replies = ChatActivity(bot.SAD_REPLY_WINDOW, clock=lambda: now[0])
+    bot.sad_message_response_probability = 1.0
+    context = get_mock_context()
+    update = get_mock_update(message="I'm so sad")
+
+    replied_at = []
+    for second in range(3 * bot.SAD_REPLY_WINDOW):
+        now[0] = float(second)
+        photos = len(context.bot.photos)
+        await bot.handle_text_messages(update, context)
+        if len(context.bot.photos) > photos:
+            replied_at.append(second)
+
+    span = bot.SAD_REPLY_WINDOW - bot.sad_replies.bucket_width
+    assert replied_at
+    for start in replied_at:
+        window = [at for at in replied_at if start <= at < start + span]
+        assert len(window) <= bot.SAD_REPLY_BUDGET
+
+
+async def test_only_sad_messages_count_towards_the_budget(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that other messages on a chat don't lower the chance
+    of replying to its sad messages.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    context = get_mock_context()
+
+    for _ in range(50):
+        await bot.handle_text_messages(get_mock_update(message="nice weather today"), context)
+
+    assert bot.activity.messages(get_mock_update().message.chat_id) == 0
+
+
+async def test_sad_replies_are_reproducible(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that bots with equally seeded random sources reply
+    to the same sad messages.
+    """
+
+    runs = []
+    for _ in range(2):
+        bot = get_mock_bot(monkeypatch)
+        bot.rng = RandomSource(3)
+        bot.sad_message_response_probability = 0.5
+        context = get_mock_context()
+        update = get_mock_update(message="I'm so sad")
+
+        replied = []
+        for _ in range(30):
+            photos = len(context.bot.photos)
+            await bot.handle_text_messages(update, context)
+            replied.append(len(context.bot.photos) > photos)
+        runs.append(replied)
+
+    assert runs[0] == runs[1]
+    assert 0 < sum(runs[0]) < 30
+
+
+async def test_redact():
+    """
+    Unit test to verify that recorded updates are stripped of personal data,
+    while keeping what the bot reacts to.
+    """
+
+    update = {
+        "update_id": 1,
+        "message": {
+            "message_id": 2,
+            "chat": {"id": -100, "type": "group", "title": "Dog lovers"},
+            "from": {"id": 7, "is_bot": False, "first_name": "Ann", "username": "ann"},
+            "text": "@bob look at my pug",
+            "reply_to_message": {"from": {"id": 7, "first_name": "Ann", "last_name": "Lee"}},
+            "new_chat_members": [{"id": 8, "is_bot": False, "first_name": "Bob"}],
+            "left_chat_member": {"id": 9, "is_bot": False, "first_name": "Cy"},
+            "forward_origin": {"type": "user", "sender_user": {"id": 10, "first_name": "Di"}},
+            "pinned_message": {"contact": {"user_id": 11}, "via_bot": {"id": 12, "is_bot": True}},
+        },
+    }
+
+    redacted = redact(update, b"salt")
+    message = redacted["message"]
+
+    assert message["text"] == "@someone look at my pug"
+    assert message["chat"]["type"] == "group"
+    assert message["chat"]["id"] < 0 and message["chat"]["id"] != -100
+    assert message["from"] == {
+        "id": message["reply_to_message"]["from"]["id"],
+        "is_bot": False,
+        "first_name": "Someone",
+    }
+    assert "Ann" not in str(redacted) and "ann" not in str(redacted)
+    assert message["new_chat_members"][0]["id"] not in (8, message["from"]["id"])
+    assert message["left_chat_member"]["id"] != 9
+    assert message["forward_origin"]["sender_user"]["id"] != 10
+    assert message["pinned_message"] == {
+        "via_bot": {"id": pseudonymize(12, b"salt"), "is_bot": True}
+    }
+    assert not {"Bob", "Cy", "Di"} & set(str(redacted).split("'"))
+    assert redact(update, b"other salt")["message"]["from"]["id"] != message["from"]["id"]
+
+
+async def test_update_recorder(tmp_path):
+    """
+    Unit test to verify that recorded updates can be read back, along with
+    the time they were received, even across recording sessions.
+    """
+
+    path = str(tmp_path / "updates.jsonl.gz")
+    now = [10.0]
+
+    for first_update_id in (1, 3):
+        recorder = UpdateRecorder(path, flush_every=1, clock=lambda: now[0])
+        for update_id in (first_update_id, first_update_id + 1):
+            recorder.record({"update_id": update_id})
+            now[0] += 1
+        recorder.close()
+        recorder.close()
+
+    recording = read_recording(path)
+    assert next(recording) == (10.0, {"update_id": 1})
+    assert [update["update_id"] for _, update in recording] == [2, 3, 4]
+
+
+async def test_update_recorder_keeps_pseudonyms_across_sessions(tmp_path):
+    """
+    Unit test to verify that a chat gets the same pseudonym when a recording
+    is closed and appended to again, but not on another recording.
+    """
+
+    def record_chat(path):
+        recorder = UpdateRecorder(path)
+        recorder.record({"update_id": 1, "message": {"chat": {"id": 42, "type": "group"}}})
+        recorder.close()
+        return [update["message"]["chat"]["id"] for _, update in read_recording(path)]
+
+    path = str(tmp_path / "updates.jsonl.gz")
+    first_id, second_id = record_chat(path)[0], record_chat(path)[-1]
+    assert first_id == second_id != 42
+    assert os.stat(path + ".salt").st_mode & 0o777 == 0o600
+
+    other_path = str(tmp_path / "other.jsonl.gz")
+    assert record_chat(other_path) != [first_id]
+
+
+async def test_bot_records_updates(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    """
+    Unit test to verify that the bot records incoming updates before
+    handling them, only if asked to.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    bot.startup()
+    assert bot.recorder is None
+    assert bot.application.update_processor.record is None
+
+    path = str(tmp_path / "updates.jsonl.gz")
+    monkeypatch.setenv("DPB_RECORD_UPDATES", path)
+    bot = get_mock_bot(monkeypatch)
+    bot.startup()
+    assert bot.application.update_processor.record is not None
+
+    class Update:  # pylint: disable=too-few-public-methods
+        """
+        Update that only knows how to turn itself into a dictionary.
+        """
+
+        def to_dict(self):
+            """
+            Returns the update as a dictionary.
+            """
+
+            return {"update_id": 5}
+
+    bot.application.update_processor.record(Update())
+    bot.close()
+
+    assert [update for _, update in read_recording(path)] == [{"update_id": 5}]
+
+    # Bots sharing resources append to a single recording
+    other_bot = DogPicsBot("123:OTHER", bot.resources)
+    assert other_bot.recorder is bot.recorder
+    bot.record_update(Update())
+    other_bot.record_update(Update())
+    bot.close()
+    other_bot.close()
+
+    assert len(list(read_recording(path))) == 3
+
+
+async def test_replay_recording(tmp_path):
+    """
+    Unit test to verify that a recording is replayed through the handlers
+    of the bot, against fake Telegram and upstream APIs.
+    """
+
+    path = str(tmp_path / "updates.jsonl.gz")
+    recorder = UpdateRecorder(path)
+    for update_id, text in enumerate(["I love dogs", "hello", "look a fox"]):
+        chat = {"id": -100, "type": "group", "title": "Dog lovers"}
+        message = {"message_id": update_id, "date": 0, "chat": chat, "text": text}
+        recorder.record({"update_id": update_id, "message": message})
+    recorder.close()
+
+    report = await benchmarks.replay_recording(path, realtime=True, speed=1000)
+
+    assert report["updates"] == 3
+    assert set(report["latency_ms"]) == {"p50", "p90", "p99", "max"}
+    assert report["telegram_requests"] == {"getMe": 1, "sendPhoto": 2}
+    assert report["upstream_requests"] == {"breeds": 1, "dog_picture": 1, "fox_picture": 1}
+
+
+@pytest.mark.parametrize(
+    "environment, expected_admin_ids",
+    [({"DPB_ADMIN_IDS": "1, 22,"}, {1, 22}), ({}, set())],
+)
+async def test_get_admin_ids(monkeypatch: pytest.MonkeyPatch, environment, expected_admin_ids):
+    """
+    Unit test to verify that bot admins are read from the environment.
+    """
+
+    monkeypatch.delenv("DPB_ADMIN_IDS", raising=False)
+    for name, value in environment.items():
+        monkeypatch.setenv(name, value)
+
+    assert get_admin_ids() == expected_admin_ids
+
+
+async def test_profiler(tmp_path):
+    """
+    Unit test to verify that profiles are written to disk and summarised
+    around the hot path of the bot.
+    """
+
+    profiler = Profiler(str(tmp_path))
+    profiler.start()
+    with pytest.raises(RuntimeError):
+        profiler.start()
+
+    load_trigger_matcher().match(["dogs"])
+    path, summary = profiler.stop()
+
+    assert not profiler.running
+    assert path.startswith(str(tmp_path)) and path.endswith(".prof")
+    assert "  match: 1, " in summary
+    assert "  send_picture: 0, 0.0, 0.0" in summary
+    assert "Top 10 functions by own time" in summary
+
+
+@pytest.mark.parametrize("filename, function", HOT_PATH_FUNCTIONS)
+async def test_hot_path_functions_exist(filename: str, function: str):
+    """
+    Unit test to verify that every function on the hot path summarised by
+    profiles is still defined within its module file.
+    """
+
+    with open(filename, encoding="utf-8") as module:
+        tree = ast.parse(module.read())
+
+    assert any(
+        isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == function
+        for node in ast.walk(tree)
+    )
+
+
+async def test_handle_profile_command(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    """
+    Unit test to verify that bot admins can profile the bot for a while,
+    while anyone else is ignored.
+    """
+
+    monkeypatch.setenv("DPB_PROFILE_DIR", str(tmp_path))
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update(chat_type="private")
+    context = get_mock_context(["0.05"])
+    context.application = MockApplication()
+
+    await bot.handle_profile_command(update, context)
+    assert not context.bot.messages and not PROFILER.running
+
+    monkeypatch.setenv("DPB_ADMIN_IDS", str(update.message.from_user.id))
+    await bot.handle_profile_command(update, context)
+    assert PROFILER.running
+    await bot.handle_profile_command(update, context)
+    await bot.handle_text_messages(get_mock_update(message="I love dogs"), context)
+    await context.application.tasks[0]
+
+    assert not PROFILER.running
+    messages = [message for _, message in context.bot.messages]
+    assert messages[:2] == ["Profiling for 0.05 seconds.", "A profile is already running."]
+    assert messages[2].startswith(f"Profile written to {tmp_path}")
+    assert "  handle_text_messages: 0, " not in messages[2]
+
+
+@pytest.mark.parametrize("seconds", ["nan", "inf", "-inf", "soon"])
+async def test_handle_profile_command_with_invalid_seconds(
+    monkeypatch: pytest.MonkeyPatch, tmp_path, seconds: str
+):
+    """
+    Unit test to verify that profiles asked for with invalid or non-finite
+    durations last the default amount of seconds.
+    """
+
+    monkeypatch.setenv("DPB_PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(Profiler, "DEFAULT_SECONDS", 0.01)
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update(chat_type="private")
+    context = get_mock_context([seconds])
+    context.application = MockApplication()
+    monkeypatch.setenv("DPB_ADMIN_IDS", str(update.message.from_user.id))
+
+    await bot.handle_profile_command(update, context)
+    await context.application.tasks[0]
+
+    assert context.bot.messages[0][1] == "Profiling for 0.01 seconds."
+
+
+async def test_profile_on_signal(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    """
+    Unit test to verify that the bot can be profiled on a signal.
+    """
+
+    monkeypatch.setenv("DPB_PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(Profiler, "DEFAULT_SECONDS", 0.01)
+    bot = get_mock_bot(monkeypatch)
+    bot.startup()
+
+    bot.profile_on_signal()
+    bot.profile_on_signal()
+    await asyncio.gather(*bot.application.tasks)
+
+    assert len(bot.application.tasks) == 1
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+@dataclass
+class MockPrioritizedUpdate:
+    """
+    Mocks the information of Telegram's Update class that update priorities
+    are based on.
+    """
+
+    effective_message: Optional[MockMessage] = None
+    inline_query: Optional[MockInlineQuery] = None
+
+
+@pytest.mark.parametrize(
+    "update, expected_priority",
+    [
+        (MockPrioritizedUpdate(inline_query=MockInlineQuery(query="pug")), COMMAND_PRIORITY),
+        (MockPrioritizedUpdate(get_mock_update(message="/dog").message), COMMAND_PRIORITY),
+        (MockPrioritizedUpdate(get_mock_update(message="/Dog@bot pug").message), COMMAND_PRIORITY),
+        (MockPrioritizedUpdate(get_mock_update(message="/spam").message), GROUP_CHAT_PRIORITY),
+        (MockPrioritizedUpdate(get_mock_update(message="/dog", chat_type="private").message), 0),
+        (MockPrioritizedUpdate(replace(get_mock_update(message="/dog").message, entities=())), 2),
+        (MockPrioritizedUpdate(get_mock_update(chat_type="private").message), 1),
+        (MockPrioritizedUpdate(get_mock_update(message="dogs").message), GROUP_CHAT_PRIORITY),
+        (MockPrioritizedUpdate(), PRIVATE_CHAT_PRIORITY),
+    ],
+)
+async def test_get_update_priority(update, expected_priority):
+    """
+    Unit test to verify that commands handled by the bot go first, and
+    group chats last.
+    """
+
+    assert get_update_priority(update, DogPicsBot.COMMANDS) == expected_priority
+
+
+async def test_priority_update_processor():
+    """
+    Unit test to verify that updates wait for their turn in order of
+    priority, and that the least important ones are dropped under overload.
+    """
+
+    processor = PriorityUpdateProcessor(max_running=1, max_waiting=2, commands=frozenset({"dog"}))
+    release = asyncio.Event()
+    handled = []
+
+    async def handle(name):
+        await release.wait()
+        handled.append(name)
+
+    def process(name, message):
+        update = MockPrioritizedUpdate(get_mock_update(message=message).message)
+        return asyncio.ensure_future(processor.process_update(update, handle(name)))
+
+    tasks = [
+        process("first group message", "dogs"),
+        process("second group message", "dogs"),
+        process("third group message", "dogs"),
+        process("command", "/dog"),
+    ]
+    await asyncio.sleep(0)
+    assert processor.waiting == 2
+
+    release.set()
+    await asyncio.gather(*tasks)
+
+    assert handled == ["first group message", "command", "second group message"]
+    assert processor.handled == 3
+    assert processor.dropped == {"group chats": 1}
+    assert processor.describe() == (
+        "Updates handled: 3\n"
+        "Updates waiting: 0\n"
+        "Updates dropped: commands: 0, private chats: 0, group chats: 1"
+    )
+
+
+async def test_priority_update_processor_records_dropped_updates():
+    """
+    Unit test to verify that every update is recorded as it arrives, even
+    if it is dropped afterwards.
+    """
+
+    recorded = []
+    processor = PriorityUpdateProcessor(max_running=1, max_waiting=1, record=recorded.append)
+    release = asyncio.Event()
+
+    updates = [MockPrioritizedUpdate(get_mock_update(message="dogs").message) for _ in range(3)]
+    tasks = [
+        asyncio.ensure_future(processor.process_update(update, release.wait()))
+        for update in updates
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(*tasks)
+
+    assert processor.dropped == {"group chats": 1}
+    assert recorded == updates
+
+
+async def test_priority_update_processor_with_cancelled_updates():
+    """
+    Unit test to verify that cancelling updates that wait for their turn
+    does not leak handling slots.
+    """
+
+    processor = PriorityUpdateProcessor(max_running=1, max_waiting=10)
+    release = asyncio.Event()
+
+    def process():
+        update = MockPrioritizedUpdate(get_mock_update().message)
+        return asyncio.ensure_future(processor.process_update(update, release.wait()))
+
+    running, waiting, woken = process(), process(), process()
+    await asyncio.sleep(0)
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    assert processor.waiting == 1
+
+    # the slot is handed over to the third update, which is cancelled
+    # before it gets to run
+    running.cancel()
+    await asyncio.sleep(0)
+    woken.cancel()
+    await asyncio.gather(running, woken, return_exceptions=True)
+
+    # updates cancelled while waiting are skipped when handing slots over
+    running, cancelled = process(), process()
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    running.cancel()
+    await asyncio.gather(running, cancelled, return_exceptions=True)
+
+    assert processor.waiting == 0
+    release.set()
+    await asyncio.wait_for(processor.process_update(MockPrioritizedUpdate(), release.wait()), 1)
+    assert processor.handled == 3
+
+
+async def test_show_stats(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that bot admins can see how many updates the bot
+    handled and dropped, while anyone else is ignored.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    bot.startup()
+    update = get_mock_update()
+    context = get_mock_context()
+    context.application = bot.application
+
+    await bot.show_stats(update, context)
+    assert not context.bot.messages
+
+    monkeypatch.setenv("DPB_ADMIN_IDS", str(update.message.from_user.id))
+    await bot.show_stats(update, context)
+    _, sent_message = context.bot.messages[0]
+    assert sent_message.startswith("Updates handled: 0")
+
+
+async def test_image_validator():
+    """
+    Unit test to verify that picture URLs are checked once in a while, with
+    bounded concurrency, and that dead ones are remembered.
+    """
+
+    now = [0.0]
+    checked = []
+    running = [0, 0]  # currently, at most
+
+    def check_url(url):
+        running[0] += 1
+        running[1] = max(running)
+        time.sleep(0.01)
+        checked.append(url)
+        running[0] -= 1
+        return "dead" not in url
+
+    validator = ImageValidator(check_url, max_concurrent_checks=2, ttl=60, clock=lambda: now[0])
+    urls = ["https://dog.pics/dead.png"] + [f"https://dog.pics/dog{i}.png" for i in range(5)]
+
+    assert await validator.find_dead(urls) == ["https://dog.pics/dead.png"]
+    assert await validator.find_dead(urls) == ["https://dog.pics/dead.png"]
+    assert len(checked) == 6
+    assert running[1] <= 2
+
+    validator.mark_dead("https://dog.pics/dog0.png")
+    assert validator.is_dead("https://dog.pics/dog0.png")
+    assert not validator.is_dead("https://dog.pics/unknown.png")
+
+    now[0] = 61.0
+    assert not validator.is_dead("https://dog.pics/dead.png")
+    assert await validator.find_dead(urls[:1]) == ["https://dog.pics/dead.png"]
+    assert len(checked) == 7
+
+
+async def test_image_pool_evicts_dead_pictures():
+    """
+    Unit test to verify that pooled pictures are validated in the background,
+    and that dead ones are evicted from the pool.
+    """
+
+    def fetch_batch(breed, count):
+        return [
+            f"https://dog.pics/{breed}/{'dead' if i % 2 else 'dog'}{i}.png" for i in range(count)
+        ]
+
+    validator = ImageValidator(lambda url: "dead" not in url)
+    image_pool = ImagePool(fetch_batch, batch_size=4, validator=validator)
+
+    await image_pool.prewarm([None, "pug"])
+    assert len(image_pool) == 8
+    await asyncio.sleep(0.1)
+
+    assert len(image_pool) == 4
+    assert await image_pool.get("pug") == [
+        "https://dog.pics/pug/dog0.png",
+        "https://dog.pics/pug/dog2.png",
+    ]
+
+    image_pool.evict(["https://dog.pics/pug/dog0.png", "https://dog.pics/pug/dog2.png"])
+    assert not image_pool.is_fresh("pug")
+    assert len(image_pool) == 2
+
+
+@pytest.mark.parametrize(
+    "status_code, expected_reachable",
+    [(200, True), (403, True), (405, True), (429, True), (503, True), (404, False), (410, False)],
+)
+async def test_upstream_client_checks_pictures(
+    monkeypatch: pytest.MonkeyPatch, status_code, expected_reachable
+):
+    """
+    Unit test to verify that pictures are checked through HEAD requests.
+    """
+
+    monkeypatch.setattr(
+        "requests.Session.head",
+        lambda _session, url, timeout, allow_redirects: MockResponse(url, timeout, status_code),
+    )
+
+    assert UpstreamClient().is_reachable("https://dog.pics/dog.png") == expected_reachable
+
+
+async def test_upstream_client_ignores_empty_base_urls(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that empty base URLs on the environment (as on
+    .env.sample) fall back to the real APIs.
+    """
+
+    monkeypatch.setenv("DPB_DOG_API_URL", "")
+    monkeypatch.setenv("DPB_RANDOMFOX_URL", "")
+
+    client = UpstreamClient()
+
+    assert (client.dogs_api_url, client.randomfox_url) == (DOGS_API_URL, RANDOMFOX_URL)
+
+
+async def test_upstream_client_gives_unreachable_pictures_the_benefit_of_the_doubt(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    """
+    Unit test to verify that pictures are not deemed dead on network errors.
+    """
+
+    def head(_session, url, timeout, allow_redirects):
+        raise requests.ConnectionError(url)
+
+    monkeypatch.setattr("requests.Session.head", head)
+
+    assert UpstreamClient().is_reachable("https://dog.pics/dog.png")
+
+
+async def test_send_dog_picture_retries_with_a_pooled_picture(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that a dog picture that Telegram can't send is
+    replaced (once) by a pooled picture, and remembered as dead.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update(chat_type="private")
+    context = get_mock_context()
+    context.bot.failing_photos.append("https://dog.pics/dog.png")
+
+    await bot.handle_text_messages(update, context)
+
+    _, _, photo_url, _ = context.bot.photos[0]
+    assert photo_url.startswith("https://dog.pics/dog") and photo_url != "https://dog.pics/dog.png"
+    assert bot.resources.validator.is_dead("https://dog.pics/dog.png")
+
+    # known dead pictures are replaced before trying to send them
+    context.bot.failing_photos.clear()
+    await bot.handle_text_messages(update, context)
+    _, _, photo_url, _ = context.bot.photos[1]
+    assert photo_url != "https://dog.pics/dog.png"
+
+
+async def test_send_picture_retries_only_once(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that sending a picture is retried at most once, and
+    only if there is a way to replace it.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update()
+    context = get_mock_context()
+    context.bot.failing_photos.extend(["https://fox.pics/fox.png", WOLF_PICTURES[0]])
+
+    with pytest.raises(BadRequest):
+        await bot.send_fox_picture(update, context)
+
+    with pytest.raises(BadRequest):
+        await bot.send_picture(update, context, WOLF_PICTURES[0], "Howl!")
+
+    async def no_replacement(_dead_url):
+        return None
+
+    with pytest.raises(BadRequest):
+        await bot.send_picture(update, context, WOLF_PICTURES[0], "Howl!", no_replacement)
+
+    assert not context.bot.photos
+
+
+async def test_send_picture_only_retries_picture_errors(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that errors unrelated to the picture (e.g. the
+    message to reply to being gone) don't mark it as dead nor retry it.
+    """
+
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update()
+    context = get_mock_context()
+    context.bot.failing_photos.append("https://dog.pics/dog.png")
+    context.bot.photo_error = "Message to be replied not found"
+
+    async def replacement(_dead_url):
+        return "https://dog.pics/other.png"
+
+    with pytest.raises(BadRequest):
+        await bot.send_picture(update, context, "https://dog.pics/dog.png", "Woof!", replacement)
+
+    assert not context.bot.photos
+    assert not bot.resources.validator.is_dead("https://dog.pics/dog.png")
+
+
+def build_test_bundle(directory) -> dict:
+    """
+    Helper function that builds an asset bundle out of made-up pictures,
+    leaving out one that can't be downloaded.
+    """
+
+    def fetch(url):
+        if url.endswith("wolf2.png"):
+            raise requests.ConnectionError("gone")
+        return url.encode()
+
+    sources = {"fox": ["https://fox.pics/1.jpg"], "wolf": WOLF_PICTURES[:2]}
+    return build_bundle(str(directory), sources, fetch)
+
+
+def test_build_bundle(tmp_path):
+    """
+    Unit test to verify that the build step stores the pictures it can
+    download along with a manifest, and that bundles are read back from it.
+    """
+
+    manifest = build_test_bundle(tmp_path)
+    assert manifest == {"fox": ["fox/00.jpg"], "wolf": ["wolf/00.jpg"]}
+
+    bundle = AssetBundle(str(tmp_path))
+    assert bundle.pictures("wolf") == ["wolf/00.jpg"]
+    assert bundle.read("wolf/00.jpg") == WOLF_PICTURES[0].encode()
+    assert not AssetBundle(str(tmp_path / "missing")).pictures("wolf")
+
+
+async def test_bundled_pictures_are_uploaded_once(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    """
+    Unit test to verify that bundled fox and wolf pictures are sent without
+    reaching the upstream APIs, uploaded the first time and then sent by
+    their recorded file ID, also after a restart.
+    """
+
+    build_test_bundle(tmp_path)
+    monkeypatch.setenv("DPB_ASSETS_DIR", str(tmp_path))
+    bot = get_mock_bot(monkeypatch)
+    update = get_mock_update()
+    context = get_mock_context()
+
+    await bot.send_wolf_picture(update, context)
+    await bot.send_wolf_picture(update, context)
+    await bot.send_fox_picture(update, context)
+
+    photos = [photo for _, _, photo, _ in context.bot.photos]
+    assert photos == [WOLF_PICTURES[0].encode(), "file-1", b"https://fox.pics/1.jpg"]
+    assert context.bot.photos[0][3] == "Howl!"
+    assert context.bot.photos[2][3] in FOX_SOUNDS
+
+    restarted_bundle = AssetBundle(str(tmp_path))
+    assert restarted_bundle.file_id(bot.chat_settings.namespace, "fox/00.jpg") == "file-3"
+    assert restarted_bundle.file_id("another bot", "fox/00.jpg") is None
+
+
+async def test_asset_bundle_upload(tmp_path):
+    """
+    Unit test to verify that bundled pictures can be uploaded ahead of time
+    to a chat, and that they are uploaded again if their file ID stops
+    working.
+    """
+
+    build_test_bundle(tmp_path)
+    bundle = AssetBundle(str(tmp_path))
+    telegram_bot = MockContextBot()
+
+    assert await bundle.upload(telegram_bot, "bot", chat_id=42) == 2
+    assert telegram_bot.deleted == [(42, 1), (42, 2)]
+    assert await bundle.upload(telegram_bot, "bot", chat_id=42) == 0
+
+    telegram_bot.failing_photos.append("file-2")
+    telegram_bot.photo_error = "Message to be replied not found"
+    with pytest.raises(BadRequest):
+        await bundle.send_picture(telegram_bot, "bot", "wolf/00.jpg", chat_id=1)
+    assert bundle.file_id("bot", "wolf/00.jpg") == "file-2"
+
+    telegram_bot.photo_error = "Wrong file identifier/HTTP URL specified"
+    message = await bundle.send_picture(telegram_bot, "bot", "wolf/00.jpg", chat_id=1)
+    assert telegram_bot.photos[-1][2] == WOLF_PICTURES[0].encode()
+    assert bundle.file_id("bot", "wolf/00.jpg") == message.photo[-1].file_id == "file-3"
+
+
+def test_assets_main(monkeypatch: pytest.MonkeyPatch, tmp_path, capsys):
+    """
+    Unit test to verify that the build step can be run from the command line.
+    """
+
+    def mock_get(url, timeout):
+        return MockResponse(url=url, timeout=timeout)
+
+    monkeypatch.setattr("requests.get", mock_get)
+    assets.main(["build", "--directory", str(tmp_path)])
+
+    assert "wolf: 9 pictures bundled" in capsys.readouterr().out
+    assert len(AssetBundle(str(tmp_path)).pictures("fox")) == 24
+
+
+async def wait_until(condition: Callable[[], bool], timeout: float = 5.0):
+    """
+    Helper function that waits (without blocking the event loop) until the
+    given condition holds, failing the test if it takes too long.
+    """
+
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out waiting for the condition"
+        await asyncio.sleep(0.01)
+
+
+async def test_live_bot_replies_through_fake_servers(
+    live_bot: DogPicsBot,
+    fake_telegram_server: FakeTelegramServer,
+    fake_upstream_server: FakeUpstreamServer,
+):
+    """
+    Unit test to verify, end to end, that a running bot polls updates from
+    the fake Bot API and replies with pictures from the fake Dog API.
+    """
+
+    await start_application(live_bot.application)
+    try:
+        fake_telegram_server.push_message(42, "/dog pug")
+        fake_telegram_server.push_message(42, "/dog 3")
+        await wait_until(lambda: fake_telegram_server.api.calls["sendMediaGroup"] == 1)
+        await wait_until(lambda: fake_telegram_server.api.calls["sendPhoto"] == 1)
+    finally:
+        await stop_application(live_bot.application)
+
+    (photo,) = fake_telegram_server.sent("sendPhoto")
+    assert photo["chat_id"] == "42"
+    assert photo["photo"].startswith(f"{fake_upstream_server.url}/images/pug/")
+    assert fake_upstream_server.requests["breeds"] == 1
+    assert fake_upstream_server.requests["dog_pictures"] >= 1
+
+
+async def test_live_bot_uploads_bundled_pictures(
+    monkeypatch: pytest.MonkeyPatch, tmp_path, fake_telegram_server: FakeTelegramServer
+):
+    """
+    Unit test to verify, end to end, that bundled pictures are uploaded to
+    the fake Bot API and then sent by the file ID it returned.
+    """
+
+    build_test_bundle(tmp_path)
+    monkeypatch.setenv("DPB_ASSETS_DIR", str(tmp_path))
+    monkeypatch.setenv("DPB_TG_TOKEN", "123456:LIVE")
+    monkeypatch.setenv("DPB_TG_API_URL", fake_telegram_server.url)
+    monkeypatch.setattr("requests.Session.get", mock_session_get)
+
+    bot = DogPicsBot()
+    bot.startup()
+    await start_application(bot.application)
+    try:
+        fake_telegram_server.push_message(7, "wolf")
+        await wait_until(lambda: bot.resources.assets.file_id("123456", "wolf/00.jpg"))
+        fake_telegram_server.push_message(7, "wolf")
+        await wait_until(lambda: fake_telegram_server.api.calls["sendPhoto"] == 2)
+    finally:
+        await stop_application(bot.application)
+
+    uploaded, resent = fake_telegram_server.sent("sendPhoto")
+    assert uploaded["photo"] == WOLF_PICTURES[0].encode()
+    assert resent["photo"] == "fake-file-1"
+
+
+def test_fake_upstream_server_reuses_connections_and_injects_errors(
+    fake_upstream_server: FakeUpstreamServer,
+):
+    """
+    Unit test to verify that the upstream client keeps its connection to
+    the fake upstream server alive, and that the server can be told to
+    fail requests and to answer slowly.
+    """
+
+    client = UpstreamClient(
+        dogs_api_url=fake_upstream_server.dogs_api_url,
+        randomfox_url=fake_upstream_server.randomfox_url,
+    )
+    assert client.fetch_breeds() == ["pug", "collie", "dalmatian"]
+    assert client.fetch_fox_picture().endswith("/images/fox/0.jpg")
+    assert len(client.fetch_dog_pictures("pug", 3)) == 3
+    assert client.is_reachable(client.fetch_dog_picture())
+    assert not client.is_reachable(f"{fake_upstream_server.url}/images/dead.jpg")
+    assert fake_upstream_server.connections == 1
+
+    fake_upstream_server.fail(status=503)
+    with pytest.raises(KeyError):
+        client.fetch_breeds()
+    assert fake_upstream_server.errors == 1
+
+    fake_upstream_server.latency = 0.05
+    started_at = time.perf_counter()
+    client.fetch_breeds()
+    assert time.perf_counter() - started_at >= 0.05
+
+
+def test_fake_server_error_rate():
+    """
+    Unit test to verify that fake servers fail a seeded share of requests.
+    """
+
+    with FakeUpstreamServer(["pug"], error_rate=0.5, seed=1) as server:
+        session = requests.Session()
+        statuses = [session.get(f"{server.url}/api/breeds/list/all").status_code for _ in range(40)]
+        session.close()
+
+    assert 0 < statuses.count(500) == server.errors < 40
+
+
+def test_request_settings_from_environment(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that the settings of the Bot API clients are read
+    from the environment, separately for sending and for polling, and that
+    invalid settings are rejected.
+    """
+
+    monkeypatch.setenv("DPB_TG_POOL_SIZE", "64")
+    monkeypatch.setenv("DPB_TG_POOL_TIMEOUT", "2.5")
+    monkeypatch.setenv("DPB_TG_KEEPALIVE_EXPIRY", "60")
+    monkeypatch.setenv("DPB_TG_UPDATES_READ_TIMEOUT", "7")
+
+    settings = get_request_settings()
+    assert (settings.pool_size, settings.pool_timeout, settings.keepalive_expiry) == (64, 2.5, 60)
+    assert settings.read_timeout == RequestSettings.read_timeout
+
+    updates_settings = get_updates_request_settings()
+    assert (updates_settings.pool_size, updates_settings.read_timeout) == (1, 7)
+
+    for name, value in (
+        ("DPB_TG_POOL_SIZE", "many"),
+        ("DPB_TG_POOL_SIZE", "0"),
+        ("DPB_TG_HTTP_VERSION", "3"),
+        ("DPB_TG_KEEPALIVE_CONNECTIONS", "-1"),
+        ("DPB_TG_READ_TIMEOUT", "-5"),
+    ):
+        with monkeypatch.context() as context:
+            context.setenv(name, value)
+            with pytest.raises(ValueError):
+                get_request_settings()
+
+
+def test_request_settings_build_request(monkeypatch: pytest.MonkeyPatch):
+    """
+    Unit test to verify that request objects are built with the given
+    settings, falling back to HTTP/1.1 when HTTP/2 is not installed, and
+    that bots use them for both sending messages and polling.
+    """
+
+    settings = RequestSettings(pool_size=8, read_timeout=3, http_version="2")
+    monkeypatch.setattr("importlib.util.find_spec", lambda name: None)
+    assert settings.effective_http_version == "1.1"
+
+    request = settings.build_request()
+    assert isinstance(request, HTTPXRequest)
+    assert request.read_timeout == 3
+
+    monkeypatch.undo()
+    monkeypatch.setenv("DPB_TG_READ_TIMEOUT", "4")
+    bot = get_mock_bot(monkeypatch)
+    bot.build_application()
+    request, updates_request = bot.application.requests
+    assert request.read_timeout == 4
+    assert updates_request is not request
+
+    # custom request objects are only used to send messages
+    custom_request = settings.build_request()
+    bot.build_application(custom_request)
+    request, updates_request = bot.application.requests
+    assert request is custom_request
+    assert isinstance(updates_request, HTTPXRequest) and updates_request is not custom_request
+
+
+async def test_send_concurrently(fake_telegram_server: FakeTelegramServer):
+    """
+    Unit test to verify that the concurrency benchmark sends pictures at
+    the same time through a pool of connections to the fake Bot API.
+    """
+
+    report = await benchmarks.send_concurrently(
+        RequestSettings(pool_size=4), fake_telegram_server.url, sends=20
+    )
+
+    assert report["timeouts"] == 0
+    assert report["sends_per_second"] > 0
+    assert fake_telegram_server.api.calls["sendPhoto"] == 20
+    assert 1 <= fake_telegram_server.connections <= 4
+
+
+async def test_pool_timeout_bounds_the_wait_for_a_connection():
+    """
+    Unit test to verify that sends time out once they waited longer than
+    the pool timeout for a connection, even if connections are freed (and
+    taken by other sends) in the meantime.
+    """
+
+    settings = RequestSettings(pool_size=1, pool_timeout=0.1)
+    with FakeTelegramServer(latency=0.04) as server:
+        report = await benchmarks.send_concurrently(settings, server.url, sends=10)
+
+    assert 0 < report["timeouts"] < 10
+    assert server.api.calls["sendPhoto"] == 10 - report["timeouts"]
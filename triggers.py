@@ -0,0 +1,226 @@
+"""
+Trigger matching for the DogPicsBot.
+
+Triggers are compiled once into lookup tables, so that checking a message
+(or a sticker) against every trigger costs a handful of dictionary and set
+lookups instead of a scan over every trigger.
+
+Triggers come in packs (e.g. one per language), which are JSON files (or
+YAML files, if PyYAML is installed) with the triggers of each category:
+
+    {"name": "English", "triggers": {"dog": ["dog", "pup"], "sad": ["sad"]}}
+
+Triggers are matched as prefixes of words, so variations are not required
+if their radix is present (e.g. "pup" covers "puppy" and "pupper" too).
+The packs within the `triggerpacks` directory are always loaded, along
+with those found on the comma-separated DPB_TRIGGER_PACKS locations (files
+or directories).
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import functools
+import importlib
+import json
+import os
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+# Categories of triggers, in order of precedence
+TRIGGER_CATEGORIES: Tuple[str, ...] = ("fox", "wolf", "sad", "dog")
+
+# Trigger packs that are always loaded, shipped along with the bot
+BUILTIN_TRIGGER_PACKS: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "triggerpacks"
+)
+
+TRIGGER_PACK_EXTENSIONS: Tuple[str, ...] = (".json", ".yaml", ".yml")
+
+# Codepoints that only change how an emoji is rendered (text or emoji
+# presentation), and are stripped before looking emojis up
+EMOJI_VARIATION_SELECTORS: FrozenSet[str] = frozenset({"\ufe0e", "\ufe0f"})
+
+
+def is_emoji_trigger(trigger: str) -> bool:
+    """
+    Checks whether a trigger is an emoji (as opposed to a word).
+    """
+
+    return not any(character.isalnum() for character in trigger)
+
+
+def strip_variation_selectors(text: str) -> str:
+    """
+    Returns the given text without emoji variation selectors.
+    """
+
+    return "".join(c for c in text if c not in EMOJI_VARIATION_SELECTORS)
+
+
+class TriggerMatcher:
+    """
+    Matches words and emojis against several categories of triggers
+    (e.g. "dog" or "fox" triggers).
+
+    A word matches a trigger if it starts with it, so every trigger is
+    indexed as a prefix, and a word is checked by looking up its prefixes
+    of the (few) distinct trigger lengths. Emojis are additionally indexed
+    by codepoint, so that an emoji (including multi-codepoint sequences
+    such as 🐕‍🦺) is classified through a set intersection.
+
+    Categories are given in order of precedence: when something matches
+    several categories, the first one wins.
+    """
+
+    __slots__ = (
+        "categories",
+        "prefixes",
+        "prefix_lengths",
+        "emoji_codepoints",
+        "emoji_index",
+        "emoji_sequences",
+    )
+
+    def __init__(self, triggers: Sequence[Tuple[str, Iterable[str]]]):
+        self.categories: Tuple[str, ...] = tuple(category for category, _ in triggers)
+
+        prefixes: Dict[str, set] = {}
+        emoji_codepoints: Dict[str, str] = {}
+        emoji_sequences = []
+
+        # iterating in reverse order of precedence, so that categories with
+        # more precedence overwrite the rest
+        for category, category_triggers in reversed(triggers):
+            for trigger in category_triggers:
+                prefixes.setdefault(trigger, set()).add(category)
+
+                if is_emoji_trigger(trigger):
+                    emoji = strip_variation_selectors(trigger)
+                    if len(emoji) == 1:
+                        emoji_codepoints[emoji] = category
+                    else:
+                        emoji_sequences.insert(0, (emoji, category))
+
+        self.prefixes: Dict[str, FrozenSet[str]] = {
+            prefix: frozenset(categories) for prefix, categories in prefixes.items()
+        }
+        self.prefix_lengths: Tuple[int, ...] = tuple(sorted({len(p) for p in self.prefixes}))
+        self.emoji_codepoints: Dict[str, str] = emoji_codepoints
+        self.emoji_index: FrozenSet[str] = frozenset(emoji_codepoints)
+        self.emoji_sequences: Tuple[Tuple[str, str], ...] = tuple(emoji_sequences)
+
+    def match(self, words: Iterable[str]) -> FrozenSet[str]:
+        """
+        Returns the categories of every trigger that any of the given
+        words starts with.
+        """
+
+        matches = set()
+        for word in words:
+            for length in self.prefix_lengths:
+                if length > len(word):
+                    break
+
+                categories = self.prefixes.get(word[:length])
+                if categories is not None:
+                    matches |= categories
+
+        return frozenset(matches)
+
+    def classify_emoji(self, emoji: str) -> Optional[str]:
+        """
+        Returns the category with the most precedence among the emoji
+        triggers contained in the given emoji, if any.
+        """
+
+        emoji = strip_variation_selectors(emoji)
+
+        for sequence, category in self.emoji_sequences:
+            if sequence in emoji:
+                return category
+
+        found = self.emoji_index.intersection(emoji)
+        if not found:
+            return None
+
+        categories = {self.emoji_codepoints[codepoint] for codepoint in found}
+        return next(c for c in self.categories if c in categories)
+
+
+def read_trigger_pack(path: str) -> Dict[str, List[str]]:
+    """
+    Reads a trigger pack and returns its (lowercase) triggers by category.
+    Raises a ValueError if the pack is not valid.
+    """
+
+    with open(path, encoding="utf-8") as file:
+        if path.endswith(".json"):
+            pack = json.load(file)
+        else:
+            pack = importlib.import_module("yaml").safe_load(file)
+
+    triggers = pack.get("triggers") if isinstance(pack, dict) else None
+    if not isinstance(triggers, dict):
+        raise ValueError(f"{path}: a trigger pack needs triggers by category.")
+
+    unknown = set(triggers) - set(TRIGGER_CATEGORIES)
+    if unknown:
+        raise ValueError(f"{path}: unknown trigger categories: {', '.join(sorted(unknown))}.")
+
+    for category_triggers in triggers.values():
+        if not isinstance(category_triggers, list) or not all(
+            isinstance(trigger, str) and trigger.strip() for trigger in category_triggers
+        ):
+            raise ValueError(f"{path}: triggers must be lists of non-empty strings.")
+
+    return {
+        category: [trigger.strip().lower() for trigger in category_triggers]
+        for category, category_triggers in triggers.items()
+    }
+
+
+def find_trigger_packs(locations: Iterable[str]) -> List[str]:
+    """
+    Returns the paths of the trigger packs at the given locations, which
+    are either packs or directories of packs (sorted by name).
+    """
+
+    paths = []
+    for location in locations:
+        if os.path.isdir(location):
+            names = sorted(os.listdir(location))
+            paths.extend(
+                os.path.join(location, name)
+                for name in names
+                if name.endswith(TRIGGER_PACK_EXTENSIONS)
+            )
+        else:
+            paths.append(location)
+
+    return paths
+
+
+def get_trigger_pack_locations() -> Tuple[str, ...]:
+    """
+    Returns the locations of the trigger packs to load: the built-in ones,
+    and those on the comma-separated DPB_TRIGGER_PACKS environment variable.
+    """
+
+    extra_locations = os.environ.get("DPB_TRIGGER_PACKS", "").split(",")
+    return (BUILTIN_TRIGGER_PACKS,) + tuple(
+        location.strip() for location in extra_locations if location.strip()
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def load_trigger_matcher(locations: Tuple[str, ...] = (BUILTIN_TRIGGER_PACKS,)) -> TriggerMatcher:
+    """
+    Compiles the trigger packs at the given locations into a single
+    matcher. Matchers are built once per set of locations, and shared.
+    """
+
+    triggers: Dict[str, List[str]] = {category: [] for category in TRIGGER_CATEGORIES}
+    for path in find_trigger_packs(locations):
+        for category, category_triggers in read_trigger_pack(path).items():
+            triggers[category].extend(category_triggers)
+
+    return TriggerMatcher(tuple(triggers.items()))
@@ -0,0 +1,138 @@
+"""
+Client for the upstream picture APIs used by the DogPicsBot: the Dog API
+(https://dog.ceo/dog-api/) and RandomFox (https://randomfox.ca/).
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import importlib
+import os
+from typing import FrozenSet, List, Optional
+
+# Base URLs of the upstream APIs, which can be overridden through the
+# DPB_DOG_API_URL and DPB_RANDOMFOX_URL environment variables (e.g. to talk
+# to fake servers)
+DOGS_API_URL: str = "https://dog.ceo/api"
+RANDOMFOX_URL: str = "https://randomfox.ca"
+
+DOGS_API_DOG_PICTURE_PATH: str = "/breeds/image/random"
+DOGS_API_SPECIFIC_BREED_DOG_PICTURE_PATH: str = "/breed/{0}/images/random"
+DOGS_API_BREED_LIST_PATH: str = "/breeds/list/all"
+DOGS_API_DOG_PICTURES_PATH: str = "/breeds/image/random/{0}"
+DOGS_API_SPECIFIC_BREED_DOG_PICTURES_PATH: str = "/breed/{0}/images/random/{1}"
+RANDOMFOX_API_PATH: str = "/floof/"
+
+DOGS_API_DOG_PICTURE_URL: str = DOGS_API_URL + DOGS_API_DOG_PICTURE_PATH
+DOGS_API_SPECIFIC_BREED_DOG_PICTURE_URL: str = (
+    DOGS_API_URL + DOGS_API_SPECIFIC_BREED_DOG_PICTURE_PATH
+)
+DOGS_API_BREED_LIST_URL: str = DOGS_API_URL + DOGS_API_BREED_LIST_PATH
+DOGS_API_DOG_PICTURES_URL: str = DOGS_API_URL + DOGS_API_DOG_PICTURES_PATH
+DOGS_API_SPECIFIC_BREED_DOG_PICTURES_URL: str = (
+    DOGS_API_URL + DOGS_API_SPECIFIC_BREED_DOG_PICTURES_PATH
+)
+
+RANDOMFOX_API_URL: str = RANDOMFOX_URL + RANDOMFOX_API_PATH
+
+# Statuses that mean a picture is gone for good
+DEAD_STATUS_CODES: FrozenSet[int] = frozenset({404, 410})
+
+
+class UpstreamClient:
+    """
+    Fetches picture URLs from the upstream APIs. Every request goes through
+    a single HTTP session, so connections are pooled and kept alive; the
+    session (and `requests` itself) is only created on first use, unless
+    one is given (e.g. to talk to fake servers).
+
+    Base URLs are read from the environment unless given.
+    """
+
+    __slots__ = ("timeout", "dogs_api_url", "randomfox_url", "_session")
+
+    def __init__(
+        self,
+        timeout: float = 10,
+        session=None,
+        dogs_api_url: Optional[str] = None,
+        randomfox_url: Optional[str] = None,
+    ):
+        self.timeout = timeout  # in seconds
+        # empty variables (e.g. copied from .env.sample) mean the defaults
+        self.dogs_api_url = dogs_api_url or os.environ.get("DPB_DOG_API_URL") or DOGS_API_URL
+        self.randomfox_url = randomfox_url or os.environ.get("DPB_RANDOMFOX_URL") or RANDOMFOX_URL
+        self._session = session
+
+    @property
+    def session(self):
+        """
+        The HTTP session shared by every request of this client.
+        """
+
+        if self._session is None:
+            self._session = importlib.import_module("requests").Session()
+
+        return self._session
+
+    def get_json(self, url: str):
+        """
+        Sends a GET request to the given URL and returns its JSON body.
+        """
+
+        response = self.session.get(url=url, timeout=self.timeout)
+        return response.json()
+
+    def fetch_breeds(self) -> List[str]:
+        """
+        Fetches the list of searchable breeds from the Dog API.
+        """
+
+        return list(self.get_json(self.dogs_api_url + DOGS_API_BREED_LIST_PATH)["message"])
+
+    def fetch_dog_picture(self, breed: Optional[str] = None) -> str:
+        """
+        Fetches the URL of a random dog picture (of a given breed, if any)
+        from the Dog API.
+        """
+
+        path = (
+            DOGS_API_DOG_PICTURE_PATH
+            if breed is None
+            else DOGS_API_SPECIFIC_BREED_DOG_PICTURE_PATH.format(breed)
+        )
+        return self.get_json(self.dogs_api_url + path)["message"]
+
+    def fetch_dog_pictures(self, breed: Optional[str] = None, count: int = 1) -> List[str]:
+        """
+        Fetches the URLs of `count` random dog pictures (of a given breed,
+        if any) from the Dog API, through a single request.
+        """
+
+        path = (
+            DOGS_API_DOG_PICTURES_PATH.format(count)
+            if breed is None
+            else DOGS_API_SPECIFIC_BREED_DOG_PICTURES_PATH.format(breed, count)
+        )
+        return list(self.get_json(self.dogs_api_url + path)["message"])
+
+    def fetch_fox_picture(self) -> str:
+        """
+        Fetches the URL of a random fox picture from the RandomFox API.
+        """
+
+        return self.get_json(self.randomfox_url + RANDOMFOX_API_PATH)["image"]
+
+    def is_reachable(self, url: str) -> bool:
+        """
+        Checks whether a picture can still be downloaded from the given URL,
+        through a HEAD request. Errors other than the picture being gone
+        (e.g. timeouts, rate limits or servers rejecting HEAD requests) give
+        the URL the benefit of the doubt.
+        """
+
+        try:
+            response = self.session.head(url=url, timeout=self.timeout, allow_redirects=True)
+        except importlib.import_module("requests").RequestException:
+            return True
+
+        return response.status_code not in DEAD_STATUS_CODES
@@ -0,0 +1,79 @@
+"""
+Validation of picture URLs for the DogPicsBot, so that dead pictures are
+found (and dropped) before Telegram is asked to send them.
+
+@author Andrés Ignacio Torres <dev@aitorres.com>
+"""
+
+import asyncio
+import time
+from typing import Callable, Iterable, List
+
+from cache import LRUCache
+
+# A blocking callable that, given a picture URL, checks whether it can
+# still be downloaded (e.g. through a HEAD request)
+URLChecker = Callable[[str], bool]
+
+
+class ImageValidator:
+    """
+    Checks picture URLs in the background, running up to
+    `max_concurrent_checks` checks at the same time, and remembers the
+    outcome of every check for `ttl` seconds (for up to `max_urls` URLs).
+    """
+
+    __slots__ = ("check_url", "ttl", "clock", "_results", "_semaphore")
+
+    def __init__(
+        self,
+        check_url: URLChecker,
+        max_concurrent_checks: int = 4,
+        ttl: float = 3600.0,
+        max_urls: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.check_url = check_url
+        self.ttl = ttl
+        self.clock = clock
+
+        # url -> (checked_at, alive)
+        self._results = LRUCache(max_urls)
+        self._semaphore = asyncio.Semaphore(max_concurrent_checks)
+
+    def is_dead(self, url: str) -> bool:
+        """
+        Checks whether the given URL was found to be dead recently.
+        """
+
+        if url not in self._results:
+            return False
+
+        checked_at, alive = self._results[url]
+        return not alive and self.clock() - checked_at < self.ttl
+
+    def mark_dead(self, url: str):
+        """
+        Records that the given URL is dead (e.g. because Telegram could not
+        send it), without checking it.
+        """
+
+        self._results[url] = (self.clock(), False)
+
+    async def find_dead(self, urls: Iterable[str]) -> List[str]:
+        """
+        Checks the given URLs, unless they were checked recently, and
+        returns the ones that are dead.
+        """
+
+        urls = list(urls)
+        await asyncio.gather(*(self._check(url) for url in urls if not self._is_known(url)))
+        return [url for url in urls if self.is_dead(url)]
+
+    def _is_known(self, url: str) -> bool:
+        return url in self._results and self.clock() - self._results[url][0] < self.ttl
+
+    async def _check(self, url: str):
+        async with self._semaphore:
+            alive = await asyncio.to_thread(self.check_url, url)
+        self._results[url] = (self.clock(), alive)